@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# Memory behaviour of the steady-state processing of one pack: _processJSONBMSData (extract,
+# control, alarms, publish) is fed decoded documents of the simulator battery model, without
+# HTTP, so only what the service itself allocates is measured. Reported with tracemalloc:
+#   peak B/cycle   transient memory allocated within one cycle (median and max)
+#   retained B     memory still held after all cycles compared to after the warm-up (RSS growth)
+#   gc             generation 0 collections, a sign of container objects created per cycle
+#
+#   python3 bench/bench_alloc.py [cycles] [number of cells]
+
+import gc
+import sys
+import logging
+import tracemalloc
+from array import array
+
+import standins
+import simulator
+from bench_update import makeConfig, percentile
+
+
+def main():
+  cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  cells = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+  logging.basicConfig(level=logging.CRITICAL + 1)
+  module = standins.loadService(makeConfig(0, 'realistic', cells))
+  service = module.DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+  # documents are made up front, the model itself allocates a lot
+  model = simulator.BatteryModel(cells)
+  documents = [model.step() for i in range(1000)]
+  for document in documents[:100]:
+    service._processJSONBMSData(document)
+  # preallocated, a growing list would be counted as retained
+  peaks = array('q', [0]) * cycles
+  tracemalloc.start()
+  start = tracemalloc.get_traced_memory()[0]
+  collections = gc.get_stats()[0]['collections']
+  for i in range(cycles):
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    service._processJSONBMSData(documents[i % len(documents)])
+    peaks[i] = tracemalloc.get_traced_memory()[1] - before
+  retained = tracemalloc.get_traced_memory()[0] - start
+  collections = gc.get_stats()[0]['collections'] - collections
+  tracemalloc.stop()
+  print("%d cycles, %d cells: peak B/cycle p50 %d max %d, retained %d B, gc %d" % (
+    cycles, cells, percentile(peaks, 50), max(peaks), retained, collections))
+
+
+if __name__ == "__main__":
+  main()
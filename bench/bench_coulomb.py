@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Accuracy and cost of the coulomb counter. A current profile is integrated once finely (every
+# 10 ms) as the reference and once by the counter from samples every poll interval with jitter,
+# failed fetches and one outage longer than MaxGap, as the service sees it. The outage is taken
+# out of the reference too. Profiles:
+#   smooth   slow charge/discharge swing, changes of sign in between samples
+#   loads    the swing plus a ripple of 97 s and a 25 A load switched every 4 minutes, faster than
+#            the polling, here the sampling and not the integration decides the error
+# Prints the error against the reference, the cost of add() and of a save().
+#
+#   python3 bench/bench_coulomb.py [hours] [poll interval s] [failed fetches %]
+
+import os
+import sys
+import math
+import time
+import random
+import tempfile
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import bms_coulomb
+
+STEP = 0.01
+MAX_GAP = 30
+KEYS = ('charged_ah', 'discharged_ah', 'charged_wh', 'discharged_wh')
+
+
+def smooth(t):
+  return 30.0 * math.sin(2 * math.pi * t / 3600)
+
+
+def loads(t):
+  load = -25.0 if int(t / 240) % 3 == 0 else 0.0
+  return smooth(t) + 8.0 * math.sin(2 * math.pi * t / 97) + load
+
+
+def voltage(t, i):
+  return 52.8 + 0.012 * i + 0.4 * math.sin(2 * math.pi * t / 7200)
+
+
+def reference(current, times):
+  # rectangles of STEP between the first and the last sample, skipping the gaps the counter skips
+  totals = dict((key, 0.0) for key in KEYS)
+  for t0, t1 in zip(times, times[1:]):
+    if t1 - t0 > MAX_GAP:
+      continue
+    for k in range(int(round((t1 - t0) / STEP))):
+      t = t0 + (k + 0.5) * STEP
+      i = current(t)
+      side = 'charged' if i >= 0 else 'discharged'
+      totals[side + '_ah'] += abs(i) * STEP / 3600
+      totals[side + '_wh'] += abs(i * voltage(t, i)) * STEP / 3600
+  return totals
+
+
+def main():
+  hours = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+  poll_interval = float(sys.argv[2]) if len(sys.argv) > 2 else 3.766
+  failed = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+  duration = hours * 3600
+  outage = (duration / 2, duration / 2 + 4 * MAX_GAP)
+  random.seed(1)
+  # sample times as the service gets them
+  times = []
+  t = 0.0
+  while t < duration:
+    if not outage[0] <= t < outage[1] and random.random() * 100 >= failed:
+      times.append(t)
+    t += poll_interval * random.uniform(0.9, 1.1)
+  print("%.1f h, %d samples every %.3f s, %.0f%% failed fetches, outage of %d s" % (
+    hours, len(times), poll_interval, failed, outage[1] - outage[0]))
+  print("%-8s %-14s %12s %12s %9s" % ('profile', '', 'reference', 'counted', 'error'))
+  for name, current in (('smooth', smooth), ('loads', loads)):
+    expected = reference(current, times)
+    counter = bms_coulomb.CoulombCounter(230, max_gap=MAX_GAP)
+    samples = [(t, voltage(t, current(t)), current(t)) for t in times]
+    start = time.perf_counter()
+    for t, v, i in samples:
+      counter.add(t, v, i, 50)
+    elapsed = time.perf_counter() - start
+    for key in KEYS:
+      value = getattr(counter, key)
+      print("%-8s %-14s %12.3f %12.3f %8.3f%%" % (name, key, expected[key], value, (value / expected[key] - 1) * 100))
+    print("%-8s %d gap(s) not counted, add() %.2f us/sample" % (name, counter.gaps, elapsed / len(samples) * 1e6))
+  counter.filename = os.path.join(tempfile.mkdtemp(), 'coulomb.bin')
+  start = time.perf_counter()
+  counter.save(times[-1], time.time())
+  saved = time.perf_counter() - start
+  restored = bms_coulomb.CoulombCounter(230, counter.filename)
+  os.remove(counter.filename)
+  if [getattr(restored, key) for key in KEYS] != [getattr(counter, key) for key in KEYS]:
+    sys.exit("state file does not restore the counters")
+  print("save() %.2f ms for %d bytes, fsync included" % (saved * 1000, bms_coulomb.STATE.size))
+
+
+if __name__ == "__main__":
+  main()
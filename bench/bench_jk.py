@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# AccessType JKSerial against the JK BMS stand-in of jk_simulator.py: the whole update (request,
+# frame reassembly, decoding, control, publish) per mode of the stand-in. Reports the successful
+# cycles, cycles whose decoded values differ from what the stand-in sent, frames skipped as
+# corrupted and the _update latency. Then the decoding alone: time and memory per frame.
+#
+#   python3 bench/bench_jk.py [cycles] [capture file]
+
+import sys
+import time
+import timeit
+import logging
+import tracemalloc
+
+import standins
+import jk_simulator
+from bench_update import makeConfig, percentile
+
+MODES = ('realistic', 'partial', 'corrupted', 'noisy', 'echo')
+
+
+def run(mode, cycles, cells=16, capture=None):
+  server = jk_simulator.start(mode=mode, cells=cells, capture=capture)
+  config = makeConfig(0, mode, cells)
+  config['DEFAULT']['AccessType'] = 'JKSerial'
+  config['ONPREMISE']['Port'] = 'tcp://127.0.0.1:%d' % (server.server_address[1])
+  config['ONPREMISE']['ReadTimeout'] = '1'
+  module = standins.loadService(config)
+  service = module.DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+  latencies = []
+  ok = 0
+  wrong = 0
+  for i in range(cycles):
+    last_update = service._lastUpdate
+    start = time.perf_counter()
+    service._update()
+    latencies.append(time.perf_counter() - start)
+    if service._lastUpdate == last_update:
+      continue
+    ok += 1
+    document = server.document
+    if not capture and (any(abs(service.state.cell_volt[k] - document['Cell'][str(k)]) > 0.0005 for k in range(cells))
+                        or abs(service._sample['Current'] - document['Battery']['Charge_Current']) > 0.005
+                        or service.state.soc != document['Battery']['Percent_Remain']):
+      wrong += 1
+  service._jk.close()
+  server.shutdown()
+  print("%-10s %4d/%-4d %5d %9d %7.2f %7.2f %7.2f" % (mode, ok, cycles, wrong, service._jk.corrupted,
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, max(latencies) * 1000))
+  return service
+
+
+def main():
+  cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+  capture = sys.argv[2] if len(sys.argv) > 2 else None
+  logging.basicConfig(level=logging.CRITICAL + 1)
+  print("%-10s %9s %5s %9s %7s %7s %7s" % ('mode', 'ok', 'wrong', 'corrupted', 'p50 ms', 'p95 ms', 'max ms'))
+  for mode in (('replay',) if capture else MODES):
+    service = run(mode, cycles, capture=capture)
+  # decoding alone, on a frame in a memoryview as read() returns it
+  model = jk_simulator.simulator.BatteryModel(16)
+  frame = memoryview(bytearray(jk_simulator.encodeFrame(model.step(), 16)))
+  decoder = service._mapping
+  sample = service._sample
+  cell_volt = service.state.cell_volt
+  seconds = min(timeit.repeat(lambda: decoder.extract(frame, sample, cell_volt), number=10000, repeat=3)) / 10000
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  tracemalloc.reset_peak()
+  decoder.extract(frame, sample, cell_volt)
+  peak = tracemalloc.get_traced_memory()[1] - before
+  tracemalloc.stop()
+  print("decode %d byte frame: %.1f us, peak %d B" % (len(frame), seconds * 1e6, peak))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# Micro-benchmark: parse + extract time per JSON payload, the hard-coded extraction of
+# earlier versions (json module + nested dict lookups) against the compiled bms_mapping.
+#
+#   python3 bench/bench_mapping.py [number of cells] [iterations]
+
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import bms_mapping
+
+
+def makePayload(number_of_cells):
+  return json.dumps({
+    'Battery': {
+      'Percent_Remain': 87, 'Battery_Voltage': 53.12, 'Charge_Current': -12.4, 'Battery_Power': -658.7,
+      'Battery_T1': 21.3, 'Battery_T2': 22.1, 'Cycle_Count': 143, 'Charge': 'on', 'Discharge': 'on',
+    },
+    'Cell': dict((str(i), 3.310 + i * 0.001) for i in range(number_of_cells)),
+  }).encode()
+
+
+def legacyExtract(payload, number_of_cells, cell_volt):
+  # extraction as done in _update up to now
+  bms_data = json.loads(payload)
+  for i in range(number_of_cells):
+    cell_volt[i] = float(bms_data['Cell'][str(i)])
+  soc = int(bms_data['Battery']['Percent_Remain'])
+  voltage = round(float(bms_data['Battery']['Battery_Voltage']), 2)
+  current = round(float(bms_data['Battery']['Charge_Current']), 1)
+  power = round(float(bms_data['Battery']['Battery_Power']), 1)
+  temperature = round(float(bms_data['Battery']['Battery_T1']), 1)
+  cycles = int(bms_data['Battery']['Cycle_Count'])
+  if float(bms_data['Battery']['Battery_T1']) < float(bms_data['Battery']['Battery_T2']):
+    min_cell_temp = float(bms_data['Battery']['Battery_T1'])
+    max_cell_temp = float(bms_data['Battery']['Battery_T2'])
+  else:
+    min_cell_temp = float(bms_data['Battery']['Battery_T2'])
+    max_cell_temp = float(bms_data['Battery']['Battery_T1'])
+  return bms_data['Battery']['Charge'] == "off", bms_data['Battery']['Discharge'] == "off"
+
+
+def mappingExtract(payload, mapping, sample, cell_volt):
+  mapping.extract(bms_mapping.loads(payload), sample, cell_volt)
+
+
+def main():
+  number_of_cells = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+  iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+  payload = makePayload(number_of_cells)
+  cell_volt = [0.0] * number_of_cells
+  mapping = bms_mapping.JSONBMSMapping(number_of_cells)
+  sample = {}
+  print("parser: %s, %d cells, %d bytes payload" % (bms_mapping.loads.__module__, number_of_cells, len(payload)))
+  for name, run in (('legacy', lambda: legacyExtract(payload, number_of_cells, cell_volt)),
+                    ('mapping', lambda: mappingExtract(payload, mapping, sample, cell_volt))):
+    best = min(timeit.repeat(run, number=iterations, repeat=5))
+    print("%-8s %8.2f us/payload" % (name, best / iterations * 1e6))
+
+
+if __name__ == "__main__":
+  main()
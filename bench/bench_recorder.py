@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+# Benchmark of the binary recorder: cost of add() per sample (including the flushes) and
+# bytes written to the file per hour for a poll interval and flush interval.
+#
+#   python3 bench/bench_recorder.py [number of cells] [poll interval s] [flush interval s]
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import bms_recorder
+
+PAGE_SIZE = 4096
+
+
+def main():
+  number_of_cells = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+  poll_interval = float(sys.argv[2]) if len(sys.argv) > 2 else 3.766
+  flush_interval = float(sys.argv[3]) if len(sys.argv) > 3 else 300
+  samples = 100000
+  cells = [3.3 + i * 0.001 for i in range(number_of_cells)]
+  filename = os.path.join(tempfile.mkdtemp(), 'bench.bin')
+  recorder = bms_recorder.Recorder(filename, number_of_cells, capacity=50000, flush_interval=3600)
+  start = time.perf_counter()
+  for i in range(samples):
+    recorder.add(1.7e9 + i, 87, 53.1, -12.4, -658.7, 21.3, 22.1, 50, 50, 55.2, 1, 1, cells)
+  recorder.close()
+  elapsed = time.perf_counter() - start
+  os.remove(filename)
+  record_size = recorder.record.size
+  samples_per_hour = 3600 / poll_interval
+  flushes_per_hour = 3600 / flush_interval
+  payload = samples_per_hour * record_size
+  # every flush dirties the pages of its records plus the header page
+  pages = flushes_per_hour * (-(-(samples_per_hour / flushes_per_hour * record_size) // PAGE_SIZE) + 2)
+  print("%d cells, record %d bytes, %d samples" % (number_of_cells, record_size, samples))
+  print("add():            %8.2f us/sample (flushes included)" % (elapsed / samples * 1e6))
+  print("records per hour: %8d bytes (poll every %.3f s)" % (payload, poll_interval))
+  print("disk per hour:    %8d bytes in %d pages (flush every %d s)" % (pages * PAGE_SIZE, pages, flush_interval))
+
+
+if __name__ == "__main__":
+  main()
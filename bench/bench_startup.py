@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Startup time of one pack service, from the launch of a fresh python process to the first
+# /UpdateIndex published, against the local BMS simulator with the stand-ins of standins.py.
+# Every run is a new process, so module imports are part of the measurement. Prints the median
+# of the runs split into interpreter start, imports, service setup and the first update, and
+# exits with 1 when the median is above the target. The default target of 300 ms is for a PC,
+# pass a higher one for a GX device.
+#
+#   python3 bench/bench_startup.py [runs] [target ms]
+
+import os
+import sys
+import time
+import socket
+import subprocess
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+
+
+def child(port, cells):
+  # runs in the measured process, reports the milestones as perf_counter values
+  started = time.perf_counter()
+  import logging
+  import standins
+  from bench_update import makeConfig
+  logging.basicConfig(level=logging.CRITICAL + 1)
+  module = standins.loadService(makeConfig(port, 'realistic', cells))
+  imported = time.perf_counter()
+  service = module.DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+  created = time.perf_counter()
+  service._update()
+  if service._dbusservice['/UpdateIndex'] != 1:
+    sys.exit("no /UpdateIndex published")
+  published = time.perf_counter()
+  print("%.6f %.6f %.6f %.6f" % (started, imported, created, published))
+
+
+def main():
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  target = float(sys.argv[2]) if len(sys.argv) > 2 else 300
+  sys.path.insert(0, BENCH)
+  from bench_update import freePort
+  port = freePort()
+  simulator = subprocess.Popen([sys.executable, os.path.join(BENCH, 'simulator.py'), str(port)], stdout=subprocess.DEVNULL)
+  try:
+    for i in range(50):
+      try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+        break
+      except socket.error:
+        time.sleep(0.1)
+    results = []
+    for i in range(runs):
+      launch = time.perf_counter()
+      output = subprocess.check_output([sys.executable, os.path.realpath(__file__), '--child', str(port), '16'], cwd=BENCH)
+      # perf_counter is the same system-wide monotonic clock in both processes
+      started, imported, created, published = [float(value) for value in output.split()]
+      results.append((published - launch, started - launch, imported - started, created - imported, published - created))
+    results.sort()
+    total, interpreter, imports, setup, update = results[len(results) // 2]
+    print("launch to first /UpdateIndex %.0f ms (interpreter %.0f, imports %.0f, setup %.0f, first update %.0f), target %.0f ms" % (
+      total * 1000, interpreter * 1000, imports * 1000, setup * 1000, update * 1000, target))
+    if total * 1000 > target:
+      sys.exit(1)
+  finally:
+    simulator.terminate()
+
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1 and sys.argv[1] == '--child':
+    child(int(sys.argv[2]), int(sys.argv[3]))
+  else:
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Benchmark of the whole poll pipeline (_update: HTTP fetch, parse, control, publish) against the
+# local BMS simulator, with the stand-ins of standins.py instead of Venus OS.
+# Reports per scenario: successful cycles, _update latency percentiles, CPU per cycle and per
+# hour at the normal poll interval, D-Bus writes and signals per cycle and memory allocated per
+# cycle (tracemalloc peak, measured in a separate pass as tracing slows everything down).
+#
+#   python3 bench/bench_update.py [cycles]
+
+import os
+import sys
+import time
+import socket
+import logging
+import subprocess
+import tracemalloc
+import configparser
+
+import standins
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+
+SCENARIOS = (
+  ('realistic', 8), ('realistic', 16), ('realistic', 24), ('realistic', 32),
+  ('missing', 16), ('malformed', 16), ('mixed', 16), ('slow', 16),
+)
+
+
+def freePort():
+  s = socket.socket()
+  s.bind(('127.0.0.1', 0))
+  port = s.getsockname()[1]
+  s.close()
+  return port
+
+
+def makeConfig(port, mode, cells):
+  config = configparser.ConfigParser()
+  config.read(os.path.join(standins.ROOT, 'config.ini'))
+  config['DEFAULT']['FetchMode'] = 'Blocking'
+  config['DEFAULT']['AccessType'] = 'OnPremise'
+  config['ONPREMISE']['Host'] = '127.0.0.1:%d/%s?cells=%d&delay=0.2' % (port, mode, cells)
+  config['ONPREMISE']['Username'] = ''
+  config['ONPREMISE']['Password'] = ''
+  config['Battery']['NumberOfCells'] = str(cells)
+  return config
+
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def run(port, mode, cells, cycles):
+  module = standins.loadService(makeConfig(port, mode, cells))
+  service = module.DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+  dbusservice = service._dbusservice
+  latencies = []
+  cpu = 0.0
+  ok = 0
+  writes = dbusservice.writes
+  signals = dbusservice.signals
+  for i in range(cycles):
+    last_update = service._lastUpdate
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    service._update()
+    latencies.append(time.perf_counter() - start)
+    cpu += time.process_time() - start_cpu
+    if service._lastUpdate != last_update:
+      ok += 1
+  writes = dbusservice.writes - writes
+  signals = dbusservice.signals - signals
+  # second pass for the allocations
+  tracemalloc.start()
+  allocated = []
+  for i in range(min(cycles, 200)):
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    service._update()
+    allocated.append(tracemalloc.get_traced_memory()[1] - before)
+  tracemalloc.stop()
+  interval = service._scheduler.normal_interval
+  print("%-9s %2d  %4d/%-4d %7.2f %7.2f %7.2f %7.2f %8.1f %7.2f %6.1f %6.2f %8d" % (
+    mode, cells, ok, cycles,
+    percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000,
+    cpu / cycles * 1e6, cpu / cycles * 3600 / interval, float(writes) / cycles, float(signals) / cycles,
+    percentile(allocated, 50)))
+
+
+def main():
+  cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  logging.basicConfig(level=logging.CRITICAL + 1)
+  port = freePort()
+  simulator = subprocess.Popen([sys.executable, os.path.join(BENCH, 'simulator.py'), str(port)], stdout=subprocess.DEVNULL)
+  try:
+    # wait for the simulator to listen
+    for i in range(50):
+      try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+        break
+      except socket.error:
+        time.sleep(0.1)
+    print("%-9s %2s  %9s %7s %7s %7s %7s %8s %7s %6s %6s %8s" % (
+      'mode', 'n', 'ok', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'cpu us', 'cpu s/h', 'writes', 'sig', 'alloc B'))
+    for mode, cells in SCENARIOS:
+      run(port, mode, cells, cycles if mode != 'slow' else max(cycles // 25, 10))
+  finally:
+    simulator.terminate()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Compares the charge/discharge current limits of the curves in config.ini with the SoC step
+# logic of earlier versions for SoC 0..100 in steps of 0.5, without the ramp of the rate limiter.
+# Prints the SoC values where they differ and the largest difference at whole and at any SoC.
+# The max currents of config.ini can be replaced to check the curves for another battery.
+#
+#   python3 bench/compare_curves.py [config.ini] [max charge A] [max discharge A]
+
+import os
+import sys
+import configparser
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import bms_curves
+
+
+def legacyCharge(soc, max_current):
+  if 98 < soc <= 100:
+    return 5
+  elif 95 < soc <= 98:
+    return max_current / 4
+  elif 91 < soc <= 95:
+    return max_current / 2
+  return max_current
+
+
+def legacyDischarge(soc, max_current):
+  if soc <= 10:
+    return 5
+  elif 10 < soc <= 20:
+    return max_current / 2
+  return max_current
+
+
+def compare(charge_text, discharge_text, max_charge, max_discharge):
+  # (soc, old charge, curve charge, old discharge, curve discharge) for SoC 0..100 in steps of 0.5
+  charge = bms_curves.compileCurve(charge_text, full=max_charge)
+  discharge = bms_curves.compileCurve(discharge_text, full=max_discharge)
+  for half in range(201):
+    soc = half / 2.0
+    yield (soc, legacyCharge(soc, max_charge), max_charge * charge(soc),
+           legacyDischarge(soc, max_discharge), max_discharge * discharge(soc))
+
+
+def main():
+  config = configparser.ConfigParser()
+  config.read(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'config.ini'))
+  battery = config['Battery']
+  max_charge = float(sys.argv[2]) if len(sys.argv) > 2 else float(battery['MaxBatteryChargeCurrent'])
+  max_discharge = float(sys.argv[3]) if len(sys.argv) > 3 else float(battery['MaxBatteryDischargeCurrent'])
+  worst = [0.0, 0.0, 0.0, 0.0]
+  print("  soc  charge step  curve   discharge step  curve")
+  for values in compare(battery.get('ChargeCurrentSoc', bms_curves.DEFAULT_CHARGE_CURRENT_SOC),
+                        battery.get('DischargeCurrentSoc', bms_curves.DEFAULT_DISCHARGE_CURRENT_SOC),
+                        max_charge, max_discharge):
+    whole = 0 if values[0] == int(values[0]) else 2
+    worst[whole] = max(worst[whole], abs(values[1] - values[2]))
+    worst[whole + 1] = max(worst[whole + 1], abs(values[3] - values[4]))
+    if abs(values[1] - values[2]) > 0.01 or abs(values[3] - values[4]) > 0.01:
+      print("%5.1f  %11.2f %6.2f   %14.2f %6.2f" % values)
+  print("max current: charge %.0f A, discharge %.0f A" % (max_charge, max_discharge))
+  print("largest difference at whole SoC: charge %.2f A, discharge %.2f A" % tuple(worst[:2]))
+  print("largest difference between:      charge %.2f A, discharge %.2f A" % tuple(worst[2:]))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Local TCP stand-in for a JK BMS behind a serial bridge (ser2net raw mode), speaking the binary
+# "4E 57" protocol of bms_jk.py. Every read-all request is answered with one frame; the mode
+# decides how it arrives:
+#   realistic   the whole frame at once, values from the battery model of simulator.py
+#   partial     the frame in small pieces with pauses in between
+#   corrupted   every 4th answer has a broken checksum, the others are fine
+#   noisy       random bytes and a truncated frame before the valid one
+#   echo        the request is sent back first, as RS485 adapters do
+#   replay      captured frames from a file (one frame per line in hex), round robin
+#
+#   python3 bench/jk_simulator.py [port] [mode] [cells] [capture file]
+
+import os
+import sys
+import time
+import random
+import socket
+import struct
+import socketserver
+import threading
+
+import simulator
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from bms_jk import READ_ALL
+
+
+def encodeFrame(document, number_of_cells):
+  # frame of protocol version 1 with the fields read by bms_jk and a few parameters after them
+  battery = document['Battery']
+  cells = bytearray()
+  for i in range(number_of_cells):
+    cells += struct.pack('>BH', i + 1, int(round(document['Cell'][str(i)] * 1000)))
+  current = int(round(abs(battery['Charge_Current']) * 100)) & 0x7FFF
+  if battery['Charge_Current'] >= 0:
+    current |= 0x8000
+  status = (1 if battery['Charge'] == 'on' else 0) | (2 if battery['Discharge'] == 'on' else 0)
+  temperature = lambda value: int(round(value)) if value >= 0 else 100 - int(round(value))
+  data = bytearray(b'\x79') + bytes((len(cells),)) + cells
+  data += struct.pack('>BHBHBHBHBHBBBBBHBIBHBHBH', 0x80, 25, 0x81, temperature(battery['Battery_T1']),
+                      0x82, temperature(battery['Battery_T2']), 0x83, int(round(battery['Battery_Voltage'] * 100)),
+                      0x84, current, 0x85, battery['Percent_Remain'], 0x86, 2, 0x87, battery['Cycle_Count'],
+                      0x89, 0, 0x8A, number_of_cells, 0x8B, 0, 0x8C, status)
+  data += struct.pack('>BHBHBB', 0x8E, 5840, 0x8F, 4000, 0x9D, 1)
+  data += b'\xb7' + b'11.XW_S11.26___'
+  data += b'\xc0\x01'
+  length = 2 + 4 + 1 + 1 + 1 + len(data) + 4 + 1 + 4
+  frame = bytearray(b'\x4e\x57') + struct.pack('>HIBBB', length, 0, 0x06, 0x00, 0x01) + data
+  frame += struct.pack('>IB', 0, 0x68)
+  frame += struct.pack('>I', sum(frame) & 0xFFFF)
+  return bytes(frame)
+
+
+class JKHandler(socketserver.BaseRequestHandler):
+  def setup(self):
+    # like a serial bridge, every write goes out at once
+    self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+  def handle(self):
+    server = self.server
+    answers = 0
+    while True:
+      request = self.request.recv(64)
+      if not request:
+        return
+      if READ_ALL not in request:
+        continue
+      answers += 1
+      with server.lock:
+        server.document = server.model.step()
+        frame = server.replay[answers % len(server.replay)] if server.replay else encodeFrame(server.document, server.cells)
+      mode = server.mode
+      if mode == 'echo':
+        self.request.sendall(READ_ALL)
+      if mode == 'noisy':
+        self.request.sendall(bytes(random.randrange(256) for i in range(random.randrange(1, 40))) + frame[:len(frame) // 3])
+      if mode == 'corrupted' and answers % 4 == 0:
+        broken = bytearray(frame)
+        broken[random.randrange(11, len(frame) - 9)] ^= 0x10
+        self.request.sendall(bytes(broken))
+        continue
+      if mode == 'partial':
+        position = 0
+        while position < len(frame):
+          size = random.randrange(1, 64)
+          self.request.sendall(frame[position:position + size])
+          position += size
+          time.sleep(0.002)
+      else:
+        self.request.sendall(frame)
+
+
+class JKSimulator(socketserver.ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, port, mode='realistic', cells=16, capture=None):
+    socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', port), JKHandler)
+    self.mode = mode
+    self.cells = cells
+    self.model = simulator.BatteryModel(cells)
+    self.document = None
+    self.lock = threading.Lock()
+    self.replay = None
+    if capture:
+      with open(capture) as f:
+        self.replay = [bytes.fromhex(line) for line in f if line.strip()]
+
+
+def start(port=0, mode='realistic', cells=16, capture=None):
+  # runs the stand-in in a daemon thread, returns the server (server.server_address[1] is the port)
+  server = JKSimulator(port, mode, cells, capture)
+  thread = threading.Thread(target=server.serve_forever, name='JKSimulator')
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def main():
+  port = int(sys.argv[1]) if len(sys.argv) > 1 else 4001
+  mode = sys.argv[2] if len(sys.argv) > 2 else 'realistic'
+  cells = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+  server = JKSimulator(port, mode, cells, sys.argv[4] if len(sys.argv) > 4 else None)
+  print("JK BMS stand-in on tcp://127.0.0.1:%d (%s, %d cells)" % (port, mode, cells))
+  server.serve_forever()
+
+
+if __name__ == "__main__":
+  main()
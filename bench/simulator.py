@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# Local HTTP stand-in for a JK BMS JSON bridge. The path selects the behaviour, the query the pack:
+#   /realistic   random walk of current, SoC and cell voltages
+#   /slow        like realistic, answered after ?delay= seconds (default 4)
+#   /malformed   truncated JSON
+#   /missing     a random cell is missing in the document
+#   /mixed       90% realistic, the rest slow, malformed or missing
+#   /static      always the same document with an ETag, 304 when asked for with If-None-Match
+#   /sse         push stream of frames as Server-Sent Events (chunked HTTP/1.1)
+#   /ndjson      push stream of frames, one JSON document per line (chunked HTTP/1.1)
+#                every ?full= frames (default 1) a whole document, the frames in between only
+#                carry the current and the first cell. ?frames= frames per connection every
+#                ?interval= seconds (default 0.5), then the connection is closed. After
+#                ?connections= connections with the same ?name= the stream answers 404
+#   ?cells=1..32 (default 16)
+#
+#   python3 bench/simulator.py [port]
+
+import sys
+import json
+import time
+import random
+import threading
+try:
+  from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+except ImportError:
+  from http.server import HTTPServer as ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class BatteryModel:
+  def __init__(self, number_of_cells, capacity=230.0):
+    self.number_of_cells = number_of_cells
+    self.capacity = capacity
+    self.soc = 60.0
+    self.current = 0.0
+    self.offsets = [random.gauss(0, 0.004) for i in range(number_of_cells)]
+    self.time = time.monotonic()
+    self.cycles = 143
+    self.lock = threading.Lock()
+
+  def step(self):
+    with self.lock:
+      now = time.monotonic()
+      dt = now - self.time
+      self.time = now
+      # load steps now and then, otherwise a slow drift
+      if random.random() < 0.05:
+        self.current = random.choice((-80.0, -30.0, -5.0, 0.0, 10.0, 40.0))
+      self.current += random.gauss(0, 0.5)
+      self.soc = min(100.0, max(0.0, self.soc + self.current * dt / 3600 / self.capacity * 100))
+      # LiFePO4 plateau, IR drop 1 mOhm per cell
+      base = 3.0 + 0.3 * (self.soc / 100) ** 0.3 + self.current * 0.001
+      cells = [round(base + offset + random.gauss(0, 0.0005), 3) for offset in self.offsets]
+      voltage = sum(cells)
+      return {
+        'Battery': {
+          'Percent_Remain': int(self.soc),
+          'Battery_Voltage': round(voltage, 2),
+          'Charge_Current': round(self.current, 2),
+          'Battery_Power': round(voltage * self.current, 1),
+          'Battery_T1': round(22 + random.gauss(0, 0.2), 1),
+          'Battery_T2': round(23 + random.gauss(0, 0.2), 1),
+          'Cycle_Count': self.cycles,
+          'Charge': 'on',
+          'Discharge': 'on',
+        },
+        'Cell': dict((str(i), cells[i]) for i in range(self.number_of_cells)),
+      }
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+  models = {}
+  documents = {}
+  connections = {}
+  lock = threading.Lock()
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    url = urlparse(self.path)
+    query = parse_qs(url.query)
+    cells = int(query.get('cells', ['16'])[0])
+    mode = url.path.strip('/') or 'realistic'
+    if mode == 'mixed':
+      mode = random.choice(('realistic',) * 17 + ('slow', 'malformed', 'missing'))
+    model = self.models.setdefault(cells, BatteryModel(cells))
+    if mode in ('sse', 'ndjson'):
+      self.stream(mode, model, query)
+      return
+    document = model.step()
+    headers = {}
+    if mode == 'static':
+      document = self.documents.setdefault(cells, document)
+      headers['ETag'] = '"static-%d"' % (cells)
+      if self.headers.get('If-None-Match') == headers['ETag']:
+        self.send_response(304)
+        self.send_header('ETag', headers['ETag'])
+        self.end_headers()
+        return
+    if mode == 'slow':
+      time.sleep(float(query.get('delay', ['4'])[0]))
+    if mode == 'missing':
+      del document['Cell'][str(random.randrange(cells))]
+    body = json.dumps(document).encode()
+    if mode == 'malformed':
+      body = body[:len(body) // 2]
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def stream(self, mode, model, query):
+    name = query.get('name', ['stream'])[0]
+    with self.lock:
+      connection = self.connections[name] = self.connections.get(name, 0) + 1
+    if connection > int(query.get('connections', ['1000000'])[0]):
+      self.send_error(404)
+      return
+    frames = int(query.get('frames', ['1000000'])[0])
+    full = int(query.get('full', ['1'])[0])
+    interval = float(query.get('interval', ['0.5'])[0])
+    # chunked, so every frame is passed on by the client as soon as it arrives
+    self.protocol_version = 'HTTP/1.1'
+    self.close_connection = True
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/event-stream' if mode == 'sse' else 'application/x-ndjson')
+    self.send_header('Transfer-Encoding', 'chunked')
+    self.send_header('Connection', 'close')
+    self.end_headers()
+    try:
+      for i in range(1, frames + 1):
+        document = model.step()
+        if i % full:
+          document = {'Battery': {'Charge_Current': document['Battery']['Charge_Current']},
+                      'Cell': {'0': document['Cell']['0']}}
+        # not part of the JK dialect, it tells a test which frame it got
+        document['Stream'] = {'connection': connection, 'frame': i}
+        line = json.dumps(document)
+        data = ('data: %s\n\n' % (line) if mode == 'sse' else line + '\n').encode()
+        self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+        time.sleep(interval)
+      self.wfile.write(b'0\r\n\r\n')
+    except (BrokenPipeError, ConnectionResetError):
+      pass
+
+
+def start(port=0):
+  # runs the simulator in a daemon thread, returns the server (server.server_port is the port)
+  server = ThreadingHTTPServer(('127.0.0.1', port), SimulatorHandler)
+  server.daemon_threads = True
+  thread = threading.Thread(target=server.serve_forever, name='BMSSimulator')
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def main():
+  port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+  server = ThreadingHTTPServer(('127.0.0.1', port), SimulatorHandler)
+  print("BMS simulator on http://127.0.0.1:%d/realistic?cells=16" % (port))
+  server.serve_forever()
+
+
+if __name__ == "__main__":
+  main()
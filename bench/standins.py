@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Stand-ins for the Venus OS parts of dbus-json-bms (vedbus, dbus, GLib), so the service can be
+# loaded and driven on any machine. The VeDbusService stand-in records every write and counts the
+# signals the real one would emit: one PropertiesChanged per changed value set directly, one
+# ItemsChanged per batch of the "with service as s:" context. GLib.idle_add queues the callback
+# like the real main loop, the harness runs the queue with GLib.iteration().
+
+import os
+import sys
+import types
+import queue
+import importlib.util
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+
+class VeDbusService:
+  def __init__(self, servicename, bus=None, register=True):
+    self.servicename = servicename
+    self._values = {}
+    self.writeable = {}
+    self.writes = 0
+    self.signals = 0
+    self._changes = None
+
+  def add_path(self, path, value, description="", writeable=False, onchangecallback=None, gettextcallback=None,
+               valuetype=None, itemtype=None):
+    self._values[path] = value
+    self.writeable[path] = writeable
+
+  def register(self):
+    pass
+
+  def __getitem__(self, path):
+    return self._values[path]
+
+  def __setitem__(self, path, value):
+    self.writes += 1
+    if self._values[path] == value:
+      return
+    self._values[path] = value
+    if self._changes is not None:
+      self._changes[path] = value
+    else:
+      self.signals += 1
+
+  def __enter__(self):
+    self._changes = {}
+    return self
+
+  def __exit__(self, *exc):
+    if self._changes:
+      self.signals += 1
+    self._changes = None
+
+
+class GLib:
+  # timers are recorded, the harness calls the callbacks itself
+  timers = []
+  idle = queue.Queue()
+
+  @staticmethod
+  def timeout_add(interval, callback, *args):
+    GLib.timers.append((interval, callback, args))
+    return len(GLib.timers)
+
+  @staticmethod
+  def idle_add(callback, *args):
+    # may be called from any thread, the callback runs in the thread calling iteration()
+    GLib.idle.put((callback, args))
+    return 1
+
+  @staticmethod
+  def iteration(timeout=None):
+    # runs one idle callback, waits up to timeout seconds for one, False when there was none
+    try:
+      callback, args = GLib.idle.get(timeout=timeout) if timeout else GLib.idle.get_nowait()
+    except queue.Empty:
+      return False
+    callback(*args)
+    return True
+
+  @staticmethod
+  def threads_init():
+    pass
+
+  class MainLoop:
+    def run(self):
+      raise RuntimeError("no main loop in the bench harness")
+
+
+def install():
+  vedbus = types.ModuleType('vedbus')
+  vedbus.VeDbusService = VeDbusService
+  dbus = types.ModuleType('dbus')
+  dbus.SystemBus = dbus.SessionBus = lambda private=False: None
+  gi = types.ModuleType('gi')
+  repository = types.ModuleType('gi.repository')
+  repository.GLib = GLib
+  gi.repository = repository
+  sys.modules.update({'vedbus': vedbus, 'dbus': dbus, 'gi': gi, 'gi.repository': repository})
+  if ROOT not in sys.path:
+    sys.path.insert(1, ROOT)
+
+
+def loadService(config):
+  # returns the dbus-json-bms module with getConfig() answering the given ConfigParser
+  install()
+  spec = importlib.util.spec_from_file_location('dbus_json_bms', os.path.join(ROOT, 'dbus-json-bms.py'))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  module.getConfig = lambda: config
+  return module
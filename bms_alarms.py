@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# Table driven alarm engine for the /Alarms/* paths of a pack.
+#
+# Every rule compares one input of the sample with a warning and an alarm threshold
+# (dbus value 1 and 2), a level is only raised after the condition held for Delay seconds and
+# only cleared when the input is back below the threshold by more than Hysteresis. Warning and
+# alarm have their own timer, the alarm delay starts when the alarm threshold is crossed.
+# Low side rules work on the negated input, so all rules are evaluated as "input >= threshold"
+# in one pass over flat arrays. A pass over all rules takes a few microseconds; the time of
+# each pass is checked against the per-cycle budget.
+#
+# [ALARMS] in config.ini: <Alarm> = warning, alarm, hysteresis, delay
+#
+# Replay a recorded trace (see bms_recorder.py) and print every alarm transition:
+#   python3 bms_alarms.py recorder_onpremise.bin
+
+import os
+import time
+import argparse
+import configparser
+from array import array
+
+# inputs of a sample
+VOLTAGE, CHARGE_CURRENT, DISCHARGE_CURRENT, SOC, MIN_CELL, MAX_CELL, CELL_DIFF, MIN_TEMP, MAX_TEMP, CHARGE_MIN_TEMP, CHARGE_MAX_TEMP = range(11)
+
+HIGH = 1.0
+LOW = -1.0
+
+# dbus path, input, side
+ALARM_RULES = (
+  ('/Alarms/LowVoltage', VOLTAGE, LOW),
+  ('/Alarms/HighVoltage', VOLTAGE, HIGH),
+  ('/Alarms/LowCellVoltage', MIN_CELL, LOW),
+  ('/Alarms/HighCellVoltage', MAX_CELL, HIGH),
+  ('/Alarms/LowSoc', SOC, LOW),
+  ('/Alarms/HighChargeCurrent', CHARGE_CURRENT, HIGH),
+  ('/Alarms/HighDischargeCurrent', DISCHARGE_CURRENT, HIGH),
+  ('/Alarms/CellImbalance', CELL_DIFF, HIGH),
+  ('/Alarms/HighChargeTemperature', CHARGE_MAX_TEMP, HIGH),
+  ('/Alarms/LowChargeTemperature', CHARGE_MIN_TEMP, LOW),
+  ('/Alarms/HighTemperature', MAX_TEMP, HIGH),
+  ('/Alarms/LowTemperature', MIN_TEMP, LOW),
+)
+
+
+def defaultThresholds(number_of_cells, max_charge_current, max_discharge_current):
+  # warning, alarm, hysteresis, delay for LiFePO4 cells
+  return {
+    'LowVoltage': (3.0 * number_of_cells, 2.8 * number_of_cells, 0.1 * number_of_cells, 5),
+    'HighVoltage': (3.6 * number_of_cells, 3.65 * number_of_cells, 0.05 * number_of_cells, 5),
+    'LowCellVoltage': (3.0, 2.8, 0.1, 5),
+    'HighCellVoltage': (3.6, 3.65, 0.05, 5),
+    'LowSoc': (10, 5, 2, 0),
+    'HighChargeCurrent': (max_charge_current * 1.1, max_charge_current * 1.25, max_charge_current * 0.05, 5),
+    'HighDischargeCurrent': (max_discharge_current * 1.1, max_discharge_current * 1.25, max_discharge_current * 0.05, 5),
+    'CellImbalance': (0.05, 0.1, 0.01, 30),
+    'HighChargeTemperature': (45, 55, 3, 10),
+    'LowChargeTemperature': (5, 0, 3, 10),
+    'HighTemperature': (50, 60, 3, 10),
+    'LowTemperature': (0, -10, 3, 10),
+  }
+
+
+class AlarmEngine:
+  def __init__(self, thresholds, budget=0.002):
+    # thresholds: alarm name (path without /Alarms/) -> (warning, alarm, hysteresis, delay)
+    rules = len(ALARM_RULES)
+    self.paths = tuple(path for path, _, _ in ALARM_RULES)
+    self._input = tuple(index for _, index, _ in ALARM_RULES)
+    self._side = array('d', [side for _, _, side in ALARM_RULES])
+    self._warning = array('d', [0.0]) * rules
+    self._alarm = array('d', [0.0]) * rules
+    self._hysteresis = array('d', [0.0]) * rules
+    self._delay = array('d', [0.0]) * rules
+    for k, (path, _, side) in enumerate(ALARM_RULES):
+      warning, alarm, hysteresis, delay = thresholds[path[len('/Alarms/'):]]
+      self._warning[k] = warning * side
+      self._alarm[k] = alarm * side
+      self._hysteresis[k] = hysteresis
+      self._delay[k] = delay
+    self.levels = array('i', [0]) * rules
+    # since when the warning/alarm condition holds, -1 while it does not
+    self._warning_since = array('d', [-1.0]) * rules
+    self._alarm_since = array('d', [-1.0]) * rules
+    self._inputs = array('d', [0.0]) * 11
+    self.budget = budget
+    self.last_duration = 0.0
+    self.overruns = 0
+
+  def evaluate(self, now, voltage, current, soc, min_cell, max_cell, min_temp, max_temp):
+    # now from a monotonic clock, returns the levels in the order of self.paths
+    start = time.perf_counter()
+    inputs = self._inputs
+    inputs[VOLTAGE] = voltage
+    # the BMS reports discharging as negative current
+    inputs[CHARGE_CURRENT] = current
+    inputs[DISCHARGE_CURRENT] = -current
+    inputs[SOC] = soc
+    inputs[MIN_CELL] = min_cell
+    inputs[MAX_CELL] = max_cell
+    inputs[CELL_DIFF] = max_cell - min_cell
+    inputs[MIN_TEMP] = min_temp
+    inputs[MAX_TEMP] = max_temp
+    # charge temperature rules only apply while charging
+    charging = current > 0
+    inputs[CHARGE_MIN_TEMP] = min_temp if charging else float('inf')
+    inputs[CHARGE_MAX_TEMP] = max_temp if charging else float('-inf')
+    levels = self.levels
+    warning_since = self._warning_since
+    alarm_since = self._alarm_since
+    for k in range(len(levels)):
+      value = inputs[self._input[k]] * self._side[k]
+      level = levels[k]
+      hysteresis = self._hysteresis[k]
+      if value >= self._alarm[k] or (level == 2 and value > self._alarm[k] - hysteresis):
+        target = 2
+      elif value >= self._warning[k] or (level >= 1 and value > self._warning[k] - hysteresis):
+        target = 1
+      else:
+        target = 0
+      if target < 1:
+        warning_since[k] = -1.0
+      elif warning_since[k] < 0:
+        warning_since[k] = now
+      if target < 2:
+        alarm_since[k] = -1.0
+      elif alarm_since[k] < 0:
+        alarm_since[k] = now
+      if target <= level:
+        levels[k] = target
+      elif target == 2 and now - alarm_since[k] >= self._delay[k]:
+        levels[k] = 2
+      elif level == 0 and now - warning_since[k] >= self._delay[k]:
+        levels[k] = 1
+    self.last_duration = time.perf_counter() - start
+    if self.last_duration > self.budget:
+      self.overruns += 1
+    return levels
+
+
+def loadThresholds(alarms, number_of_cells, max_charge_current, max_discharge_current):
+  # alarms: bms_config.AlarmConfig, the thresholds set in config.ini replace the defaults
+  thresholds = defaultThresholds(number_of_cells, max_charge_current, max_discharge_current)
+  thresholds.update(alarms.thresholds)
+  return thresholds
+
+
+def main():
+  # replay of a recorder file with the thresholds of config.ini
+  from bms_recorder import RecorderReader, FIELDS
+  from bms_config import AlarmConfig
+  parser = argparse.ArgumentParser(description='Replay a dbus-json-bms recorder file through the alarm engine')
+  parser.add_argument('file')
+  parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.ini'))
+  args = parser.parse_args()
+  config = configparser.ConfigParser()
+  config.read(args.config)
+  battery = config['Battery']
+  reader = RecorderReader(args.file)
+  engine = AlarmEngine(loadThresholds(AlarmConfig(config), reader.number_of_cells, float(battery['MaxBatteryChargeCurrent']),
+                                      float(battery['MaxBatteryDischargeCurrent'])))
+  field = dict((name, index) for index, name in enumerate(FIELDS))
+  previous = list(engine.levels)
+  slowest = 0.0
+  for values in reader.records():
+    cells = values[len(FIELDS):]
+    levels = engine.evaluate(values[field['timestamp']], values[field['voltage']], values[field['current']],
+                             values[field['soc']], min(cells), max(cells),
+                             values[field['min_temperature']], values[field['max_temperature']])
+    slowest = max(slowest, engine.last_duration)
+    for k, level in enumerate(levels):
+      if level != previous[k]:
+        print("%s %s %d -> %d" % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(values[0])), engine.paths[k], previous[k], level))
+        previous[k] = level
+  print("slowest evaluation %.1f us, %d over budget" % (slowest * 1e6, engine.overruns))
+
+
+if __name__ == "__main__":
+  main()
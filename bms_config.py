@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# Configuration of dbus-json-bms, config.ini is parsed once per process. The values of a pack
+# are converted and checked once into a PackConfig, the sections shared by all packs ([POLL],
+# [HISTORY], [RECORDER], [COULOMB], [ALARMS], [PERF], [DEADBAND], Aggregate in [DEFAULT]) into
+# a ServiceConfig. An unknown key or a value out of range in these sections raises ValueError at
+# start, the features only get the converted values. [MAPPING] is checked when it is compiled.
+
+import os
+import configparser
+
+from bms_alarms import ALARM_RULES
+
+ACCESS_TYPES = ('OnPremise', 'Stream', 'JKSerial')
+FETCH_MODES = ('Thread', 'Blocking')
+MAX_CELLS = 32
+
+_config = None
+
+
+def getConfig():
+  global _config
+  if _config is None:
+    _config = configparser.ConfigParser()
+    _config.read("%s/config.ini" % (os.path.dirname(os.path.realpath(__file__))))
+  return _config
+
+
+def getBatteryConfig(config, pack):
+  # a pack section may override any key of [Battery], e.g. BatteryCapacity of a smaller pack
+  values = dict((key, config[pack].get(key, value)) for key, value in config['Battery'].items())
+  battery = configparser.ConfigParser()
+  battery.read_dict({'Battery': values})
+  return battery['Battery']
+
+
+class PackConfig:
+  def __init__(self, config, pack):
+    self.config = config
+    self.pack = pack
+    default = config['DEFAULT']
+    section = config[pack]
+    self.access_type = default['AccessType']
+    if self.access_type not in ACCESS_TYPES:
+      raise ValueError("AccessType %s is not supported" % (self.access_type))
+    self.fetch_mode = default.get('FetchMode', 'Thread')
+    if self.fetch_mode not in FETCH_MODES:
+      raise ValueError("FetchMode %s is not supported" % (self.fetch_mode))
+    # minutes
+    self.sign_of_life = int(default['SignOfLifeLog'] or 0)
+    # Host, optionally followed by more hosts for the same pack, primary first
+    self.urls = []
+    if self.access_type in ('OnPremise', 'Stream'):
+      for host in section['Host'].split(','):
+        if host.strip():
+          url = "http://%s:%s@%s" % (section['Username'], section['Password'], host.strip())
+          self.urls.append(url.replace(":@", ""))
+    if self.access_type == 'JKSerial':
+      # binary protocol of the BMS, tcp://host:port of a serial bridge or a serial device
+      self.port = section['Port']
+      self.baudrate = section.getint('BaudRate', 115200)
+      self.read_timeout = section.getfloat('ReadTimeout', 2)
+      self.current_encoding = section.get('CurrentEncoding', 'Auto')
+    self.stale_timeout = section.getfloat('StaleTimeout', 60)
+    if self.access_type == 'Stream':
+      self.stream_url = section['StreamUrl']
+      self.stream_protocol = section.get('StreamProtocol', 'SSE')
+      self.stream_reconnect_delay = section.getfloat('StreamReconnectDelay', 5)
+    mapping_section = section.get('Mapping', 'MAPPING')
+    self.mapping = config[mapping_section] if config.has_section(mapping_section) else None
+    # [Battery] with the overrides of the pack, the curves are compiled from it by the service
+    self.battery = battery = getBatteryConfig(config, pack)
+    self.number_of_cells = battery.getint('NumberOfCells')
+    if not 1 <= self.number_of_cells <= MAX_CELLS:
+      raise ValueError("NumberOfCells %d is not supported, 1 to %d" % (self.number_of_cells, MAX_CELLS))
+    self.capacity = battery.getint('BatteryCapacity')
+    self.min_cell_voltage = battery.getfloat('MinCellVoltage')
+    self.max_cell_voltage = battery.getfloat('MaxCellVoltage')
+    self.float_cell_voltage = battery.getfloat('FloatCellVoltage')
+    self.max_charge_current = battery.getfloat('MaxBatteryChargeCurrent')
+    self.max_discharge_current = battery.getfloat('MaxBatteryDischargeCurrent')
+    self.max_voltage_time = battery.getfloat('MaxVoltageTimeSec')
+    self.soc_level_reset_voltage = battery.getfloat('SOCLevelToResetVoltageLimit')
+    self.cccm_enable = battery.getboolean('CCCMEnable')
+    self.cvcm_enable = battery.getboolean('CVCMEnable')
+
+
+def getSection(config, name):
+  # an optional section, without it every key has its default
+  return config[name] if config.has_section(name) else config['DEFAULT']
+
+
+def checkKeys(config, name, keys):
+  # keys in lower case, as configparser returns them. The keys of [DEFAULT] show up in every section
+  if not config.has_section(name):
+    return
+  defaults = config.defaults()
+  for key in config[name]:
+    if key not in keys and key not in defaults:
+      raise ValueError("unknown key %s in [%s]" % (key, name))
+
+
+def checkPositive(name, section, **values):
+  for key, value in values.items():
+    if not value > 0:
+      raise ValueError("%s in [%s] must be greater than 0, not %s" % (key, section, value))
+
+
+class PollConfig:
+  # times in seconds
+  def __init__(self, config):
+    checkKeys(config, 'POLL', ('mininterval', 'interval', 'maxinterval', 'maxbackoff', 'fastcurrentchange',
+                               'fastcellvoltagechange', 'fastnearmaxcellvoltage', 'idlecurrent'))
+    poll = getSection(config, 'POLL')
+    self.min_interval = poll.getfloat('MinInterval', 0.5)
+    self.interval = poll.getfloat('Interval', 3.766)
+    self.max_interval = poll.getfloat('MaxInterval', 15)
+    self.max_backoff = poll.getfloat('MaxBackoff', 120)
+    self.fast_current_change = poll.getfloat('FastCurrentChange', 5)
+    self.fast_cell_voltage_change = poll.getfloat('FastCellVoltageChange', 0.005)
+    self.fast_near_max_cell_voltage = poll.getfloat('FastNearMaxCellVoltage', 0.03)
+    self.idle_current = poll.getfloat('IdleCurrent', 1)
+    checkPositive('POLL', 'POLL', MinInterval=self.min_interval, MaxBackoff=self.max_backoff)
+    if not self.min_interval <= self.interval <= self.max_interval:
+      raise ValueError("[POLL] needs MinInterval <= Interval <= MaxInterval")
+
+
+class HistoryConfig:
+  def __init__(self, config):
+    checkKeys(config, 'HISTORY', ('enable', 'hours', 'sampleinterval', 'loadstepcurrent'))
+    history = getSection(config, 'HISTORY')
+    self.enable = history.getboolean('Enable', False)
+    self.hours = history.getfloat('Hours', 24)
+    self.sample_interval = history.getfloat('SampleInterval', 10)
+    self.load_step_current = history.getfloat('LoadStepCurrent', 10)
+    checkPositive('HISTORY', 'HISTORY', Hours=self.hours, SampleInterval=self.sample_interval,
+                  LoadStepCurrent=self.load_step_current)
+
+
+class RecorderConfig:
+  def __init__(self, config):
+    checkKeys(config, 'RECORDER', ('enable', 'file', 'records', 'flushinterval'))
+    recorder = getSection(config, 'RECORDER')
+    self.enable = recorder.getboolean('Enable', False)
+    # {pack} is replaced by the name of the pack section in lower case
+    self.file = recorder.get('File', 'recorder_{pack}.bin')
+    self.records = recorder.getint('Records', 100000)
+    self.flush_interval = recorder.getfloat('FlushInterval', 300)
+    checkPositive('RECORDER', 'RECORDER', Records=self.records)
+    if self.flush_interval < 0:
+      raise ValueError("FlushInterval in [RECORDER] must not be negative")
+
+
+class CoulombConfig:
+  def __init__(self, config):
+    checkKeys(config, 'COULOMB', ('enable', 'file', 'maxgap', 'saveinterval', 'socwindow'))
+    coulomb = getSection(config, 'COULOMB')
+    self.enable = coulomb.getboolean('Enable', True)
+    self.file = coulomb.get('File', 'coulomb_{pack}.bin')
+    self.max_gap = coulomb.getfloat('MaxGap', 30)
+    self.save_interval = coulomb.getfloat('SaveInterval', 300)
+    self.soc_window = coulomb.getfloat('SocWindow', 1)
+    checkPositive('COULOMB', 'COULOMB', MaxGap=self.max_gap, SaveInterval=self.save_interval)
+    if self.soc_window < 0:
+      raise ValueError("SocWindow in [COULOMB] must not be negative")
+
+
+class AlarmConfig:
+  def __init__(self, config):
+    names = [path[len('/Alarms/'):] for path, _, _ in ALARM_RULES]
+    checkKeys(config, 'ALARMS', ['budgetms'] + [name.lower() for name in names])
+    alarms = getSection(config, 'ALARMS')
+    # seconds one evaluation may take
+    self.budget = alarms.getfloat('BudgetMs', 2) / 1000
+    # alarm name -> (warning, alarm, hysteresis, delay) for the alarms set in config.ini,
+    # the others keep the defaults of bms_alarms.defaultThresholds
+    self.thresholds = {}
+    if config.has_section('ALARMS'):
+      for name in names:
+        value = alarms.get(name)
+        if not value:
+          continue
+        try:
+          threshold = tuple(float(part) for part in value.split(','))
+        except ValueError:
+          threshold = ()
+        if len(threshold) != 4 or threshold[2] < 0 or threshold[3] < 0:
+          raise ValueError("%s in [ALARMS] needs warning, alarm, hysteresis, delay, not %s" % (name, value))
+        self.thresholds[name] = threshold
+
+
+class PerfConfig:
+  def __init__(self, config):
+    checkKeys(config, 'PERF', ('interval', 'metricsport'))
+    perf = getSection(config, 'PERF')
+    # seconds, 0 = off
+    self.interval = perf.getfloat('Interval', 10)
+    self.metrics_port = perf.getint('MetricsPort', 0)
+    if self.interval < 0:
+      raise ValueError("Interval in [PERF] must not be negative")
+    if not 0 <= self.metrics_port <= 65535:
+      raise ValueError("MetricsPort %d in [PERF] is not a port" % (self.metrics_port))
+
+
+def getDeadbands(config):
+  # [DEADBAND] maps a path prefix to the change needed before a new value is published,
+  # the longest matching prefix wins. configparser lower-cases the keys, so matching is case insensitive
+  deadbands = []
+  if config.has_section('DEADBAND'):
+    defaults = config.defaults()
+    for key, value in config['DEADBAND'].items():
+      if key in defaults:
+        continue
+      if not key.startswith('/'):
+        raise ValueError("%s in [DEADBAND] is not a dbus path" % (key))
+      deadband = float(value)
+      if deadband < 0:
+        raise ValueError("deadband of %s must not be negative" % (key))
+      deadbands.append((key, deadband))
+  deadbands.sort(key=lambda deadband: len(deadband[0]), reverse=True)
+  return deadbands
+
+
+class ServiceConfig:
+  # the sections shared by all packs of the process
+  def __init__(self, config):
+    self.poll = PollConfig(config)
+    self.history = HistoryConfig(config)
+    self.recorder = RecorderConfig(config)
+    self.coulomb = CoulombConfig(config)
+    self.alarms = AlarmConfig(config)
+    self.perf = PerfConfig(config)
+    self.deadbands = getDeadbands(config)
+    default = config['DEFAULT']
+    self.aggregate = default.getboolean('Aggregate', False)
+    self.aggregate_device_instance = default.getint('AggregateDeviceInstance', 39)
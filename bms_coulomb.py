@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Coulomb counter of one pack: Ah and Wh charged and discharged, integrated from the current and
+# voltage of every sample, and a fractional SoC between the integer steps of the BMS.
+#
+# Between two samples current and power are taken as linear (trapezoidal rule). When the current
+# changes sign in between, the interval is split at the zero crossing so the charged and the
+# discharged part each go to their own counter. Timestamps come from a monotonic clock. A gap
+# longer than max_gap (failed fetches, a stopped service) is not integrated, nobody knows what
+# flowed in it, the BMS SoC corrects the fractional SoC afterwards.
+#
+# The fractional SoC starts at the SoC of the BMS, follows the counted Ah and is kept within
+# soc_window of the SoC the BMS reports, so it can not drift away from the BMS calibration.
+#
+# The counters are kept across restarts in a small state file, rewritten every save_interval
+# seconds through a temporary file and os.replace, so a power cut leaves the old or the new state,
+# never a broken one, and at most save_interval seconds are lost.
+#
+# File layout (little endian): STATE, magic, charged Ah, discharged Ah, charged Wh,
+# discharged Wh, fractional SoC (NaN before the first sample), unix time of the save
+
+import os
+import math
+import struct
+
+MAGIC = b'JSONBMC1'
+STATE = struct.Struct('<8sdddddd')
+
+
+class CoulombCounter:
+  def __init__(self, capacity, filename=None, max_gap=30, save_interval=300, soc_window=1.0):
+    # capacity in Ah
+    self.capacity = float(capacity)
+    self.filename = filename
+    self.max_gap = max_gap
+    self.save_interval = save_interval
+    self.soc_window = soc_window
+    self.charged_ah = 0.0
+    self.discharged_ah = 0.0
+    self.charged_wh = 0.0
+    self.discharged_wh = 0.0
+    self.soc = None
+    self.gaps = 0
+    self.voltage = 0.0
+    self.current = 0.0
+    self._last_time = None
+    self._last_power = 0.0
+    self._last_save = None
+    self._saved_soc = None
+    if filename is not None:
+      self.load()
+
+  def load(self):
+    # a missing or foreign file starts from zero
+    try:
+      with open(self.filename, 'rb') as f:
+        data = f.read(STATE.size + 1)
+    except (IOError, OSError):
+      return False
+    if len(data) != STATE.size:
+      return False
+    magic, charged_ah, discharged_ah, charged_wh, discharged_wh, soc, saved = STATE.unpack(data)
+    if magic != MAGIC:
+      return False
+    self.charged_ah = charged_ah
+    self.discharged_ah = discharged_ah
+    self.charged_wh = charged_wh
+    self.discharged_wh = discharged_wh
+    # only a start value, the first sample checks it against the BMS
+    self._saved_soc = None if math.isnan(soc) else soc
+    return True
+
+  def save(self, timestamp, now):
+    # timestamp from the monotonic clock of add(), now is the unix time stored in the file
+    self._last_save = timestamp
+    data = STATE.pack(MAGIC, self.charged_ah, self.discharged_ah, self.charged_wh, self.discharged_wh,
+                      float('nan') if self.soc is None else self.soc, now)
+    temporary = self.filename + '.tmp'
+    with open(temporary, 'wb') as f:
+      f.write(data)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temporary, self.filename)
+
+  def saveDue(self, timestamp):
+    if self.filename is None:
+      return False
+    if self._last_save is None:
+      self._last_save = timestamp
+    return timestamp - self._last_save >= self.save_interval
+
+  def _count(self, seconds, current_sum, power_sum):
+    # one part of an interval without a change of sign, the sums are of both ends
+    if current_sum >= 0:
+      self.charged_ah += current_sum * seconds / 7200.0
+      self.charged_wh += power_sum * seconds / 7200.0
+    else:
+      self.discharged_ah -= current_sum * seconds / 7200.0
+      self.discharged_wh -= power_sum * seconds / 7200.0
+
+  def add(self, timestamp, voltage, current, soc):
+    # timestamp from a monotonic clock, current positive while charging, soc of the BMS in %
+    power = voltage * current
+    net_ah = 0.0
+    if self._last_time is not None:
+      seconds = timestamp - self._last_time
+      if seconds > self.max_gap:
+        self.gaps += 1
+      elif seconds > 0:
+        last = self.current
+        if (last < 0 < current) or (current < 0 < last):
+          # current and power are zero at the crossing
+          first = seconds * last / (last - current)
+          self._count(first, last, self._last_power)
+          self._count(seconds - first, current, power)
+        else:
+          self._count(seconds, last + current, self._last_power + power)
+        net_ah = (last + current) * seconds / 7200.0
+    self._last_time = timestamp
+    self._last_power = power
+    self.voltage = voltage
+    self.current = current
+    if self.soc is None:
+      saved = self._saved_soc
+      self.soc = saved if saved is not None and abs(saved - soc) <= self.soc_window else float(soc)
+    else:
+      self.soc += net_ah * 100.0 / self.capacity
+    self.soc = min(max(self.soc, soc - self.soc_window, 0.0), soc + self.soc_window, 100.0)
+
+  def repeat(self, timestamp, soc):
+    # the source reported no change since the last sample, the values still hold up to now
+    if self._last_time is not None:
+      self.add(timestamp, self.voltage, self.current, soc)
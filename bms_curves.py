@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Piecewise linear control curves for the charge/discharge limits (CCCM/CVCM).
+#
+# A curve is written as "x:y, x:y, ..." e.g. ChargeCurrentSoc = 0:1, 91:1, 92:0.5, 100:0.1
+# and compiled at start into an evenly spaced lookup table, so a lookup is one index
+# calculation and one linear interpolation between two table entries, whatever the number of
+# points. Below the first and above the last point the curve stays at the end value.
+# In a current curve a y with the unit A is an absolute current, e.g. 99:5A, and is turned into
+# the factor of the max current the curve is compiled for.
+#
+# The RateLimiter ramps an output towards its target with at most RampUp/RampDown per second,
+# 0 means the output follows immediately.
+
+from array import array
+
+# the SoC steps of earlier versions: a fixed 5 A above 98 % when charging and up to 10 % when
+# discharging, half and a quarter of the max current in between
+DEFAULT_CHARGE_CURRENT_SOC = '0:1, 91:1, 92:0.5, 95:0.5, 96:0.25, 98:0.25, 99:5A, 100:5A'
+DEFAULT_DISCHARGE_CURRENT_SOC = '0:5A, 10:5A, 11:0.5, 20:0.5, 21:1, 100:1'
+
+
+def parseCurve(text, full=None):
+  # "x:y, x:y" -> sorted list of (x, y), empty text -> None. y "<n>A" is n / full
+  points = []
+  for point in text.split(','):
+    point = point.strip()
+    if point:
+      x, y = point.split(':')
+      y = y.strip()
+      if y[-1:] in ('A', 'a'):
+        if not full:
+          raise ValueError("curve point %s in A needs a max current" % (point))
+        points.append((float(x), float(y[:-1]) / full))
+      else:
+        points.append((float(x), float(y)))
+  points.sort()
+  return points or None
+
+
+def interpolate(points, x):
+  if x <= points[0][0]:
+    return points[0][1]
+  for k in range(1, len(points)):
+    x1, y1 = points[k]
+    if x <= x1:
+      x0, y0 = points[k - 1]
+      return y0 + (y1 - y0) * (x - x0) / (x1 - x0) if x1 > x0 else y1
+  return points[-1][1]
+
+
+class Curve:
+  def __init__(self, points, size=1000):
+    self.points = points
+    self.x0 = points[0][0]
+    span = points[-1][0] - self.x0
+    self.size = size if span > 0 else 0
+    self.scale = size / span if span > 0 else 0.0
+    self.table = array('d', [interpolate(points, self.x0 + i / self.scale) for i in range(size + 1)]
+                       if span > 0 else [points[0][1]])
+
+  def __call__(self, x):
+    position = (x - self.x0) * self.scale
+    if position <= 0:
+      return self.table[0]
+    if position >= self.size:
+      return self.table[self.size]
+    i = int(position)
+    low = self.table[i]
+    return low + (position - i) * (self.table[i + 1] - low)
+
+
+def compileCurve(text, size=1000, full=None):
+  # full: max current of a current curve, for points in A
+  points = parseCurve(text or '', full)
+  return Curve(points, size) if points else None
+
+
+class RateLimiter:
+  def __init__(self, ramp_up=0.0, ramp_down=0.0):
+    self.ramp_up = ramp_up
+    self.ramp_down = ramp_down
+    self.value = None
+    self._last = None
+
+  def reset(self, value, now=None):
+    self.value = value
+    self._last = now
+
+  def __call__(self, now, target):
+    if self.value is None or self._last is None:
+      self.reset(target, now)
+      return target
+    dt = now - self._last
+    self._last = now
+    if target > self.value and self.ramp_up > 0:
+      self.value = min(target, self.value + self.ramp_up * dt)
+    elif target < self.value and self.ramp_down > 0:
+      self.value = max(target, self.value - self.ramp_down * dt)
+    else:
+      self.value = target
+    return self.value
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Bounded in-memory history of the cell data of one pack with rolling per-cell statistics.
+#
+# Samples are decimated to one every SampleInterval seconds and kept in fixed-size ring
+# buffers from the array module, allocated once at start. Memory is strictly bounded:
+#   slots = Hours * 3600 / SampleInterval
+#   bytes = slots * (4 * cells  +  4 current + 4 temperature + 4 imbalance + 8 timestamp)
+# e.g. 16 cells, 24 h, 10 s: 8640 slots * 84 bytes = 725,760 bytes (~709 KiB) plus two sets
+# of per-cell accumulators. memoryUsage() returns the exact number.
+#
+# Mean and standard deviation per cell and the imbalance slope (linear regression of
+# max-min cell voltage over time) are kept as running sums, adding the new and removing the
+# overwritten sample costs O(cells) per stored sample. To cancel floating point drift a second
+# set of sums is built from scratch after every wrap of the ring, REBUILD_CHUNK slots per stored
+# sample so no single add() blocks the main loop, and replaces the running sums when done. The
+# internal resistance per cell is estimated as dV/dI between two consecutive raw samples across
+# a load step and smoothed.
+
+import math
+from array import array
+
+# slots added to the rebuilt sums per stored sample, 16 cells take well below 1 ms
+REBUILD_CHUNK = 64
+
+
+class RunningSums:
+  # per cell sum and sum of squares, sums for the imbalance regression with t relative to t0
+  def __init__(self, number_of_cells):
+    self.sum = array('d', [0.0]) * number_of_cells
+    self.sumsq = array('d', [0.0]) * number_of_cells
+    self.reset(0.0)
+
+  def reset(self, t0):
+    for i in range(len(self.sum)):
+      self.sum[i] = self.sumsq[i] = 0.0
+    self.t0 = t0
+    self.st = self.stt = self.sy = self.sty = 0.0
+
+
+class CellHistory:
+  def __init__(self, number_of_cells, hours=24, sample_interval=10, load_step_current=10, max_step_time=10):
+    self.number_of_cells = number_of_cells
+    self.sample_interval = sample_interval
+    self.load_step_current = load_step_current
+    self.max_step_time = max_step_time
+    self.size = max(int(hours * 3600 / sample_interval), 2)
+    self.voltages = array('f', [0.0]) * (self.size * number_of_cells)
+    self.current = array('f', [0.0]) * self.size
+    self.temperature = array('f', [0.0]) * self.size
+    self.imbalance = array('f', [0.0]) * self.size
+    self.times = array('d', [0.0]) * self.size
+    self.position = 0
+    self.count = 0
+    self._last_stored = None
+    # the running sums and the ones rebuilt after a wrap, the rebuild has added the slots
+    # below _rebuild_at, None while no rebuild runs
+    self._sums = RunningSums(number_of_cells)
+    self._rebuilt = RunningSums(number_of_cells)
+    self._rebuild_at = None
+    # last raw sample and smoothed resistance for dV/dI
+    self._raw_time = None
+    self._raw_current = 0.0
+    self._raw_volt = array('d', [0.0]) * number_of_cells
+    self.resistance = array('d', [0.0]) * number_of_cells
+    self.resistance_valid = False
+
+  def memoryUsage(self):
+    buffers = (self.voltages, self.current, self.temperature, self.imbalance, self.times,
+               self._sums.sum, self._sums.sumsq, self._rebuilt.sum, self._rebuilt.sumsq, self._raw_volt, self.resistance)
+    return sum(buffer.buffer_info()[1] * buffer.itemsize for buffer in buffers)
+
+  def add(self, timestamp, cell_volt, current, temperature):
+    # timestamp from a monotonic clock, returns True when the sample was stored in the ring
+    self._estimateResistance(timestamp, cell_volt, current)
+    if self._last_stored is not None and timestamp - self._last_stored < self.sample_interval:
+      return False
+    self._last_stored = timestamp
+    if not self.count:
+      self._sums.reset(timestamp)
+    n = self.number_of_cells
+    pos = self.position
+    base = pos * n
+    voltages = self.voltages
+    # the slots below _rebuild_at are in the rebuilt sums as well
+    rebuilt = self._rebuild_at is not None and pos < self._rebuild_at
+    if self.count == self.size:
+      self._accumulate(self._sums, pos, -1.0)
+      if rebuilt:
+        self._accumulate(self._rebuilt, pos, -1.0)
+    low = high = cell_volt[0]
+    for i in range(n):
+      value = cell_volt[i]
+      if value < low:
+        low = value
+      elif value > high:
+        high = value
+      voltages[base + i] = value
+    self.current[pos] = current
+    self.temperature[pos] = temperature
+    self.imbalance[pos] = high - low
+    self.times[pos] = timestamp
+    self._accumulate(self._sums, pos, 1.0)
+    if rebuilt:
+      self._accumulate(self._rebuilt, pos, 1.0)
+    if self.count < self.size:
+      self.count += 1
+    self.position = pos + 1
+    if self.position == self.size:
+      self.position = 0
+      # fresh sums without drift, with the time origin at the newest sample
+      self._rebuilt.reset(timestamp)
+      self._rebuild_at = 0
+    if self._rebuild_at is not None:
+      self._rebuildChunk()
+    return True
+
+  def _accumulate(self, sums, pos, sign):
+    # adds (sign 1) or removes (sign -1) slot pos, the values as stored (float32), so removing
+    # a slot subtracts exactly what was added
+    n = self.number_of_cells
+    base = pos * n
+    voltages = self.voltages
+    total = sums.sum
+    squares = sums.sumsq
+    for i in range(n):
+      value = voltages[base + i]
+      total[i] += sign * value
+      squares[i] += sign * value * value
+    t = self.times[pos] - sums.t0
+    y = self.imbalance[pos]
+    sums.st += sign * t
+    sums.stt += sign * t * t
+    sums.sy += sign * y
+    sums.sty += sign * t * y
+
+  def _rebuildChunk(self):
+    start = self._rebuild_at
+    end = min(start + REBUILD_CHUNK, self.count)
+    for j in range(start, end):
+      self._accumulate(self._rebuilt, j, 1.0)
+    if end < self.count:
+      self._rebuild_at = end
+      return
+    self._sums, self._rebuilt = self._rebuilt, self._sums
+    self._rebuild_at = None
+
+  def _estimateResistance(self, timestamp, cell_volt, current):
+    n = self.number_of_cells
+    step = current - self._raw_current
+    if (self._raw_time is not None and abs(step) >= self.load_step_current
+        and timestamp - self._raw_time <= self.max_step_time):
+      for i in range(n):
+        r = (cell_volt[i] - self._raw_volt[i]) / step
+        if r <= 0:
+          # cell voltage moved against the current, not a clean load step
+          continue
+        if self.resistance[i] == 0.0:
+          self.resistance[i] = r
+        else:
+          self.resistance[i] += 0.2 * (r - self.resistance[i])
+      self.resistance_valid = True
+    self._raw_time = timestamp
+    self._raw_current = current
+    for i in range(n):
+      self._raw_volt[i] = cell_volt[i]
+
+  def mean(self, cell):
+    return self._sums.sum[cell] / self.count if self.count else None
+
+  def stddev(self, cell):
+    if not self.count:
+      return None
+    mean = self._sums.sum[cell] / self.count
+    return math.sqrt(max(self._sums.sumsq[cell] / self.count - mean * mean, 0.0))
+
+  def imbalanceSlope(self):
+    # change of max-min cell voltage in V per hour over the window
+    n = self.count
+    sums = self._sums
+    denominator = n * sums.stt - sums.st * sums.st
+    if n < 2 or denominator <= 0:
+      return None
+    return (n * sums.sty - sums.st * sums.sy) / denominator * 3600
+
+  def window(self):
+    # hours covered by the stored samples
+    if self.count < 2:
+      return 0.0
+    newest = self.times[self.position - 1]
+    oldest = self.times[self.position if self.count == self.size else 0]
+    return (newest - oldest) / 3600
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+# JK BMS binary protocol of the RS485/GPS port ("4E 57" frames), read directly from a TCP serial
+# bridge (ser2net in raw mode, tcp://host:port) or a local serial port (needs pyserial), instead of
+# a bridge rendering JSON.
+#
+# Frame: 4E 57, length (2, from the length field to the end), terminal number (4), command (1,
+# 0x06 read all), frame source (1), transport type (1, 0 request, 1 response, 2 upload), data,
+# record number (4), end flag 0x68, checksum (4, the low 2 bytes are the sum of all bytes before).
+# The data is a list of fields, an id byte followed by a value of fixed length per id, except the
+# cell voltages: 0x79, length, then per cell its number and the voltage in mV.
+#
+# Frames are received into one preallocated buffer and decoded in place with struct.unpack_from
+# on a memoryview, the frame returned by read() is a view into that buffer and valid until the
+# next read().
+
+import time
+import socket
+import struct
+from array import array
+
+HEADER = b'\x4e\x57'
+# read all data, from the PC port
+READ_ALL = bytes.fromhex('4e 57 00 13 00 00 00 00 06 03 00 00 00 00 00 00 68 00 00 01 29')
+END_FLAG = 0x68
+# header, length, terminal, command, source, transport .. record number, end flag, checksum
+MIN_FRAME = 20
+DATA_OFFSET = 11
+TRAILER = 9
+# after a corrupted frame, seconds to wait for a valid one before the read fails
+CORRUPTED_GAP = 0.2
+
+CELLS = 0x79
+POWER_TUBE_TEMPERATURE = 0x80
+BOX_TEMPERATURE = 0x81
+BATTERY_TEMPERATURE = 0x82
+VOLTAGE = 0x83
+CURRENT = 0x84
+SOC = 0x85
+CYCLES = 0x87
+STATUS = 0x8C
+PROTOCOL_VERSION = 0xC0
+
+# value length of every field id, the parameters 0x8E .. 0xBA are walked over but not used
+FIELD_LENGTHS = {
+  0x80: 2, 0x81: 2, 0x82: 2, 0x83: 2, 0x84: 2, 0x85: 1, 0x86: 1, 0x87: 2, 0x89: 4, 0x8A: 2, 0x8B: 2, 0x8C: 2,
+  0x8E: 2, 0x8F: 2, 0x90: 2, 0x91: 2, 0x92: 2, 0x93: 2, 0x94: 2, 0x95: 2, 0x96: 2, 0x97: 2, 0x98: 2, 0x99: 2,
+  0x9A: 2, 0x9B: 2, 0x9C: 2, 0x9D: 1, 0x9E: 2, 0x9F: 2, 0xA0: 2, 0xA1: 2, 0xA2: 2, 0xA3: 2, 0xA4: 2, 0xA5: 2,
+  0xA6: 2, 0xA7: 2, 0xA8: 2, 0xA9: 1, 0xAA: 4, 0xAB: 1, 0xAC: 1, 0xAD: 2, 0xAE: 1, 0xAF: 1, 0xB0: 2, 0xB1: 1,
+  0xB2: 10, 0xB3: 1, 0xB4: 8, 0xB5: 4, 0xB6: 4, 0xB7: 15, 0xB8: 1, 0xB9: 4, 0xBA: 24, 0xC0: 1,
+}
+# the fields a sample can not do without
+REQUIRED = (BOX_TEMPERATURE, BATTERY_TEMPERATURE, VOLTAGE, CURRENT, SOC, CYCLES, STATUS)
+
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+
+
+def validFrame(buffer, start, length):
+  # end flag and checksum of the frame buffer[start:start + length], buffer a memoryview so the
+  # sum runs over the received bytes without a copy
+  end = start + length
+  if buffer[end - 5] != END_FLAG:
+    return False
+  return sum(buffer[start:end - 4]) & 0xFFFF == _U16.unpack_from(buffer, end - 2)[0]
+
+
+def temperature(raw):
+  # 0..100 are degrees, above that 101 is -1 degree
+  return float(raw) if raw <= 100 else float(100 - raw)
+
+
+class JKFrameDecoder:
+  # Same interface as bms_mapping.JSONBMSMapping: extract() fills the dict sample with the values
+  # of the JK JSON dialect and the cell voltages in place.
+  # CurrentEncoding: Sign (protocol version 1, bit 15 set while charging), Offset (older
+  # firmware, 10000 is 0 A, below is discharging) or Auto from the protocol version field 0xC0,
+  # Sign when the frame has none
+  def __init__(self, number_of_cells, current_encoding='Auto'):
+    if current_encoding not in ('Auto', 'Sign', 'Offset'):
+      raise ValueError("CurrentEncoding %s is not supported" % (current_encoding))
+    self.number_of_cells = number_of_cells
+    self.current_encoding = current_encoding
+    self._values = array('q', [-1]) * 256
+
+  def extract(self, frame, sample, cell_volt):
+    values = self._values
+    for code in REQUIRED:
+      values[code] = -1
+    values[PROTOCOL_VERSION] = -1
+    cells = 0
+    offset = DATA_OFFSET
+    end = len(frame) - TRAILER
+    while offset < end:
+      code = frame[offset]
+      if code == CELLS:
+        size = frame[offset + 1]
+        for k in range(offset + 2, offset + 2 + size - 2, 3):
+          number = frame[k]
+          if 1 <= number <= self.number_of_cells:
+            cell_volt[number - 1] = _U16.unpack_from(frame, k + 1)[0] / 1000.0
+            cells += 1
+        offset += 2 + size
+        continue
+      length = FIELD_LENGTHS.get(code)
+      if length is None:
+        # unknown id, the fields used here all come before
+        break
+      if length == 1:
+        values[code] = frame[offset + 1]
+      elif length == 2:
+        values[code] = _U16.unpack_from(frame, offset + 1)[0]
+      elif length == 4:
+        values[code] = _U32.unpack_from(frame, offset + 1)[0]
+      offset += 1 + length
+    if cells < self.number_of_cells:
+      raise ValueError("JK frame has %d of %d cells" % (cells, self.number_of_cells))
+    for code in REQUIRED:
+      if values[code] < 0:
+        raise ValueError("JK frame without field 0x%02X" % (code))
+    raw = values[CURRENT]
+    if self.current_encoding == 'Offset' or (self.current_encoding == 'Auto' and values[PROTOCOL_VERSION] not in (-1, 1)):
+      current = (raw - 10000) * 0.01
+    elif raw & 0x8000:
+      current = (raw & 0x7FFF) * 0.01
+    else:
+      current = (raw & 0x7FFF) * -0.01
+    voltage = values[VOLTAGE] * 0.01
+    status = values[STATUS]
+    sample['Soc'] = values[SOC]
+    sample['Voltage'] = voltage
+    sample['Current'] = current
+    sample['Power'] = voltage * current
+    sample['Temperature1'] = temperature(values[BOX_TEMPERATURE])
+    sample['Temperature2'] = temperature(values[BATTERY_TEMPERATURE])
+    sample['ChargeCycles'] = values[CYCLES]
+    sample['Charge'] = 'on' if status & 0x01 else 'off'
+    sample['Discharge'] = 'on' if status & 0x02 else 'off'
+
+
+class JKBMSConnection:
+  # Request/response with one BMS. read() sends the read-all request and returns the first valid
+  # response frame, skipping noise, corrupted frames and the echo of the request which RS485
+  # adapters send back. Raises OSError or ValueError, the caller closes and the next read()
+  # connects again, so a late answer to a timed out request is never taken for a new one.
+  def __init__(self, port, baudrate=115200, timeout=2.0, buffer_size=2048):
+    self.port = port
+    self.baudrate = baudrate
+    self.timeout = timeout
+    self._buffer = bytearray(buffer_size)
+    self._view = memoryview(self._buffer)
+    self._connection = None
+    self.corrupted = 0
+
+  def _connect(self):
+    if self.port.startswith('tcp://'):
+      host, _, port = self.port[len('tcp://'):].rpartition(':')
+      connection = socket.create_connection((host, int(port)), timeout=self.timeout)
+      connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      self._send = connection.sendall
+      self._receive = connection.recv_into
+      self._settimeout = connection.settimeout
+    else:
+      import serial # pyserial, only needed for a local serial port
+      connection = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+      self._send = connection.write
+      self._receive = connection.readinto
+      # changing the timeout reconfigures the port, a serial read always waits up to timeout
+      self._settimeout = None
+    self._connection = connection
+
+  def close(self):
+    if self._connection is not None:
+      try:
+        self._connection.close()
+      except OSError:
+        pass
+      self._connection = None
+
+  def read(self):
+    if self._connection is None:
+      self._connect()
+    self._send(READ_ALL)
+    buffer = self._buffer
+    deadline = time.monotonic() + self.timeout
+    scan = 0
+    end = 0
+    while True:
+      # look for a complete frame in buffer[scan:end]
+      start = buffer.find(HEADER, scan, end)
+      while start >= 0 and end - start >= 4:
+        length = _U16.unpack_from(buffer, start + 2)[0] + 2
+        if length < MIN_FRAME or length > len(buffer):
+          self.corrupted += 1
+        elif end - start < length:
+          break
+        elif not validFrame(self._view, start, length):
+          self.corrupted += 1
+          deadline = min(deadline, time.monotonic() + CORRUPTED_GAP)
+        elif buffer[start + 10] != 0:
+          return self._view[start:start + length]
+        start = buffer.find(HEADER, start + 1, end)
+      # keep a header which is not complete yet, or the last byte in case it is the first of one
+      scan = start if start >= 0 else max(end - 1, 0)
+      if end == len(buffer):
+        raise ValueError("no valid JK frame in %d bytes" % (end))
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        raise socket.timeout("no valid JK frame within %.1fs" % (self.timeout))
+      if self._settimeout is not None:
+        self._settimeout(remaining)
+      received = self._receive(self._view[end:])
+      if not received:
+        raise ConnectionError("JK BMS %s closed the connection or timed out" % (self.port))
+      end += received
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Declarative mapping from the JSON document of a BMS to the values used by dbus-json-bms.
+#
+# Every field is described as "source path, type[, scale[, default]]", e.g.
+#   Current = Battery.Charge_Current, float
+#   Cell = Cells[{index}], float, 0.001
+# A source path is a list of keys separated by '.', "[n]" selects an element of a JSON array.
+# In the Cell path {index} is replaced by the cell index counted from 0, {number} counted from 1.
+# The mapping is compiled once into accessors, extract() only walks precomputed keys.
+
+import re
+
+# fastest available JSON parser, all of them accept bytes and str
+try:
+  import orjson
+  loads = orjson.loads
+except ImportError:
+  try:
+    import ujson
+    loads = ujson.loads
+  except ImportError:
+    import json
+    loads = json.loads
+
+# field name -> mapping of the JK BMS dialect
+DEFAULT_MAPPING = {
+  'Soc': 'Battery.Percent_Remain, int',
+  'Voltage': 'Battery.Battery_Voltage, float',
+  'Current': 'Battery.Charge_Current, float',
+  'Power': 'Battery.Battery_Power, float',
+  'Temperature1': 'Battery.Battery_T1, float',
+  'Temperature2': 'Battery.Battery_T2, float',
+  'ChargeCycles': 'Battery.Cycle_Count, int',
+  'Charge': 'Battery.Charge, str',
+  'Discharge': 'Battery.Discharge, str',
+  'Cell': 'Cell.{index}, float',
+}
+
+TYPES = {
+  'int': int,
+  'float': float,
+  'str': str,
+  'bool': lambda value: value in (True, 1, '1', 'on', 'true', 'True'),
+}
+
+_SEGMENT = re.compile(r'\[(\d+)\]')
+
+_NO_DEFAULT = object()
+
+
+def parseSourcePath(path):
+  keys = []
+  for segment in path.split('.'):
+    name = _SEGMENT.split(segment)
+    # split gives name, index, '', index, '' ...
+    if name[0]:
+      keys.append(name[0])
+    keys.extend(int(index) for index in name[1::2])
+  return tuple(keys)
+
+
+def compileAccessor(keys):
+  if len(keys) == 1:
+    key, = keys
+    return lambda data: data[key]
+  if len(keys) == 2:
+    key1, key2 = keys
+    return lambda data: data[key1][key2]
+  if len(keys) == 3:
+    key1, key2, key3 = keys
+    return lambda data: data[key1][key2][key3]
+  def accessor(data):
+    for key in keys:
+      data = data[key]
+    return data
+  return accessor
+
+
+class CompiledField:
+  __slots__ = ('name', 'get', 'convert', 'scale', 'default')
+
+  def __init__(self, name, spec, **path_format):
+    parts = [part.strip() for part in spec.split(',')]
+    if len(parts) < 2 or parts[1] not in TYPES:
+      raise ValueError("Mapping %s = %s needs 'source path, type[, scale[, default]]'" % (name, spec))
+    self.name = name
+    self.get = compileAccessor(parseSourcePath(parts[0].format(**path_format)))
+    self.convert = TYPES[parts[1]]
+    self.scale = float(parts[2]) if len(parts) > 2 and parts[2] else None
+    self.default = self.convert(parts[3]) if len(parts) > 3 else _NO_DEFAULT
+
+  def extract(self, data):
+    try:
+      value = self.convert(self.get(data))
+    except (KeyError, IndexError, TypeError):
+      if self.default is _NO_DEFAULT:
+        raise
+      return self.default
+    if self.scale is not None:
+      value = value * self.scale
+    return value
+
+
+class JSONBMSMapping:
+  # mapping: field name -> spec, missing fields are taken from DEFAULT_MAPPING
+  def __init__(self, number_of_cells, mapping=None):
+    specs = dict(DEFAULT_MAPPING)
+    if mapping:
+      # configparser lower-cases keys, match them with the field names case insensitive
+      names = dict((name.lower(), name) for name in DEFAULT_MAPPING)
+      for key, spec in mapping.items():
+        if key.lower() in names:
+          specs[names[key.lower()]] = spec
+    self.number_of_cells = number_of_cells
+    self.fields = tuple(CompiledField(name, spec) for name, spec in specs.items() if name != 'Cell')
+    self.cells = tuple(CompiledField('Cell', specs['Cell'], index=i, number=i + 1) for i in range(number_of_cells))
+
+  def extract(self, data, sample, cell_volt):
+    # fills the dict sample and the list cell_volt in place
+    for field in self.fields:
+      sample[field.name] = field.extract(data)
+    i = 0
+    for cell in self.cells:
+      cell_volt[i] = cell.extract(data)
+      i += 1
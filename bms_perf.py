@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Hot-path instrumentation of dbus-json-bms: per pack the duration of every phase of an update
+# (fetch, parse, control, publish) and the drift of the poll timer are kept in small fixed-size
+# rings. Recording is one perf_counter() call and one array store per phase, percentiles are only
+# computed when the numbers are published (/Mgmt/Perf/*) or scraped from the optional
+# Prometheus text endpoint on localhost.
+
+import time
+import threading
+from array import array
+
+PHASES = ('Fetch', 'Parse', 'Control', 'Publish', 'LoopDrift')
+
+
+class PerfWindow:
+  def __init__(self, size=256):
+    self.values = array('d', [0.0]) * size
+    self.size = size
+    self.position = 0
+    self.count = 0
+
+  def add(self, value):
+    # the latency of a source is added from the threads of a hedged fetch, without a lock two adds
+    # at once may lose a value but never leave position or count out of range
+    position = self.position % self.size
+    self.values[position] = value
+    self.position = (position + 1) % self.size
+    self.count = min(self.count + 1, self.size)
+
+  def summary(self):
+    # p50, p95, max in seconds, None while empty
+    if not self.count:
+      return None, None, None
+    values = sorted(self.values[:self.count])
+    last = self.count - 1
+    return values[int(last * 0.5)], values[int(last * 0.95)], values[last]
+
+
+class PackPerf:
+  def __init__(self, name):
+    self.name = name
+    self.windows = dict((phase, PerfWindow()) for phase in PHASES)
+    self.fetch_failures = 0
+    self.last_update = 0
+    self.published = 0
+    self.suppressed = 0
+
+  def add(self, phase, seconds):
+    self.windows[phase].add(seconds)
+
+  def dataAge(self):
+    return time.time() - self.last_update if self.last_update else None
+
+
+def prometheusText(packs):
+  lines = ['# TYPE jsonbms_phase_seconds summary', '# TYPE jsonbms_fetch_failures_total counter',
+           '# TYPE jsonbms_data_age_seconds gauge', '# TYPE jsonbms_dbus_values_total counter']
+  for perf in packs:
+    for phase in PHASES:
+      p50, p95, maximum = perf.windows[phase].summary()
+      if p50 is None:
+        continue
+      for quantile, value in (('0.5', p50), ('0.95', p95), ('1', maximum)):
+        lines.append('jsonbms_phase_seconds{pack="%s",phase="%s",quantile="%s"} %.6f' % (perf.name, phase.lower(), quantile, value))
+    lines.append('jsonbms_fetch_failures_total{pack="%s"} %d' % (perf.name, perf.fetch_failures))
+    age = perf.dataAge()
+    if age is not None:
+      lines.append('jsonbms_data_age_seconds{pack="%s"} %.3f' % (perf.name, age))
+    lines.append('jsonbms_dbus_values_total{pack="%s",state="published"} %d' % (perf.name, perf.published))
+    lines.append('jsonbms_dbus_values_total{pack="%s",state="suppressed"} %d' % (perf.name, perf.suppressed))
+  return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(threading.Thread):
+  # Prometheus text format on http://127.0.0.1:<port>/metrics for all registered packs
+  def __init__(self, port):
+    # only imported when the endpoint is configured, http.server pulls in email and html
+    try:
+      from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    except ImportError:
+      from http.server import HTTPServer as ThreadingHTTPServer, BaseHTTPRequestHandler
+    threading.Thread.__init__(self, name='MetricsServer')
+    self.daemon = True
+    self.packs = []
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def log_message(self, format, *args):
+        pass
+
+      def do_GET(self):
+        if self.path != '/metrics':
+          self.send_error(404)
+          return
+        body = prometheusText(server.packs).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    self._httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+  def run(self):
+    self._httpd.serve_forever()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+# Flash friendly time-series recorder: every sample of a pack as a fixed size binary record in a
+# pre-allocated, memory-mapped ring file.
+#
+# Samples are packed into a RAM batch and only copied into the mapped file and flushed every
+# FlushInterval seconds (or when the batch is full), so the SD card sees a few page writes per
+# interval instead of one small write per sample. The service calls close() when it is stopped
+# (SIGTERM), only a hard power cut loses the samples of the last interval, that is the price for
+# the flash.
+#
+# The timestamps are unix time. A GX device may start with a wrong clock until NTP has synced,
+# so the records are not necessarily in time order; --from/--to select by the timestamp of each
+# record instead of searching the ring.
+#
+# File layout (little endian):
+#   header  HEADER: magic, version, cells, record size, capacity, next record, records stored
+#   records RECORD + one float per cell, capacity times
+#
+# Export as CSV:
+#   python3 bms_recorder.py recorder_onpremise.bin [--from "2026-10-01 00:00"] [--to "2026-10-02"] > out.csv
+
+import os
+import sys
+import csv
+import mmap
+import time
+import struct
+import argparse
+from datetime import datetime
+
+MAGIC = b'JSONBMS1'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIIII')
+HEADER_SIZE = 64
+# timestamp, soc, voltage, current, power, min/max temperature, max charge/discharge current,
+# max charge voltage, allow to charge/discharge
+RECORD = '<dfffffffffBB2x'
+FIELDS = ('timestamp', 'soc', 'voltage', 'current', 'power', 'min_temperature', 'max_temperature',
+          'max_charge_current', 'max_discharge_current', 'max_charge_voltage', 'allow_to_charge', 'allow_to_discharge')
+
+
+def recordStruct(number_of_cells):
+  return struct.Struct(RECORD + 'f' * number_of_cells)
+
+
+class Recorder:
+  def __init__(self, filename, number_of_cells, capacity=100000, flush_interval=300, batch_records=512):
+    self.filename = filename
+    self.number_of_cells = number_of_cells
+    self.capacity = capacity
+    self.flush_interval = flush_interval
+    self.record = recordStruct(number_of_cells)
+    self.size = HEADER_SIZE + capacity * self.record.size
+    self._batch = bytearray(batch_records * self.record.size)
+    self._batch_records = batch_records
+    self._batched = 0
+    self._last_flush = time.monotonic()
+    self.bytes_flushed = 0
+    self._open()
+
+  def _open(self):
+    # keep an existing file when it was written with the same layout, otherwise start a new one
+    head = count = 0
+    fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+    self._file = os.fdopen(fd, 'r+b')
+    if os.fstat(fd).st_size == self.size:
+      magic, version, cells, record_size, capacity, head, count = HEADER.unpack(self._file.read(HEADER.size))
+      if (magic, version, cells, record_size, capacity) != (MAGIC, VERSION, self.number_of_cells, self.record.size, self.capacity):
+        head = count = 0
+    else:
+      self._file.truncate(0)
+      # reserve the blocks now instead of growing the file on the card
+      if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, self.size)
+      else:
+        self._file.truncate(self.size)
+    self.head = head
+    self.count = count
+    self._map = mmap.mmap(fd, self.size)
+    self._writeHeader()
+
+  def _writeHeader(self):
+    HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.number_of_cells, self.record.size, self.capacity, self.head, self.count)
+
+  def add(self, timestamp, soc, voltage, current, power, min_temperature, max_temperature,
+          max_charge_current, max_discharge_current, max_charge_voltage, allow_to_charge, allow_to_discharge, cell_volt):
+    self.record.pack_into(self._batch, self._batched * self.record.size, timestamp, soc, voltage, current, power,
+                          min_temperature, max_temperature, max_charge_current, max_discharge_current,
+                          max_charge_voltage, allow_to_charge, allow_to_discharge, *cell_volt[:self.number_of_cells])
+    self._batched += 1
+    if self._batched == self._batch_records or time.monotonic() - self._last_flush >= self.flush_interval:
+      self.flush()
+
+  def flush(self):
+    self._last_flush = time.monotonic()
+    if not self._batched:
+      return
+    record_size = self.record.size
+    batch = memoryview(self._batch)
+    done = 0
+    while done < self._batched:
+      # copy up to the end of the ring, then wrap around
+      records = min(self._batched - done, self.capacity - self.head)
+      offset = HEADER_SIZE + self.head * record_size
+      self._map[offset:offset + records * record_size] = batch[done * record_size:(done + records) * record_size]
+      self.head = (self.head + records) % self.capacity
+      done += records
+    self.count = min(self.count + self._batched, self.capacity)
+    self._writeHeader()
+    self._map.flush()
+    self.bytes_flushed += self._batched * record_size + HEADER.size
+    self._batched = 0
+
+  def close(self):
+    self.flush()
+    self._map.close()
+    self._file.close()
+
+
+class RecorderReader:
+  def __init__(self, filename):
+    with open(filename, 'rb') as f:
+      self._data = f.read()
+    magic, version, cells, record_size, capacity, head, count = HEADER.unpack_from(self._data, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError("%s is not a recorder file" % (filename))
+    self.number_of_cells = cells
+    self.record = recordStruct(cells)
+    if self.record.size != record_size:
+      raise ValueError("%s has an unknown record layout" % (filename))
+    self.capacity = capacity
+    self.count = count
+    # index of the oldest record
+    self._first = head if count == capacity else 0
+
+  def records(self, start=None, end=None):
+    # the records from the oldest on whose timestamp is >= start and < end. Every record is
+    # checked, a clock set after the start of the recording leaves no order to search in
+    data = memoryview(self._data)
+    record_size = self.record.size
+    low = start if start is not None else float('-inf')
+    high = end if end is not None else float('inf')
+    # at most two contiguous runs because of the wrap around, each unpacked in one go
+    for run_start, run_end in ((0, min(self.count, self.capacity - self._first)),
+                               (self.capacity - self._first, self.count)):
+      if run_start >= run_end:
+        continue
+      offset = HEADER_SIZE + ((self._first + run_start) % self.capacity) * record_size
+      for values in self.record.iter_unpack(data[offset:offset + (run_end - run_start) * record_size]):
+        if low <= values[0] < high:
+          yield values
+
+  def header(self):
+    return FIELDS + tuple('cell%d' % (i + 1) for i in range(self.number_of_cells))
+
+
+def parseTime(value):
+  for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+    try:
+      return time.mktime(datetime.strptime(value, fmt).timetuple())
+    except ValueError:
+      pass
+  return float(value)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Export a dbus-json-bms recorder file as CSV')
+  parser.add_argument('file')
+  parser.add_argument('--from', dest='start', help='local time "YYYY-MM-DD[ HH:MM[:SS]]" or unix time')
+  parser.add_argument('--to', dest='end', help='local time "YYYY-MM-DD[ HH:MM[:SS]]" or unix time')
+  args = parser.parse_args()
+  reader = RecorderReader(args.file)
+  writer = csv.writer(sys.stdout)
+  writer.writerow(reader.header())
+  for values in reader.records(parseTime(args.start) if args.start else None,
+                               parseTime(args.end) if args.end else None):
+    # the values are float32, six significant digits is all they carry
+    writer.writerow(['%.3f' % values[0]] + ['%.6g' % value for value in values[1:]])
+
+
+if __name__ == "__main__":
+  main()
@@ -13,386 +13,1240 @@ else:
     from gi.repository import GLib as gobject
 import sys
 import time
-import requests # for http GET
-import configparser # for config/ini file
+import signal
+import threading
+import random
+from array import array
+import dbus
+# requests, concurrent.futures and the modules of optional features are imported where they are used
+from bms_config import getConfig, PackConfig, ServiceConfig
+from bms_mapping import JSONBMSMapping, loads # JSON dialect of the BMS, fastest JSON parser installed
+from bms_alarms import AlarmEngine, loadThresholds
+from bms_perf import PackPerf, PerfWindow, PHASES, MetricsServer
+from bms_curves import compileCurve, RateLimiter, DEFAULT_CHARGE_CURRENT_SOC, DEFAULT_DISCHARGE_CURRENT_SOC
+from bms_coulomb import CoulombCounter
  
 # our own packages from victron
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), '/opt/victronenergy/dbus-systemcalc-py/ext/velib_python'))
 from vedbus import VeDbusService
 
 
-class DbusJSONBMSService:
-  def __init__(self, servicename, deviceinstance, productname='JSON BMS', connection='JK BMS HTTP JSON service'):
-    self._dbusservice = VeDbusService("{}.http_{:02d}".format(servicename, deviceinstance))
-    config = self._getConfig()
-    #get Params used internally
-    self.allow_max_voltage = True
-    self.max_voltage_start_time = None
-    self.cccm_enable = config['Battery']['CCCMEnable']
-    self.cvcm_enable = config['Battery']['CVCMEnable']
-    self.cell_volt = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-    self.url = self._getJSONBMSStatusUrl()
-    self.float_cell_voltage = float(config['Battery']['FloatCellVoltage'])
-    self.soc_level_reset_voltage = float(config['Battery']['SOCLevelToResetVoltageLimit'])
-    self.max_voltage_time = float(config['Battery']['MaxVoltageTimeSec']) 
+# float error allowed when a change is compared with the deadband
+DEADBAND_TOLERANCE = 1e-9
+
+
+class DbusPublisher:
+  # Sits between _update and VeDbusService: values are only published when they changed by more
+  # than the deadband of the path, and all changes of one cycle go out as one ItemsChanged on flush().
+  # Reading a path returns the last value set, even when it was not published.
+  def __init__(self, dbusservice, deadbands):
+    self._dbusservice = dbusservice
+    self._deadbands = deadbands
+    self._path_deadband = {}
+    self._values = {}
+    self._published = {}
+    # path -> True while a change waits for flush(), the changed paths in the order of _queue.
+    # Both are reset instead of emptied, after the first cycles neither changes size any more
+    self._pending = {}
+    self._queue = []
+    self._queued = 0
+    # velib_python versions with the "with service as s:" context batch the signals into one ItemsChanged
+    self._batched = hasattr(dbusservice, '__enter__')
+    self.published_count = 0
+    self.suppressed_count = 0
+
+  def _getDeadband(self, path):
+    try:
+      return self._path_deadband[path]
+    except KeyError:
+      lower = path.lower()
+      deadband = next((value for prefix, value in self._deadbands if lower.startswith(prefix)), 0)
+      self._path_deadband[path] = deadband
+      return deadband
+
+  def __getitem__(self, path):
+    try:
+      return self._values[path]
+    except KeyError:
+      return self._dbusservice[path]
+
+  def __setitem__(self, path, value):
+    self._values[path] = value
+    try:
+      last = self._published[path]
+    except KeyError:
+      last = self._published[path] = self._dbusservice[path]
+    if value == last:
+      changed = False
+    elif value is None or last is None or isinstance(value, str) or isinstance(last, str):
+      changed = True
+    else:
+      # a step of exactly one deadband often computes as slightly less (0.3 - 0.2 < 0.1)
+      changed = abs(value - last) >= self._getDeadband(path) - DEADBAND_TOLERANCE
+    if changed:
+      if not self._pending.get(path):
+        self._pending[path] = True
+        if self._queued < len(self._queue):
+          self._queue[self._queued] = path
+        else:
+          self._queue.append(path)
+        self._queued += 1
+    else:
+      # back within the deadband before the flush, the queue entry is skipped
+      if self._pending.get(path):
+        self._pending[path] = False
+      self.suppressed_count += 1
+
+  def _publishPending(self, service):
+    values = self._values
+    published = self._published
+    pending = self._pending
+    queue = self._queue
+    for i in range(self._queued):
+      path = queue[i]
+      if pending[path]:
+        value = values[path]
+        service[path] = value
+        published[path] = value
+        pending[path] = False
+        self.published_count += 1
+    self._queued = 0
+
+  def flush(self):
+    if not self._queued:
+      return
+    if self._batched:
+      with self._dbusservice as service:
+        self._publishPending(service)
+    else:
+      self._publishPending(self._dbusservice)
+
+
+# returned by _getJSONBMSData when the source answered 304 Not Modified
+NOT_MODIFIED = object()
+# handed to deliver() by the streamer when a new connection starts, before its first frame
+STREAM_CONNECTED = object()
+
+
+def createSession():
+  # one keep-alive connection to the BMS instead of a new TCP connection per poll
+  import requests # for http GET
+  session = requests.Session()
+  adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+  return session
+
+
+class JSONBMSSource:
+  # One URL of a pack with its own session, conditional GET state and latency history.
+  # The p95 latency is how long a hedged fetch waits for this source before asking the next one.
+  def __init__(self, url):
+    self.url = url
+    self.session = createSession()
+    self.etag = None
+    self.last_modified = None
+    self.latency = PerfWindow(64)
+    # request of a hedged fetch, it may still be running from an earlier poll
+    self.future = None
+
+  def hedgeDelay(self, default=1.0):
+    if self.latency.count < 10:
+      return default
+    return max(self.latency.summary()[1], 0.05)
+
+
+class JSONBMSFetcher(threading.Thread):
+  # Worker thread doing the blocking HTTP request outside of the GLib main loop.
+  # fetch() runs in this thread, deliver(data) is scheduled on the main loop with idle_add.
+  def __init__(self, fetch, deliver):
+    threading.Thread.__init__(self, name='JSONBMSFetcher')
+    self.daemon = True
+    self._fetch = fetch
+    self._deliver = deliver
+    self._wakeup = threading.Event()
+    self._busy = threading.Lock()
+
+  def request(self):
+    # returns False if the previous request has not finished yet
+    if not self._busy.acquire(False):
+      return False
+    self._wakeup.set()
+    return True
+
+  def run(self):
+    while True:
+      self._wakeup.wait()
+      self._wakeup.clear()
+      try:
+        bms_data = self._fetch()
+      except Exception as e:
+        logging.critical('Error at %s', 'JSONBMSFetcher', exc_info=e)
+        bms_data = False
+      finally:
+        self._busy.release()
+      gobject.idle_add(self._deliver, bms_data)
+
+
+def mergeJSONBMSData(data, update):
+  # stream frames may only carry the values which changed, e.g. {"Cell": {"3": 3.301}}
+  for key, value in update.items():
+    if isinstance(value, dict) and isinstance(data.get(key), dict):
+      mergeJSONBMSData(data[key], value)
+    else:
+      data[key] = value
+  return data
+
+
+class JSONBMSStreamer(threading.Thread):
+  # Worker thread holding a long-lived connection to the source and handing every decoded
+  # frame to deliver(frame) on the main loop. Protocols: SSE (text/event-stream), NDJSON
+  # (one JSON document per line over chunked HTTP) and WebSocket (needs websocket-client).
+  # While not connected the service falls back to polling, reconnects back off up to 60s.
+  def __init__(self, url, protocol, deliver, reconnect_delay=5, read_timeout=30):
+    threading.Thread.__init__(self, name='JSONBMSStreamer')
+    self.daemon = True
+    self.url = url
+    self.protocol = protocol
+    self._deliver = deliver
+    self.reconnect_delay = reconnect_delay
+    self.read_timeout = read_timeout
+    self.connected = False
+
+  def run(self):
+    failures = 0
+    while True:
+      try:
+        for frame in self._frames():
+          failures = 0
+          gobject.idle_add(self._deliver, frame)
+        logging.info("JK BMS stream closed by the source")
+      except Exception as e:
+        logging.info("JK BMS stream failed: %s" % (e))
+      self.connected = False
+      failures += 1
+      time.sleep(min(self.reconnect_delay * (2 ** min(failures - 1, 4)), 60) * random.uniform(0.75, 1.0))
+
+  def _connected(self):
+    # the frames of the new connection are merged into a new document, nothing of before is kept
+    self.connected = True
+    gobject.idle_add(self._deliver, STREAM_CONNECTED)
+
+  def _frames(self):
+    if self.protocol == 'WebSocket':
+      return self._websocketFrames()
+    return self._httpFrames()
+
+  def _httpFrames(self):
+    import requests
+    headers = {'Accept': 'text/event-stream'} if self.protocol == 'SSE' else {}
+    # the read timeout also catches a source which stops sending without closing the connection
+    with requests.get(self.url, stream=True, timeout=(5, self.read_timeout), headers=headers) as bms_r:
+      bms_r.raise_for_status()
+      self._connected()
+      event = []
+      for line in bms_r.iter_lines(decode_unicode=True):
+        if self.protocol == 'SSE':
+          if line:
+            if line.startswith('data:'):
+              event.append(line[5:].lstrip())
+            continue
+          if not event:
+            continue
+          line = '\n'.join(event)
+          event = []
+        elif not line:
+          continue
+        try:
+          yield loads(line)
+        except ValueError:
+          logging.info("Converting stream frame to JSON failed")
+
+  def _websocketFrames(self):
+    import websocket # websocket-client, only needed for this protocol
+    ws = websocket.create_connection(self.url, timeout=self.read_timeout)
+    try:
+      self._connected()
+      while True:
+        message = ws.recv()
+        if not message:
+          return
+        try:
+          yield loads(message)
+        except ValueError:
+          logging.info("Converting stream frame to JSON failed")
+    finally:
+      ws.close()
+
+
+class PollScheduler:
+  # Decides how long to wait before the next poll of one pack: fast while current or cell
+  # voltages move or the highest cell is close to MaxCellVoltage (CVCM), slowly growing
+  # interval while the battery is idle, exponential backoff with jitter while unreachable.
+  # poll is the PollConfig of [POLL], all times in seconds.
+  def __init__(self, poll, max_cell_voltage):
+    self.min_interval = poll.min_interval
+    self.normal_interval = poll.interval
+    self.max_interval = poll.max_interval
+    self.max_backoff = poll.max_backoff
+    self.fast_current_change = poll.fast_current_change
+    self.fast_cell_voltage_change = poll.fast_cell_voltage_change
+    self.fast_cell_voltage = max_cell_voltage - poll.fast_near_max_cell_voltage
+    self.idle_current = poll.idle_current
+    self.interval = self.normal_interval
+    self.failures = 0
+    self._last_current = None
+    self._last_cell_volt = None
+
+  def sample(self, current, cell_volt, max_cell_voltage):
+    self.failures = 0
+    if self._last_cell_volt is None:
+      self._last_cell_volt = array('d', cell_volt)
+      self._last_current = current
+      self.interval = self.normal_interval
+      return
+    current_change = abs(current - self._last_current)
+    cell_change = 0.0
+    for i in range(len(cell_volt)):
+      change = abs(cell_volt[i] - self._last_cell_volt[i])
+      if change > cell_change:
+        cell_change = change
+      self._last_cell_volt[i] = cell_volt[i]
+    self._last_current = current
+    if (current_change >= self.fast_current_change or cell_change >= self.fast_cell_voltage_change
+        or max_cell_voltage >= self.fast_cell_voltage):
+      self.interval = self.min_interval
+    elif abs(current) < self.idle_current:
+      self.interval = min(max(self.interval, self.normal_interval) * 1.5, self.max_interval)
+    else:
+      self.interval = self.normal_interval
+
+  def unchanged(self):
+    # 304 from the source, nothing moved since the last poll
+    self.failures = 0
+    self.interval = min(max(self.interval, self.normal_interval) * 1.5, self.max_interval)
+
+  def failure(self):
+    self.failures += 1
+    backoff = min(self.normal_interval * (2 ** min(self.failures, 16)), self.max_backoff)
+    # jitter so several packs behind the same gateway do not retry in lockstep
+    self.interval = backoff * random.uniform(0.75, 1.0)
+
+  def getIntervalMs(self):
+    return int(self.interval * 1000)
+
+
+class PackState:
+  # The values of one pack which change every cycle. Slots instead of an instance dict and the
+  # cell voltages in an array of doubles sized once, so a cycle only stores into existing memory
+  __slots__ = ('soc', 'min_cell_temp', 'max_cell_temp', 'cell_volt', 'cell_voltage_sum',
+               'cell_now_min_voltage', 'cell_min_id', 'cell_now_max_voltage', 'cell_max_id',
+               'control_charge_current', 'control_discharge_current', 'control_allow_charge',
+               'control_allow_discharge', 'control_discharge_hys', 'control_voltage',
+               'allow_max_voltage', 'max_voltage_start_time')
+
+  def __init__(self, number_of_cells):
+    self.soc = None
+    self.min_cell_temp = None
+    self.max_cell_temp = None
+    self.cell_volt = array('d', [0.0]) * number_of_cells
+    self.cell_voltage_sum = 0.0
+    self.cell_now_min_voltage = 0.0
+    self.cell_min_id = 0
+    self.cell_now_max_voltage = 0.0
+    self.cell_max_id = 0
+    self.control_charge_current = 0.0
+    self.control_discharge_current = 0.0
+    self.control_allow_charge = 0
     self.control_allow_discharge = 1
     self.control_discharge_hys = True
+    self.control_voltage = None
+    self.allow_max_voltage = True
+    self.max_voltage_start_time = None
+
+  def updateMinMaxCell(self):
+    # min/max/sum run in C over the array, index() finds the first cell with that voltage
+    cell_volt = self.cell_volt
+    self.cell_now_min_voltage = min(cell_volt)
+    self.cell_min_id = cell_volt.index(self.cell_now_min_voltage)
+    self.cell_now_max_voltage = max(cell_volt)
+    self.cell_max_id = cell_volt.index(self.cell_now_max_voltage)
+    self.cell_voltage_sum = sum(cell_volt)
+
+
+def getPackSections(config):
+  # [PACK1], [PACK2], ... for several packs in one process, otherwise the single [ONPREMISE] pack
+  packs = [section for section in config.sections() if section.upper().startswith('PACK')]
+  packs.sort(key=lambda section: (len(section), section))
+  return packs or ['ONPREMISE']
+
+
+def getDbusConnection():
+  # every service needs its own connection, VeDbusService exports '/' on the bus it gets
+  return dbus.SessionBus(private=True) if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus(private=True)
+
+
+# D-Bus paths as (path, text format). Paths with {number} exist once per cell, counted from 1.
+# The initial values are given to addPaths, paths without one start as None
+MANDATORY_PATHS = (
+  ('/Mgmt/ProcessName', None),
+  ('/Mgmt/ProcessVersion', None),
+  ('/Mgmt/Connection', None),
+  ('/DeviceInstance', None),
+  ('/ProductId', None),
+  ('/ProductName', None),
+  ('/FirmwareVersion', None),
+  ('/HardwareVersion', None),
+  ('/Connected', None),
+)
+
+BATTERY_PATHS = (
+  ('/System/NrOfCellsPerBattery', None),
+  ('/Info/BatteryLowVoltage', None),
+  ('/Info/MaxChargeVoltage', "{:0.2f}V"),
+  ('/Info/MaxChargeCurrent', "{:0.2f}A"),
+  ('/Info/MaxDischargeCurrent', "{:0.2f}A"),
+  ('/System/NrOfModulesOnline', None),
+  ('/System/NrOfModulesOffline', None),
+  ('/System/NrOfModulesBlockingCharge', None),
+  ('/System/NrOfModulesBlockingDischarge', None),
+  ('/InstalledCapacity', "{:0.0f}Ah"),
+  ('/Capacity', "{:0.0f}Ah"),
+  ('/ConsumedAmphours', "{:0.0f}Ah"),
+  # SOC, DC and System items
+  ('/Soc', None),
+  ('/Dc/0/Voltage', "{:2.2f}V"),
+  ('/Dc/0/Current', "{:2.2f}A"),
+  ('/Dc/0/Power', "{:0.0f}W"),
+  ('/Dc/0/Temperature', None),
+  ('/Dc/0/MidVoltage', "{:0.2f}V"),
+  ('/Dc/0/MidVoltageDeviation', "{:0.1f}%"),
+  # battery extras
+  ('/System/MinCellTemperature', None),
+  ('/System/MaxCellTemperature', None),
+  ('/System/MaxCellVoltage', "{:0.3f}V"),
+  ('/System/MaxVoltageCellId', None),
+  ('/System/MinCellVoltage', "{:0.3f}V"),
+  ('/System/MinVoltageCellId', None),
+  ('/History/ChargeCycles', None),
+  ('/History/TotalAhDrawn', "{:0.1f}Ah"),
+  ('/History/ChargedEnergy', "{:0.2f}kWh"),
+  ('/History/DischargedEnergy', "{:0.2f}kWh"),
+  ('/Balancing', None),
+  ('/Io/AllowToCharge', None),
+  ('/Io/AllowToDischarge', None),
+  ('/Voltages/Cell{number}', "{:1.3f}V"),
+  ('/Voltages/Sum', "{:2.2f}V"),
+  ('/Voltages/Diff', "{:1.3f}V"),
+  # alarms
+  ('/Alarms/LowVoltage', None),
+  ('/Alarms/HighVoltage', None),
+  ('/Alarms/LowCellVoltage', None),
+  ('/Alarms/HighCellVoltage', None),
+  ('/Alarms/LowSoc', None),
+  ('/Alarms/HighChargeCurrent', None),
+  ('/Alarms/HighDischargeCurrent', None),
+  ('/Alarms/CellImbalance', None),
+  ('/Alarms/InternalFailure', None),
+  ('/Alarms/HighChargeTemperature', None),
+  ('/Alarms/LowChargeTemperature', None),
+  ('/Alarms/HighTemperature', None),
+  ('/Alarms/LowTemperature', None),
+)
+
+# diagnostics, read-only like the other /Mgmt paths
+PERF_PATHS = tuple(('/Mgmt/Perf/%s/%s' % (phase, value), "{:0.1f}ms") for phase in PHASES for value in ('P50', 'P95', 'Max')) + (
+  ('/Mgmt/Perf/FetchFailures', None),
+  ('/Mgmt/Perf/DataAge', "{:0.1f}s"),
+)
+
+SERIAL_PATHS = (
+  ('/Serial', None),
+  ('/UpdateIndex', None),
+)
+
+# [HISTORY] Enable
+HISTORY_PATHS = (
+  ('/CellStats/Cell{number}/Mean', "{:1.3f}V"),
+  ('/CellStats/Cell{number}/StdDev', "{:0.1f}mV"),
+  ('/CellStats/Cell{number}/Resistance', "{:0.2f}mOhm"),
+  ('/CellStats/ImbalanceSlope', "{:0.2f}mV/h"),
+  ('/CellStats/Window', "{:0.1f}h"),
+)
+
+AGGREGATE_PATHS = (
+  ('/System/NrOfModulesOnline', None),
+  ('/System/NrOfModulesOffline', None),
+  ('/InstalledCapacity', "{:0.0f}Ah"),
+  ('/Capacity', "{:0.0f}Ah"),
+  ('/ConsumedAmphours', "{:0.0f}Ah"),
+  ('/Soc', None),
+  ('/Dc/0/Voltage', "{:2.2f}V"),
+  ('/Dc/0/Current', "{:2.2f}A"),
+  ('/Dc/0/Power', "{:0.0f}W"),
+  ('/Dc/0/Temperature', None),
+  ('/System/MinCellTemperature', None),
+  ('/System/MaxCellTemperature', None),
+  ('/System/MaxCellVoltage', "{:0.3f}V"),
+  ('/System/MaxVoltageCellId', None),
+  ('/System/MinCellVoltage', "{:0.3f}V"),
+  ('/System/MinVoltageCellId', None),
+  ('/Info/MaxChargeVoltage', "{:0.2f}V"),
+  ('/Info/MaxChargeCurrent', "{:0.2f}A"),
+  ('/Info/MaxDischargeCurrent', "{:0.2f}A"),
+  ('/Io/AllowToCharge', None),
+  ('/Io/AllowToDischarge', None),
+  ('/History/TotalAhDrawn', "{:0.1f}Ah"),
+  ('/History/ChargedEnergy', "{:0.2f}kWh"),
+  ('/History/DischargedEnergy', "{:0.2f}kWh"),
+)
+
+
+def expandPaths(paths, number_of_cells):
+  # consecutive paths with {number} are repeated as a group for every cell
+  expanded = []
+  group = []
+  for path, text in paths + ((None, None),):
+    if path is not None and '{number}' in path:
+      group.append((path, text))
+      continue
+    for number in range(1, number_of_cells + 1):
+      expanded.extend((cell.format(number=number), cell_text) for cell, cell_text in group)
+    group = []
+    if path is not None:
+      expanded.append((path, text))
+  return tuple(expanded)
+
+
+_gettext = {}
+
+
+def getTextCallback(text):
+  # one callback per format, shared by all paths using it
+  if text not in _gettext:
+    _gettext[text] = lambda p, v: text.format(v)
+  return _gettext[text]
+
+
+def addPaths(dbusservice, paths, values, writeable=True):
+  for path, text in paths:
+    dbusservice.add_path(path, values.get(path), writeable=writeable,
+                         gettextcallback=getTextCallback(text) if text else None)
+
+
+class DbusJSONBMSService:
+  def __init__(self, servicename, deviceinstance, productname='JSON BMS', connection='JK BMS HTTP JSON service', pack='ONPREMISE',
+               features=None):
+    # features: the ServiceConfig shared by all packs, parsed here when not given
+    self.pack = pack
+    self._dbusservice = VeDbusService("{}.http_{:02d}".format(servicename, deviceinstance), bus=getDbusConnection())
+    config = getConfig()
+    self.settings = settings = PackConfig(config, pack)
+    self.features = features = features if features is not None else ServiceConfig(config)
+    self._publisher = DbusPublisher(self._dbusservice, features.deadbands)
+    battery = settings.battery
+    self.number_of_cells = settings.number_of_cells
+    self.state = PackState(self.number_of_cells)
+    #get Params used internally
+    self.cccm_enable = settings.cccm_enable
+    self.cvcm_enable = settings.cvcm_enable
+    # charge/discharge limits as curves of SoC, cell voltage and temperature, factors of the max current
+    charge = settings.max_charge_current
+    discharge = settings.max_discharge_current
+    self._charge_soc_curve = compileCurve(battery.get('ChargeCurrentSoc', DEFAULT_CHARGE_CURRENT_SOC), full=charge)
+    self._charge_cell_curve = compileCurve(battery.get('ChargeCurrentCellVoltage'), full=charge)
+    self._charge_temperature_curve = compileCurve(battery.get('ChargeCurrentTemperature'), full=charge)
+    self._discharge_soc_curve = compileCurve(battery.get('DischargeCurrentSoc', DEFAULT_DISCHARGE_CURRENT_SOC), full=discharge)
+    self._discharge_cell_curve = compileCurve(battery.get('DischargeCurrentCellVoltage'), full=discharge)
+    self._discharge_temperature_curve = compileCurve(battery.get('DischargeCurrentTemperature'), full=discharge)
+    # cap of the charge voltage per cell over temperature
+    self._charge_voltage_temperature_curve = compileCurve(battery.get('ChargeCellVoltageTemperature'))
+    ramp_up = battery.getfloat('CurrentRampUp', 2)
+    ramp_down = battery.getfloat('CurrentRampDown', 0)
+    self._charge_limiter = RateLimiter(ramp_up, ramp_down)
+    self._discharge_limiter = RateLimiter(ramp_up, ramp_down)
+    # one or more sources for the same pack, a second one is asked when the first is slow
+    self._sources = [JSONBMSSource(url) for url in settings.urls]
+    # AccessType JKSerial: binary frames straight from the BMS instead of JSON over HTTP
+    self._jk = None
+    if settings.access_type == 'JKSerial':
+      from bms_jk import JKBMSConnection
+      self._jk = JKBMSConnection(settings.port, baudrate=settings.baudrate, timeout=settings.read_timeout)
+    self._hedge = None
+    if len(self._sources) > 1:
+      import concurrent.futures
+      # at most one request per source is running, see _hedgedFetch
+      self._hedge = concurrent.futures.ThreadPoolExecutor(max_workers=len(self._sources))
+    # the last known good values are served this long, then the pack is reported disconnected
+    self.stale_timeout = settings.stale_timeout
+    self._stale = False
+    self._stream_data = {}
+    self._stream_complete = False
+    self.fetch_mode = settings.fetch_mode
+    self.float_cell_voltage = settings.float_cell_voltage
+    self.soc_level_reset_voltage = settings.soc_level_reset_voltage
+    self.max_voltage_time = settings.max_voltage_time
     logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
-    # Create the management objects, as specified in the ccgx dbus-api document
-    self._dbusservice.add_path('/Mgmt/ProcessName', __file__)
-    self._dbusservice.add_path('/Mgmt/ProcessVersion', 'Unkown version, and running on Python ' + platform.python_version())
-    self._dbusservice.add_path('/Mgmt/Connection', connection)
-    # Create the mandatory objects
-    self._dbusservice.add_path('/DeviceInstance', deviceinstance)
-    self._dbusservice.add_path('/ProductId', 0x0) 
-    self._dbusservice.add_path('/ProductName', productname)
-    self._dbusservice.add_path('/FirmwareVersion', 0.1)
-    self._dbusservice.add_path('/HardwareVersion', 0)
-    self._dbusservice.add_path('/Connected', 1)
-    # Create static battery info
-    self.number_of_cells = int(config['Battery']['NumberOfCells'])
-    self._dbusservice.add_path('/System/NrOfCellsPerBattery', self.number_of_cells, writeable=True)
-    self.min_cell_voltage = float(config['Battery']['MinCellVoltage'])
+    # compiled once, maps the JSON dialect of the BMS to the values used here
+    if self._jk is not None:
+      from bms_jk import JKFrameDecoder
+      self._mapping = JKFrameDecoder(self.number_of_cells, settings.current_encoding)
+    else:
+      self._mapping = JSONBMSMapping(self.number_of_cells, settings.mapping)
+    self._sample = {}
+    self.min_cell_voltage = settings.min_cell_voltage
     self.min_battery_voltage = self.number_of_cells * self.min_cell_voltage
-    self._dbusservice.add_path('/Info/BatteryLowVoltage', self.min_battery_voltage, writeable=True)
-    self.max_cell_voltage = float(config['Battery']['MaxCellVoltage'])
+    self.max_cell_voltage = settings.max_cell_voltage
     self.max_battery_voltage = self.number_of_cells * self.max_cell_voltage
-    self._dbusservice.add_path('/Info/MaxChargeVoltage', self.max_battery_voltage, writeable=True,
-                               gettextcallback=lambda p, v: "{:0.2f}V".format(v))
-    self.max_charge_current = float(config['Battery']['MaxBatteryChargeCurrent'])
-    self.control_charge_current = self.max_charge_current
-    self._dbusservice.add_path('/Info/MaxChargeCurrent', self.max_charge_current, writeable=True,
-                               gettextcallback=lambda p, v: "{:0.2f}A".format(v))
-    self.max_discharge_current = float(config['Battery']['MaxBatteryDischargeCurrent'])
-    self.control_discharge_current = self.max_discharge_current
-    self._dbusservice.add_path('/Info/MaxDischargeCurrent', self.max_discharge_current,
-                               writeable=True, gettextcallback=lambda p, v: "{:0.2f}A".format(v))
-    self._dbusservice.add_path('/System/NrOfModulesOnline', 1, writeable=True)
-    self._dbusservice.add_path('/System/NrOfModulesOffline', 0, writeable=True)
-    self._dbusservice.add_path('/System/NrOfModulesBlockingCharge', None, writeable=True)
-    self._dbusservice.add_path('/System/NrOfModulesBlockingDischarge', None, writeable=True)
-    self.installed_capacity = int(config['Battery']['BatteryCapacity'])
-    self._dbusservice.add_path('/InstalledCapacity', self.installed_capacity, writeable=True,
-                               gettextcallback=lambda p, v: "{:0.0f}Ah".format(v))
-
-    self._dbusservice.add_path('/Capacity', None, writeable=True,
-                               gettextcallback=lambda p, v: "{:0.0f}Ah".format(v))
-                               
-    self._dbusservice.add_path('/ConsumedAmphours', None, writeable=True,
-                               gettextcallback=lambda p, v: "{:0.0f}Ah".format(v))
-    # Create SOC, DC and System items
-    self._dbusservice.add_path('/Soc', None, writeable=True)
-    self._dbusservice.add_path('/Dc/0/Voltage', None, writeable=True, gettextcallback=lambda p, v: "{:2.2f}V".format(v))
-    self._dbusservice.add_path('/Dc/0/Current', None, writeable=True, gettextcallback=lambda p, v: "{:2.2f}A".format(v))
-    self._dbusservice.add_path('/Dc/0/Power', None, writeable=True, gettextcallback=lambda p, v: "{:0.0f}W".format(v))
-    self._dbusservice.add_path('/Dc/0/Temperature', None, writeable=True)
-    self._dbusservice.add_path('/Dc/0/MidVoltage', None, writeable=True,
-                                gettextcallback=lambda p, v: "{:0.2f}V".format(v))
-    self._dbusservice.add_path('/Dc/0/MidVoltageDeviation', None, writeable=True,
-                                gettextcallback=lambda p, v: "{:0.1f}%".format(v))
-    # Create battery extras
-    self._dbusservice.add_path('/System/MinCellTemperature', None, writeable=True)
-    self._dbusservice.add_path('/System/MaxCellTemperature', None, writeable=True)
-    self.cell_now_max_voltage = 0.0
-    self._dbusservice.add_path('/System/MaxCellVoltage', self.cell_now_max_voltage, writeable=True,
-                               gettextcallback=lambda p, v: "{:0.3f}V".format(v))
-    self.cell_max_id = 0
-    self._dbusservice.add_path('/System/MaxVoltageCellId', self.cell_max_id, writeable=True)
-    self.cell_now_min_voltage = 0.0
-    self._dbusservice.add_path('/System/MinCellVoltage', self.cell_now_min_voltage, writeable=True,
-                               gettextcallback=lambda p, v: "{:0.3f}V".format(v))
-    self.cell_min_id = 0                           
-    self._dbusservice.add_path('/System/MinVoltageCellId', self.cell_min_id, writeable=True)
-    self._dbusservice.add_path('/History/ChargeCycles', None, writeable=True)
-    self._dbusservice.add_path('/History/TotalAhDrawn', None, writeable=True)
-    self._dbusservice.add_path('/Balancing', None, writeable=True)
-    self._dbusservice.add_path('/Io/AllowToCharge', 0, writeable=True)
-    self._dbusservice.add_path('/Io/AllowToDischarge', 0, writeable=True)
-    # self._dbusservice.add_path('/SystemSwitch',1,writeable=True)
-    self._dbusservice.add_path('/Voltages/Cell1', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell2', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell3', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell4', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell5', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell6', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell7', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell8', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell9', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell10', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell11', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell12', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell13', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell14', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell15', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Cell16', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-
-    self._dbusservice.add_path('/Voltages/Sum', None, writeable=True, gettextcallback=lambda p, v: "{:2.2f}V".format(v))
-    self._dbusservice.add_path('/Voltages/Diff', None, writeable=True, gettextcallback=lambda p, v: "{:1.3f}V".format(v))
-    # Create the alarms
-    self._dbusservice.add_path('/Alarms/LowVoltage', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/HighVoltage', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/LowCellVoltage', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/HighCellVoltage', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/LowSoc', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/HighChargeCurrent', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/HighDischargeCurrent', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/CellImbalance', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/InternalFailure', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/HighChargeTemperature', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/LowChargeTemperature', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/HighTemperature', None, writeable=True)
-    self._dbusservice.add_path('/Alarms/LowTemperature', None, writeable=True)
-    self._dbusservice.add_path('/Serial', '1234')
-    self._dbusservice.add_path('/UpdateIndex', 0)
+    self.max_charge_current = settings.max_charge_current
+    self.state.control_charge_current = self.max_charge_current
+    self.max_discharge_current = settings.max_discharge_current
+    self.state.control_discharge_current = self.max_discharge_current
+    self.installed_capacity = settings.capacity
+    # Create the management objects, as specified in the ccgx dbus-api document, the mandatory
+    # objects and the battery items, see BATTERY_PATHS
+    addPaths(self._dbusservice, MANDATORY_PATHS, {
+      '/Mgmt/ProcessName': __file__,
+      '/Mgmt/ProcessVersion': 'Unkown version, and running on Python ' + platform.python_version(),
+      '/Mgmt/Connection': connection,
+      '/DeviceInstance': deviceinstance,
+      '/ProductId': 0x0,
+      '/ProductName': productname,
+      '/FirmwareVersion': 0.1,
+      '/HardwareVersion': 0,
+      '/Connected': 1,
+    }, writeable=False)
+    addPaths(self._dbusservice, expandPaths(BATTERY_PATHS, self.number_of_cells), {
+      '/System/NrOfCellsPerBattery': self.number_of_cells,
+      '/Info/BatteryLowVoltage': self.min_battery_voltage,
+      '/Info/MaxChargeVoltage': self.max_battery_voltage,
+      '/Info/MaxChargeCurrent': self.max_charge_current,
+      '/Info/MaxDischargeCurrent': self.max_discharge_current,
+      '/System/NrOfModulesOnline': 1,
+      '/System/NrOfModulesOffline': 0,
+      '/InstalledCapacity': self.installed_capacity,
+      '/System/MaxCellVoltage': self.state.cell_now_max_voltage,
+      '/System/MaxVoltageCellId': self.state.cell_max_id,
+      '/System/MinCellVoltage': self.state.cell_now_min_voltage,
+      '/System/MinVoltageCellId': self.state.cell_min_id,
+      '/Io/AllowToCharge': 0,
+      '/Io/AllowToDischarge': 0,
+    })
+    addPaths(self._dbusservice, PERF_PATHS, {'/Mgmt/Perf/FetchFailures': 0}, writeable=False)
+    # built once, the publish loop only indexes into it
+    self._cell_paths = tuple('/Voltages/Cell%d' % (i+1) for i in range(self.number_of_cells))
+    self._alarms = AlarmEngine(loadThresholds(features.alarms, self.number_of_cells, self.max_charge_current, self.max_discharge_current),
+                               budget=features.alarms.budget)
+    # timings of the update phases, published every [PERF] Interval seconds
+    self._perf = PackPerf(self.pack.lower())
+    self._perf_paths = [(phase, tuple('/Mgmt/Perf/%s/%s' % (phase, value) for value in ('P50', 'P95', 'Max'))) for phase in PHASES]
+    self._poll_due = None
+    self._decode_time = 0.0
+    if features.perf.interval > 0:
+      gobject.timeout_add(int(features.perf.interval * 1000), self._publishPerf)
+    addPaths(self._dbusservice, SERIAL_PATHS, {'/Serial': '1234', '/UpdateIndex': 0}, writeable=False)
     # last update
     self._lastUpdate = 0
-    # add _update function 'timer'
-    gobject.timeout_add(3766, self._update) # pause 250ms before the next request   
+    # binary recorder of every sample, see bms_recorder.py for the export to CSV
+    self._recorder = None
+    recorder = features.recorder
+    if recorder.enable:
+      from bms_recorder import Recorder
+      filename = recorder.file.format(pack=self.pack.lower())
+      self._recorder = Recorder(os.path.join(os.path.dirname(os.path.realpath(__file__)), filename), self.number_of_cells,
+                                capacity=recorder.records, flush_interval=recorder.flush_interval)
+    # Ah and Wh counted from every sample for /History/* and the fractional /Soc, on unless
+    # [COULOMB] Enable = False, the counters are kept across restarts in File
+    self._coulomb = None
+    coulomb = features.coulomb
+    if coulomb.enable:
+      filename = coulomb.file.format(pack=self.pack.lower())
+      self._coulomb = CoulombCounter(self.installed_capacity, os.path.join(os.path.dirname(os.path.realpath(__file__)), filename),
+                                     max_gap=coulomb.max_gap, save_interval=coulomb.save_interval,
+                                     soc_window=coulomb.soc_window)
+    # rolling per-cell statistics from a bounded in-memory history
+    self._history = None
+    history = features.history
+    if history.enable:
+      from bms_history import CellHistory
+      self._history = CellHistory(self.number_of_cells, hours=history.hours, sample_interval=history.sample_interval,
+                                  load_step_current=history.load_step_current)
+      logging.info("cell history uses %d bytes" % (self._history.memoryUsage()))
+      paths = expandPaths(HISTORY_PATHS, self.number_of_cells)
+      addPaths(self._dbusservice, paths, {})
+      # (Mean, StdDev, Resistance) of every cell
+      self._history_paths = [tuple(path for path, _ in paths[3 * i:3 * i + 3]) for i in range(self.number_of_cells)]
+    # in Thread mode the HTTP request runs in a worker, results come back via idle_add
+    self._fetcher = None
+    if self.fetch_mode == 'Thread':
+      self._fetcher = JSONBMSFetcher(self._getJSONBMSData, self._deliverJSONBMSData)
+      self._fetcher.start()
+    # AccessType Stream: data is pushed by the source, polling only while the stream is down
+    self._streamer = None
+    if settings.access_type == 'Stream':
+      self._streamer = JSONBMSStreamer(settings.stream_url, settings.stream_protocol, self._deliverStreamFrame,
+                                       reconnect_delay=settings.stream_reconnect_delay)
+      self._streamer.start()
+    # add _update function 'timer', every poll schedules the next one with the interval of the scheduler
+    self._scheduler = PollScheduler(features.poll, self.max_cell_voltage)
+    self._schedulePoll()
+    # no data yet, start as stale and check once a second, independent of the poll backoff
+    self._checkStale()
+    gobject.timeout_add(1000, self._checkStale)
     # add _signOfLife 'timer' to get feedback in log in minutes
-    value = self._getSignOfLifeInterval()*60*1000
+    value = settings.sign_of_life*60*1000
     gobject.timeout_add(value, self._signOfLife)
- 
 
-  def _getConfig(self):
-    config = configparser.ConfigParser()
-    config.read("%s/config.ini" % (os.path.dirname(os.path.realpath(__file__))))
-    return config;
- 
- 
-  def _getSignOfLifeInterval(self):
-    config = self._getConfig()
-    value = config['DEFAULT']['SignOfLifeLog']
-    if not value: 
-        value = 0
-    return int(value)
-  
-  
-  def _getJSONBMSStatusUrl(self):
-    config = self._getConfig()
-    accessType = config['DEFAULT']['AccessType']    
-    if accessType == 'OnPremise': 
-        URL = "http://%s:%s@%s" % (config['ONPREMISE']['Username'], config['ONPREMISE']['Password'], config['ONPREMISE']['Host'])
-        URL = URL.replace(":@", "")
-    else:
-        raise ValueError("AccessType %s is not supported" % (config['DEFAULT']['AccessType']))
-    return URL
-    
- 
+
   def _getJSONBMSData(self):
+    start = time.perf_counter()
+    if self._jk is not None:
+      bms_data = self._readJKFrame()
+    elif self._hedge is None:
+      bms_data = self._fetchSource(self._sources[0])
+    else:
+      bms_data = self._hedgedFetch()
+    if bms_data is False:
+      self._perf.fetch_failures += 1
+    else:
+      self._perf.add('Fetch', time.perf_counter() - start - self._decode_time)
+    return bms_data
+
+
+  def _hedgedFetch(self):
+    # ask the next source when the current one did not answer within its p95 latency or failed,
+    # the first valid answer wins and the slower requests are left to finish on their own. A source
+    # whose request of an earlier poll is still running gets no second one, its running request
+    # is waited for instead, so a hanging source can not fill the pool nor share its session
+    import concurrent.futures
+    pending = set()
+    next_source = 0
+    while True:
+      timeout = None
+      if next_source < len(self._sources):
+        source = self._sources[next_source]
+        if source.future is None or source.future.done():
+          source.future = self._hedge.submit(self._fetchSource, source)
+        pending.add(source.future)
+        timeout = source.hedgeDelay()
+        next_source += 1
+      done, pending = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        bms_data = future.result()
+        if bms_data is not False:
+          return bms_data
+      if not pending and next_source >= len(self._sources):
+        return False
+
+
+  def _readJKFrame(self):
+    # the frame is a view into the receive buffer of the connection, it is decoded by
+    # _processJSONBMSData before the next read
+    try:
+      return self._jk.read()
+    except Exception as e:
+      logging.info("No valid frame from JK BMS %s: %s" % (self._jk.port, e))
+      self._jk.close()
+      return False
+
+
+  def _fetchSource(self, source):
+    # conditional GET, a source which supports ETag/Last-Modified answers 304 when nothing changed
+    headers = {}
+    if source.etag:
+      headers['If-None-Match'] = source.etag
+    if source.last_modified:
+      headers['If-Modified-Since'] = source.last_modified
+    start = time.perf_counter()
     try:
-      bms_r = requests.get(self.url, timeout=5)
+      bms_r = source.session.get(source.url, timeout=5, headers=headers)
     except Exception as e:
-      logging.info("No response from JK BMS")
+      logging.info("No response from JK BMS %s" % (source.url))
       return False
+    fetched = time.perf_counter()
+    source.latency.add(fetched - start)
+    if bms_r.status_code == 304:
+      return NOT_MODIFIED
+    source.etag = bms_r.headers.get('ETag')
+    source.last_modified = bms_r.headers.get('Last-Modified')
     try:
-      bms_data = bms_r.json()         
+      bms_data = loads(bms_r.content)
     # check for Json
     except Exception as e:
       logging.info("Converting response to JSON failed")
       return False
+    # added to the extraction time in _processJSONBMSData
+    self._decode_time = time.perf_counter() - fetched
     return bms_data
     
 
-  def _get_min_max_cell(self):
-    min_voltage = 9999
-    max_voltage = 0
-    min_cell = None
-    max_cell = None
+  def _updateHistory(self, current):
+    history = self._history
+    if not history.add(time.monotonic(), self.state.cell_volt, current, self.state.max_cell_temp):
+      return
+    # statistics only move when a sample was stored
     for i in range(self.number_of_cells):
-      if self.cell_volt[i] < min_voltage:
-        min_voltage = self.cell_volt[i]
-        min_cell = i
-      if self.cell_volt[i] > max_voltage:
-        max_voltage = self.cell_volt[i]
-        max_cell = i    
-    self.cell_now_max_voltage = max_voltage
-    self.cell_max_id = max_cell
-    self.cell_now_min_voltage = min_voltage
-    self.cell_min_id = min_cell
- 
- 
- 
+      paths = self._history_paths[i]
+      self._publisher[paths[0]] = round(history.mean(i), 3)
+      self._publisher[paths[1]] = round(history.stddev(i) * 1000, 1)
+      if history.resistance_valid:
+        self._publisher[paths[2]] = round(history.resistance[i] * 1000, 2)
+    slope = history.imbalanceSlope()
+    if slope is not None:
+      self._publisher['/CellStats/ImbalanceSlope'] = round(slope * 1000, 2)
+    self._publisher['/CellStats/Window'] = round(history.window(), 1)
+
+
+  def _countCharge(self, voltage, current, soc):
+    # integrates the sample, publishes the counters and returns the fractional SoC
+    coulomb = self._coulomb
+    now = time.monotonic()
+    coulomb.add(now, voltage, current, soc)
+    publisher = self._publisher
+    # Ah drawn are negative, as on a Victron battery monitor
+    publisher['/History/TotalAhDrawn'] = 0.0 - round(coulomb.discharged_ah, 1)
+    publisher['/History/ChargedEnergy'] = round(coulomb.charged_wh / 1000.0, 2)
+    publisher['/History/DischargedEnergy'] = round(coulomb.discharged_wh / 1000.0, 2)
+    if coulomb.saveDue(now):
+      try:
+        coulomb.save(now, time.time())
+      except (IOError, OSError) as e:
+        logging.warning("coulomb counter state not saved: %s" % (e))
+    return round(coulomb.soc, 1)
+
+  def _forgetValidators(self):
+    for source in self._sources:
+      source.etag = None
+      source.last_modified = None
+
+  def _checkStale(self):
+    # the last known good values are served for StaleTimeout seconds. After that the pack is
+    # reported disconnected with charging and discharging blocked, so systemcalc reacts
+    if self._stale or (time.time() - self._lastUpdate) <= self.stale_timeout:
+      return True
+    if self._lastUpdate:
+      logging.info("-- shut down BMS, no valid data for %.0fs" % (time.time() - self._lastUpdate))
+    self._stale = True
+    # the next answer has to be a whole document, a 304 would not make the old values valid again
+    self._forgetValidators()
+    self._publisher['/Connected'] = 0
+    self._publisher['/Info/MaxChargeCurrent'] = 0
+    self._publisher['/Info/MaxDischargeCurrent'] = 0
+    self._publisher['/Io/AllowToCharge'] = 0
+    self._publisher['/Io/AllowToDischarge'] = 0
+    self._publisher.flush()
+    return True
+
+
+  def _publishPerf(self):
+    perf = self._perf
+    for phase, paths in self._perf_paths:
+      summary = perf.windows[phase].summary()
+      for k in range(3):
+        if summary[k] is not None:
+          self._publisher[paths[k]] = round(summary[k] * 1000, 1)
+    self._publisher['/Mgmt/Perf/FetchFailures'] = perf.fetch_failures
+    age = perf.dataAge()
+    if age is not None:
+      self._publisher['/Mgmt/Perf/DataAge'] = round(age, 1)
+    perf.published = self._publisher.published_count
+    perf.suppressed = self._publisher.suppressed_count
+    self._publisher.flush()
+    return True
+
+
+  def close(self):
+    # on shutdown, what the recorder and the coulomb counter keep in RAM goes to their files
+    if self._recorder is not None:
+      self._recorder.close()
+      self._recorder = None
+    if self._coulomb is not None and self._coulomb.filename is not None:
+      try:
+        self._coulomb.save(time.monotonic(), time.time())
+      except (IOError, OSError) as e:
+        logging.warning("coulomb counter state not saved: %s" % (e))
+
+
   def _signOfLife(self):
     logging.info("--- Start: sign of life ---")
     logging.info("Last _update() call: %s" % (self._lastUpdate))
     logging.info("Last '/DC/Power': %s" % (self._dbusservice['/Dc/0/Power']))
+    logging.info("D-Bus values published: %d, suppressed: %d" % (self._publisher.published_count, self._publisher.suppressed_count))
     logging.info("--- End: sign of life ---")
     return True
  
 # next two functions are the core of BMS controlling and managing Voltage and Current depending on SoC and Voltage
   
   def _manage_charge_current(self):
+    state = self.state
         # If disabled make sure the default values are set and then exit 
     if (not self.cccm_enable):
-        self.control_charge_current = self.max_charge_current
-        self.control_discharge_current = self.max_discharge_current
-        self.control_allow_charge = 1
-        self.control_allow_discharge = 1
+        state.control_charge_current = self.max_charge_current
+        state.control_discharge_current = self.max_discharge_current
+        state.control_allow_charge = 1
+        state.control_allow_discharge = 1
         return
-    if self.soc is None:
+    if state.soc is None:
             # Prevent JSON BMS from terminating on error
         return False
-        # Charge depending on the SOC values       
-    if self.soc > 99:
-        self.control_allow_charge = 0
+    now = time.monotonic()
+        # Charge depending on the curves of SoC, highest cell and temperatures, the most restrictive wins
+    if state.soc > 99:
+        state.control_allow_charge = 0
     else:
-        self.control_allow_charge = 1
-    if 98 < self.soc <= 100:
-        self.control_charge_current = 5
-    elif 95 < self.soc <= 98:
-        self.control_charge_current = self.max_charge_current/4
-    elif 91 < self.soc <= 95:
-        self.control_charge_current = self.max_charge_current/2
-    else:
-        self.control_charge_current = self.max_charge_current 
-        # Discharge depending on the SOC values
-    if self.soc < 5:
-        self.control_allow_discharge = 0
-    elif self.control_discharge_hys == True:
-        self.control_allow_discharge = 1        
-    if self.soc <= 10 and self.control_discharge_hys == True:
-        self.control_discharge_current = 5
-    elif 10 < self.soc <= 20 and self.control_discharge_hys == True:
-        self.control_discharge_current = self.max_discharge_current/2
-    elif self.control_discharge_hys == True:
-        self.control_discharge_current = self.max_discharge_current
+        state.control_allow_charge = 1
+    factor = self._charge_soc_curve(state.soc) if self._charge_soc_curve else 1.0
+    if self._charge_cell_curve:
+        factor = min(factor, self._charge_cell_curve(state.cell_now_max_voltage))
+    if self._charge_temperature_curve:
+        factor = min(factor, self._charge_temperature_curve(state.min_cell_temp), self._charge_temperature_curve(state.max_cell_temp))
+    state.control_charge_current = self._charge_limiter(now, self.max_charge_current * factor)
+        # Discharge depending on the curves of SoC, lowest cell and temperatures
+    if state.soc < 5:
+        state.control_allow_discharge = 0
+    elif state.control_discharge_hys == True:
+        state.control_allow_discharge = 1        
+    if state.control_discharge_hys == True:
+        factor = self._discharge_soc_curve(state.soc) if self._discharge_soc_curve else 1.0
+        if self._discharge_cell_curve:
+            factor = min(factor, self._discharge_cell_curve(state.cell_now_min_voltage))
+        if self._discharge_temperature_curve:
+            factor = min(factor, self._discharge_temperature_curve(state.min_cell_temp), self._discharge_temperature_curve(state.max_cell_temp))
+        state.control_discharge_current = self._discharge_limiter(now, self.max_discharge_current * factor)
     # Discharge depending on Low voltage has higher priority SoC could be a wrong estimation to avoid switching effects hysteresis is built in
-    if self.cell_now_min_voltage < self.min_cell_voltage:
-        self.control_allow_discharge = 0
-        self.control_discharge_current = 0
-        self.control_discharge_hys = False
-    elif self.cell_now_min_voltage > (self.min_cell_voltage + 0.15):
-        self.control_allow_discharge = 1
-        self.control_discharge_hys = True
+    if state.cell_now_min_voltage < self.min_cell_voltage:
+        state.control_allow_discharge = 0
+        state.control_discharge_current = 0
+        state.control_discharge_hys = False
+        # ramp up from 0 again once the cells recovered
+        self._discharge_limiter.reset(0, now)
+    elif state.cell_now_min_voltage > (self.min_cell_voltage + 0.15):
+        state.control_allow_discharge = 1
+        state.control_discharge_hys = True
 
         
   def _manage_charge_voltage(self):
-    voltageSum = 0
+    state = self.state
     if (self.cvcm_enable):
-       for i in range(self.number_of_cells):
-         voltage = self.cell_volt[i]
-         if voltage:
-            voltageSum+=voltage
-       if None == self.max_voltage_start_time:
-         if (self.max_cell_voltage * self.number_of_cells <= voltageSum) and (True == self.allow_max_voltage):
-            self.max_voltage_start_time = time.time()
+       # cell_voltage_sum comes from updateMinMaxCell of this cycle
+       voltageSum = state.cell_voltage_sum
+       if None == state.max_voltage_start_time:
+         if (self.max_cell_voltage * self.number_of_cells <= voltageSum) and (True == state.allow_max_voltage):
+            state.max_voltage_start_time = time.time()
          else:
-            if self.soc_level_reset_voltage > self.soc and not self.allow_max_voltage:
-               self.allow_max_voltage = True
+            if self.soc_level_reset_voltage > state.soc and not state.allow_max_voltage:
+               state.allow_max_voltage = True
        else:
-         tDiff = time.time() - self.max_voltage_start_time
+         tDiff = time.time() - state.max_voltage_start_time
          if self.max_voltage_time < tDiff:
-            self.max_voltage_start_time = None
-            self.allow_max_voltage = False
-    if self.allow_max_voltage:
-       self.control_voltage = self.max_cell_voltage * self.number_of_cells
+            state.max_voltage_start_time = None
+            state.allow_max_voltage = False
+    if state.allow_max_voltage:
+       cell_voltage = self.max_cell_voltage
     else:
-       self.control_voltage = self.float_cell_voltage * self.number_of_cells    
+       cell_voltage = self.float_cell_voltage
+    if self._charge_voltage_temperature_curve:
+       cell_voltage = min(cell_voltage, self._charge_voltage_temperature_curve(state.min_cell_temp),
+                          self._charge_voltage_temperature_curve(state.max_cell_temp))
+    state.control_voltage = cell_voltage * self.number_of_cells
  
  
-  def _update(self):   
+  def _schedulePoll(self):
+    interval = self._scheduler.getIntervalMs()
+    self._poll_due = time.monotonic() + interval / 1000.0
+    gobject.timeout_add(interval, self._update)
+
+
+  def _update(self):
+    if self._poll_due is not None:
+       self._perf.add('LoopDrift', time.monotonic() - self._poll_due)
+    if self._streamer is not None and self._streamer.connected:
+       # values arrive with the stream, keep the timer running to fall back if it drops
+       if self._stream_complete:
+          self._repeatSample()
+       self._schedulePoll()
+       return False
+    if self._fetcher is not None:
+       # never block the main loop on the network, the worker calls back when done
+       if not self._fetcher.request():
+          logging.debug("previous request to JK BMS still in flight, skipping poll")
+          self._schedulePoll()
+       return False
+    self._processJSONBMSData(self._getJSONBMSData())
+    self._schedulePoll()
+    # return false, the timer is one-shot and the next poll was scheduled with the interval of the scheduler
+    return False
+
+
+  def _deliverJSONBMSData(self, bms_data):
+    # called from the main loop via idle_add, returning False removes the idle source
+    self._processJSONBMSData(bms_data)
+    self._schedulePoll()
+    return False
+
+
+  def _deliverStreamFrame(self, frame):
+    # called from the main loop via idle_add for every frame of the stream
+    if frame is STREAM_CONNECTED:
+       # frames of a new connection may only carry changes, they are published once they add
+       # up to a complete document again
+       self._stream_data = {}
+       self._stream_complete = False
+       return False
+    if not isinstance(frame, dict):
+       return False
+    mergeJSONBMSData(self._stream_data, frame)
+    # wait until the frames gave us a complete document
+    if not self._stream_complete:
+       try:
+          self._mapping.extract(self._stream_data, self._sample, self.state.cell_volt)
+       except (KeyError, IndexError, TypeError, ValueError):
+          return False
+       self._stream_complete = True
+    self._processJSONBMSData(self._stream_data)
+    return False
+
+
+  def _publishSoc(self, voltage, current):
+    soc = self._countCharge(voltage, current, self.state.soc) if self._coulomb is not None else self.state.soc
+    publisher = self._publisher
+    publisher['/Soc'] = soc
+    publisher['/Capacity'] = round(float(self.installed_capacity) * soc / 100.0, 1)
+    publisher['/ConsumedAmphours'] = round(self.installed_capacity - publisher['/Capacity'], 1)
+
+
+  def _control(self, sample, current):
+    # the time dependent part of an update: current and voltage control, alarms
+    state = self.state
+    publisher = self._publisher
+    # Charge control
+    self._manage_charge_current()
+    publisher['/Info/MaxChargeCurrent'] = state.control_charge_current
+    publisher['/Info/MaxDischargeCurrent'] = state.control_discharge_current
+    # BMS "off" overrules "on/off" from this BMS control
+    if sample['Charge'] == "off":
+      publisher['/Io/AllowToCharge'] = 0
+    else:
+      publisher['/Io/AllowToCharge'] = state.control_allow_charge
+    # BMS "off" overrules "on/off" from this BMS control
+    if sample['Discharge'] == "off":
+      publisher['/Io/AllowToDischarge'] = 0
+    else:
+      publisher['/Io/AllowToDischarge'] = state.control_allow_discharge
+    # Voltage control
+    self._manage_charge_voltage()
+    publisher['/Info/MaxChargeVoltage'] = state.control_voltage
+    # Update the alarms
+    levels = self._alarms.evaluate(time.monotonic(), sample['Voltage'], current, state.soc,
+                                   state.cell_now_min_voltage, state.cell_now_max_voltage,
+                                   state.min_cell_temp, state.max_cell_temp)
+    for k in range(len(levels)):
+      publisher[self._alarms.paths[k]] = levels[k]
+    if self._alarms.last_duration > self._alarms.budget:
+      logging.warning("alarm evaluation took %.1f ms" % (self._alarms.last_duration * 1000))
+
+
+  def _repeatSample(self):
+    # the source has nothing new (304, a stream which only pushes changes), the last sample still
+    # holds. Counting, ramps, MaxVoltageTimeSec and the alarm delays go on with it
+    if self._stale or self.state.soc is None:
+      return
+    sample = self._sample
+    self._publishSoc(sample['Voltage'], sample['Current'])
+    self._control(sample, sample['Current'])
+    self._publisher.flush()
+
+
+  def _processJSONBMSData(self, bms_data):
     try:
-       #get data from JSON BMS
-       bms_data = self._getJSONBMSData()
+       if bms_data is NOT_MODIFIED:
+          self._scheduler.unchanged()
+          if self._stale:
+             # the document the 304 refers to is older than StaleTimeout, ask for a whole one
+             self._forgetValidators()
+             return True
+          self._repeatSample()
+          self._lastUpdate = time.time()
+          return True
        if bms_data == False:
+          self._scheduler.failure()
           logging.info("-- bms_data return is False in _update_")
-          if ((time.time() - self._lastUpdate) > 60):    
-            logging.info("-- shut down BMS")
-            logging.info((time.time() - self._lastUpdate))
+          self._checkStale()
           return True
-       for i in range(self.number_of_cells):   
-          self.cell_volt[i] = float(bms_data['Cell'][str(i)])
+       start = time.perf_counter()
+       sample = self._sample
+       state = self.state
+       publisher = self._publisher
+       self._mapping.extract(bms_data, sample, state.cell_volt)
+       extracted = time.perf_counter()
+       self._perf.add('Parse', self._decode_time + extracted - start)
+       self._decode_time = 0.0
        # Update SOC, DC and System items
-       self.soc = int(bms_data['Battery']['Percent_Remain'])   
-       self._dbusservice['/Soc'] = self.soc
-       self._dbusservice['/Dc/0/Voltage'] = round(float(bms_data['Battery']['Battery_Voltage']), 2)
-       self._dbusservice['/Dc/0/Current'] = round(float(bms_data['Battery']['Charge_Current']), 1)
-       self._dbusservice['/Dc/0/Power'] = round(float(bms_data['Battery']['Battery_Power']), 1)
-       self._dbusservice['/Dc/0/Temperature'] = round(float(bms_data['Battery']['Battery_T1']), 1)
-       self._dbusservice['/Capacity'] = round(float(float(self.installed_capacity) * float(self.soc) / 100.0) , 1)
-       self._dbusservice['/ConsumedAmphours'] = self.installed_capacity - self._dbusservice['/Capacity'] 
+       state.soc = sample['Soc']
+       current = sample['Current']
+       self._publishSoc(sample['Voltage'], current)
+       publisher['/Dc/0/Voltage'] = round(sample['Voltage'], 2)
+       publisher['/Dc/0/Current'] = round(current, 1)
+       publisher['/Dc/0/Power'] = round(sample['Power'], 1)
+       publisher['/Dc/0/Temperature'] = round(sample['Temperature1'], 1)
         # Update battery extras
-       self._dbusservice['/History/ChargeCycles'] = int(bms_data['Battery']['Cycle_Count'])
-       if float(bms_data['Battery']['Battery_T1']) < float(bms_data['Battery']['Battery_T2']):
-         self.min_cell_temp = float(bms_data['Battery']['Battery_T1'])
-         self.max_cell_temp = float(bms_data['Battery']['Battery_T2'])
+       publisher['/History/ChargeCycles'] = sample['ChargeCycles']
+       if sample['Temperature1'] < sample['Temperature2']:
+         state.min_cell_temp = sample['Temperature1']
+         state.max_cell_temp = sample['Temperature2']
        else: 
-         self.min_cell_temp = float(bms_data['Battery']['Battery_T2'])
-         self.max_cell_temp = float(bms_data['Battery']['Battery_T1'])
-       self._dbusservice['/System/MinCellTemperature'] = self.min_cell_temp
-       self._dbusservice['/System/MaxCellTemperature'] = self.max_cell_temp
+         state.min_cell_temp = sample['Temperature2']
+         state.max_cell_temp = sample['Temperature1']
+       publisher['/System/MinCellTemperature'] = state.min_cell_temp
+       publisher['/System/MaxCellTemperature'] = state.max_cell_temp
        # Updates from cells
-       self._get_min_max_cell()
-       self._dbusservice['/System/MinVoltageCellId'] = self.cell_min_id
-       self._dbusservice['/System/MaxVoltageCellId'] = self.cell_max_id
-       self._dbusservice['/System/MinCellVoltage'] = self.cell_now_min_voltage
-       self._dbusservice['/System/MaxCellVoltage'] = self.cell_now_max_voltage
-       # Charge control
-       self._manage_charge_current()   
-       self._dbusservice['/Info/MaxChargeCurrent'] = self.control_charge_current
-       self._dbusservice['/Info/MaxDischargeCurrent'] = self.control_discharge_current
-#       self._dbusservice['/History/TotalAhDrawn'] = self.battery.total_ah_drawn
-       # BMS "off" overrules "on/off" from this BMS control
-       if bms_data['Battery']['Charge'] == "off":
-         self._dbusservice['/Io/AllowToCharge'] = 0
-       else:
-         self._dbusservice['/Io/AllowToCharge'] = self.control_allow_charge
-       # BMS "off" overrules "on/off" from this BMS control
-       if bms_data['Battery']['Discharge'] == "off":
-         self._dbusservice['/Io/AllowToDischarge'] = 0
-       else:
-         self._dbusservice['/Io/AllowToDischarge'] = self.control_allow_discharge
-       # Voltage control
-       self._manage_charge_voltage()
-       self._dbusservice['/Info/MaxChargeVoltage'] = self.control_voltage
-
- # Alarm and Balancing still not part of JSON Files. Has to be updated
-#       self._dbusservice['/Balancing'] = 
-        # Update the alarms
-#       self._dbusservice['/Alarms/LowVoltage'] = 
-#        self._dbusservice['/Alarms/LowCellVoltage'] = 
-#        self._dbusservice['/Alarms/HighVoltage'] = 
-#        self._dbusservice['/Alarms/LowSoc'] = 
-#        self._dbusservice['/Alarms/HighChargeCurrent'] = 
-#        self._dbusservice['/Alarms/HighDischargeCurrent'] = 
-#        self._dbusservice['/Alarms/CellImbalance'] = 
-#        self._dbusservice['/Alarms/InternalFailure'] = 
-#        self._dbusservice['/Alarms/HighChargeTemperature'] = 
-#        self._dbusservice['/Alarms/LowChargeTemperature'] = 
-#        self._dbusservice['/Alarms/HighTemperature'] = 
-#        self._dbusservice['/Alarms/LowTemperature'] = 
+       state.updateMinMaxCell()
+       self._scheduler.sample(current, state.cell_volt, state.cell_now_max_voltage)
+       if self._history is not None:
+         self._updateHistory(current)
+       publisher['/System/MinVoltageCellId'] = state.cell_min_id
+       publisher['/System/MaxVoltageCellId'] = state.cell_max_id
+       publisher['/System/MinCellVoltage'] = state.cell_now_min_voltage
+       publisher['/System/MaxCellVoltage'] = state.cell_now_max_voltage
+       if self._stale:
+         # 0 A were published while stale, the limits ramp up from there again
+         now = time.monotonic()
+         self._charge_limiter.reset(0, now)
+         self._discharge_limiter.reset(0, now)
+       self._control(sample, current)
+
+ # Balancing still not part of JSON Files. Has to be updated
+#       publisher['/Balancing'] = 
        # cell voltages
-       voltage_sum = 0
+       cell_volt = state.cell_volt
        for i in range(self.number_of_cells):
-          cellpath = '/Voltages/Cell' + str(i+1)
-          voltage_sum = voltage_sum + self.cell_volt[i]  
-          self._dbusservice[cellpath] = self.cell_volt[i]
-       self._dbusservice['/Voltages/Sum'] = voltage_sum
-       self._dbusservice['/Voltages/Diff'] = self.cell_now_max_voltage - self.cell_now_min_voltage     
+          publisher[self._cell_paths[i]] = cell_volt[i]
+       publisher['/Voltages/Sum'] = state.cell_voltage_sum
+       publisher['/Voltages/Diff'] = state.cell_now_max_voltage - state.cell_now_min_voltage     
+       if self._recorder is not None:
+         self._recorder.add(time.time(), state.soc, sample['Voltage'], current, sample['Power'],
+                            state.min_cell_temp, state.max_cell_temp, state.control_charge_current,
+                            state.control_discharge_current, state.control_voltage,
+                            publisher['/Io/AllowToCharge'], publisher['/Io/AllowToDischarge'], state.cell_volt)
        # increment UpdateIndex - to show that new data is available
-       index = self._dbusservice['/UpdateIndex'] + 1  # increment index
+       index = publisher['/UpdateIndex'] + 1  # increment index
        if index > 255:   # maximum value of the index
          index = 0       # overflow from 255 to 0
-       self._dbusservice['/UpdateIndex'] = index
+       publisher['/UpdateIndex'] = index
+       if self._stale:
+         logging.info("-- BMS data valid again")
+         self._stale = False
+         publisher['/Connected'] = 1
+       # one batched ItemsChanged for everything that changed in this cycle
+       publish = time.perf_counter()
+       publisher.flush()
+       self._perf.add('Control', publish - extracted)
+       self._perf.add('Publish', time.perf_counter() - publish)
        #update lastupdate vars
        self._lastUpdate = time.time() 
-    except (ValueError, requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionError, requests.exceptions.JSONDecodeError):
+       self._perf.last_update = self._lastUpdate
+    except (ValueError, ConnectionError):
+       self._scheduler.failure()
        logging.info('Error getting data from BMS - check network or BMS status. Setting power values to 0')
-       if ((time.time() - self._lastUpdate) > 60):    
-         logging.info("-- shut down BMS") 
-         logging.info((time.time() - self._lastUpdate))
+       self._checkStale()
        return True        
     except Exception as e:
+       self._scheduler.failure()
        logging.critical('Error at %s', '_update_', exc_info=e)
        return True
-       
-    # return true, otherwise add_timeout will be removed from GObject - see docs http://library.isr.ist.utl.pt/docs/pygtk2reference/gobject-functions.html#function-gobject--timeout-add
     return True
  
   def _handlechangedvalue(self, path, value):
     logging.debug("someone else updated %s to %s" % (path, value))
     return True # accept the change
- 
+
+
+class DbusJSONBMSAggregateService:
+  # Virtual battery made of several packs in parallel, computed from the pack services of this process
+  def __init__(self, servicename, deviceinstance, packs, productname='JSON BMS Aggregate', connection='JK BMS HTTP JSON aggregate'):
+    self._dbusservice = VeDbusService("{}.aggregate_{:02d}".format(servicename, deviceinstance), bus=getDbusConnection())
+    # the same deadbands as the packs
+    self._publisher = DbusPublisher(self._dbusservice, packs[0].features.deadbands)
+    self.packs = packs
+    logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
+    addPaths(self._dbusservice, MANDATORY_PATHS, {
+      '/Mgmt/ProcessName': __file__,
+      '/Mgmt/ProcessVersion': 'Unkown version, and running on Python ' + platform.python_version(),
+      '/Mgmt/Connection': connection,
+      '/DeviceInstance': deviceinstance,
+      '/ProductId': 0x0,
+      '/ProductName': productname,
+      '/FirmwareVersion': 0.1,
+      '/HardwareVersion': 0,
+      '/Connected': 1,
+    }, writeable=False)
+    addPaths(self._dbusservice, AGGREGATE_PATHS, {
+      '/System/NrOfModulesOnline': 0,
+      '/System/NrOfModulesOffline': len(packs),
+      '/Io/AllowToCharge': 0,
+      '/Io/AllowToDischarge': 0,
+    })
+    addPaths(self._dbusservice, (('/UpdateIndex', None),), {'/UpdateIndex': 0}, writeable=False)
+    gobject.timeout_add(1000, self._update)
+
+
+  def _getOnlinePacks(self):
+    # a pack without valid data for its StaleTimeout does not count
+    return [pack for pack in self.packs if not pack._stale]
+
+
+  def _update(self):
+    try:
+      online = self._getOnlinePacks()
+      self._publisher['/System/NrOfModulesOnline'] = len(online)
+      self._publisher['/System/NrOfModulesOffline'] = len(self.packs) - len(online)
+      self._publisher['/Connected'] = 1 if online else 0
+      if not online:
+        # nothing we can vouch for, stop charging and discharging
+        self._publisher['/Io/AllowToCharge'] = 0
+        self._publisher['/Io/AllowToDischarge'] = 0
+        self._publisher.flush()
+        return True
+      installed_capacity = sum(pack.installed_capacity for pack in online)
+      capacity = sum(pack._publisher['/Capacity'] for pack in online)
+      self._publisher['/InstalledCapacity'] = installed_capacity
+      self._publisher['/Capacity'] = round(capacity, 1)
+      self._publisher['/ConsumedAmphours'] = round(installed_capacity - capacity, 1)
+      # capacity weighted so a small pack does not pull the SoC as much as a big one
+      self._publisher['/Soc'] = round(sum(pack._publisher['/Soc'] * pack.installed_capacity for pack in online) / float(installed_capacity), 1)
+      self._publisher['/Dc/0/Voltage'] = round(sum(pack._publisher['/Dc/0/Voltage'] for pack in online) / len(online), 2)
+      self._publisher['/Dc/0/Current'] = round(sum(pack._publisher['/Dc/0/Current'] for pack in online), 1)
+      self._publisher['/Dc/0/Power'] = round(sum(pack._publisher['/Dc/0/Power'] for pack in online), 1)
+      self._publisher['/Dc/0/Temperature'] = max(pack._publisher['/Dc/0/Temperature'] for pack in online)
+      self._publisher['/System/MinCellTemperature'] = min(pack.state.min_cell_temp for pack in online)
+      self._publisher['/System/MaxCellTemperature'] = max(pack.state.max_cell_temp for pack in online)
+      # cell ids are reported as P<pack>C<cell>, both counted from 1
+      min_pack = min(online, key=lambda pack: pack.state.cell_now_min_voltage)
+      max_pack = max(online, key=lambda pack: pack.state.cell_now_max_voltage)
+      self._publisher['/System/MinCellVoltage'] = min_pack.state.cell_now_min_voltage
+      self._publisher['/System/MinVoltageCellId'] = "P%dC%d" % (self.packs.index(min_pack) + 1, min_pack.state.cell_min_id + 1)
+      self._publisher['/System/MaxCellVoltage'] = max_pack.state.cell_now_max_voltage
+      self._publisher['/System/MaxVoltageCellId'] = "P%dC%d" % (self.packs.index(max_pack) + 1, max_pack.state.cell_max_id + 1)
+      # the most restrictive pack decides. The packs share the current in parallel, so its
+      # current limit counts once for every pack online
+      self._publisher['/Info/MaxChargeVoltage'] = min(pack._publisher['/Info/MaxChargeVoltage'] for pack in online)
+      self._publisher['/Info/MaxChargeCurrent'] = min(pack._publisher['/Info/MaxChargeCurrent'] for pack in online) * len(online)
+      self._publisher['/Info/MaxDischargeCurrent'] = min(pack._publisher['/Info/MaxDischargeCurrent'] for pack in online) * len(online)
+      self._publisher['/Io/AllowToCharge'] = min(pack._publisher['/Io/AllowToCharge'] for pack in online)
+      self._publisher['/Io/AllowToDischarge'] = min(pack._publisher['/Io/AllowToDischarge'] for pack in online)
+      # counters of all packs, an offline pack keeps its last value
+      for path in ('/History/TotalAhDrawn', '/History/ChargedEnergy', '/History/DischargedEnergy'):
+        values = [pack._publisher[path] for pack in self.packs if pack._publisher[path] is not None]
+        self._publisher[path] = round(sum(values), 2) if values else None
+      index = self._publisher['/UpdateIndex'] + 1
+      if index > 255:
+        index = 0
+      self._publisher['/UpdateIndex'] = index
+      self._publisher.flush()
+    except Exception as e:
+      logging.critical('Error at %s', '_update_aggregate_', exc_info=e)
+    return True
+
 
 
 def main():
@@ -417,6 +1271,9 @@ def main():
       from dbus.mainloop.glib import DBusGMainLoop
       # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
       DBusGMainLoop(set_as_default=True)
+      if sys.version_info.major == 2:
+        # python 2 gobject needs this before the fetch worker thread is started
+        gobject.threads_init()
      
       #formatting 
       _kwh = lambda p, v: (str(round(v, 2)) + ' KWh')
@@ -426,15 +1283,47 @@ def main():
       _v = lambda p, v: (str(round(v, 1)) + ' V') 
       _pr = lambda p , v:(str(round(v, 0)) + ' %')  
      
-      #start our main-service
-      bms_output = DbusJSONBMSService(
-        servicename='com.victronenergy.battery',
-        deviceinstance=40
-        )
+      #start our main-services, one per pack
+      config = getConfig()
+      # the sections shared by the packs, a wrong value stops here
+      features = ServiceConfig(config)
+      packs = getPackSections(config)
+      bms_outputs = []
+      for number, pack in enumerate(packs):
+        bms_outputs.append(DbusJSONBMSService(
+          servicename='com.victronenergy.battery',
+          deviceinstance=int(config[pack].get('DeviceInstance', 40 + number)),
+          pack=pack,
+          features=features
+          ))
+      # optional Prometheus text endpoint on localhost
+      if features.perf.metrics_port:
+        metrics = MetricsServer(features.perf.metrics_port)
+        metrics.packs.extend(bms_output._perf for bms_output in bms_outputs)
+        metrics.start()
+      if features.aggregate:
+        bms_aggregate = DbusJSONBMSAggregateService(
+          servicename='com.victronenergy.battery',
+          deviceinstance=features.aggregate_device_instance,
+          packs=bms_outputs
+          )
      
       logging.info('Connected to dbus, and switching over to gobject.MainLoop() (= event based)')
       mainloop = gobject.MainLoop()
-      mainloop.run()            
+
+      # svc -t and a normal shutdown send SIGTERM, the main loop ends and the packs are closed
+      def stop(*args):
+        logging.info("Stopping")
+        mainloop.quit()
+        return False
+      for signum in (signal.SIGTERM, signal.SIGINT):
+        if hasattr(gobject, 'unix_signal_add'):
+          gobject.unix_signal_add(gobject.PRIORITY_HIGH, signum, stop)
+        else:
+          signal.signal(signum, stop)
+      mainloop.run()
+      for bms_output in bms_outputs:
+        bms_output.close()
   except Exception as e:
     logging.critical('Error at %s', 'main', exc_info=e)
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Timing of the alarm engine on synthetic traces: delay, hysteresis, the separate alarm delay and
+# the charge temperature rules.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from bms_alarms import AlarmEngine, defaultThresholds
+
+# LowCellVoltage 3.0 / 2.8 V, hysteresis 0.1 V, delay 5 s
+LOW_CELL = '/Alarms/LowCellVoltage'
+
+
+class Trace:
+  # feeds one sample per second, the values of a normal idle battery unless given
+  def __init__(self):
+    self.engine = AlarmEngine(defaultThresholds(16, 50, 50))
+    self.time = 0.0
+
+  def run(self, seconds, path, current=0.0, min_cell=3.3, max_cell=3.31, min_temp=20.0, max_temp=22.0):
+    # returns the level of path after every sample
+    k = self.engine.paths.index(path)
+    levels = []
+    for i in range(seconds):
+      self.engine.evaluate(self.time, 16 * 3.3, current, 50, min_cell, max_cell, min_temp, max_temp)
+      levels.append(self.engine.levels[k])
+      self.time += 1.0
+    return levels
+
+
+class TestDelay(unittest.TestCase):
+  def test_warning_after_delay(self):
+    trace = Trace()
+    self.assertEqual(trace.run(8, LOW_CELL, min_cell=2.95), [0, 0, 0, 0, 0, 1, 1, 1])
+
+  def test_short_dip_is_ignored(self):
+    trace = Trace()
+    levels = trace.run(4, LOW_CELL, min_cell=2.95) + trace.run(1, LOW_CELL) + trace.run(4, LOW_CELL, min_cell=2.95)
+    self.assertEqual(levels, [0] * 9)
+
+  def test_alarm_delay_starts_at_the_alarm_threshold(self):
+    trace = Trace()
+    # warning condition from t=0, alarm condition from t=4
+    levels = trace.run(4, LOW_CELL, min_cell=2.95) + trace.run(8, LOW_CELL, min_cell=2.7)
+    # warning at t=5 after its own delay, alarm only at t=9, 5 s after 2.8 V was crossed
+    self.assertEqual(levels, [0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2])
+
+  def test_alarm_without_warning_first(self):
+    trace = Trace()
+    self.assertEqual(trace.run(7, LOW_CELL, min_cell=2.7), [0, 0, 0, 0, 0, 2, 2])
+
+  def test_no_delay(self):
+    trace = Trace()
+    # LowSoc has no delay
+    k = trace.engine.paths.index('/Alarms/LowSoc')
+    trace.engine.evaluate(0.0, 52.8, 0.0, 4, 3.3, 3.31, 20.0, 22.0)
+    self.assertEqual(trace.engine.levels[k], 2)
+
+
+class TestHysteresis(unittest.TestCase):
+  def test_cleared_below_threshold_minus_hysteresis(self):
+    trace = Trace()
+    trace.run(6, LOW_CELL, min_cell=2.95)
+    # back above 3.0 V, but not by more than 0.1 V
+    self.assertEqual(trace.run(3, LOW_CELL, min_cell=3.05), [1, 1, 1])
+    # cleared at once, without a delay
+    self.assertEqual(trace.run(2, LOW_CELL, min_cell=3.11), [0, 0])
+
+  def test_alarm_falls_back_to_warning(self):
+    trace = Trace()
+    trace.run(6, LOW_CELL, min_cell=2.7)
+    self.assertEqual(trace.run(2, LOW_CELL, min_cell=2.85), [2, 2])
+    self.assertEqual(trace.run(2, LOW_CELL, min_cell=2.95), [1, 1])
+    # rising again waits the delay of the alarm again
+    self.assertEqual(trace.run(6, LOW_CELL, min_cell=2.7), [1, 1, 1, 1, 1, 2])
+
+
+class TestChargeTemperature(unittest.TestCase):
+  def test_low_charge_temperature_only_while_charging(self):
+    # LowChargeTemperature 5 / 0 degrees, delay 10 s, LowTemperature 0 / -10 degrees
+    trace = Trace()
+    self.assertEqual(trace.run(15, '/Alarms/LowChargeTemperature', current=-20.0, min_temp=2.0), [0] * 15)
+    self.assertEqual(trace.run(15, '/Alarms/LowChargeTemperature', current=0.0, min_temp=2.0), [0] * 15)
+    self.assertEqual(trace.run(12, '/Alarms/LowChargeTemperature', current=10.0, min_temp=2.0), [0] * 10 + [1, 1])
+    self.assertEqual(trace.engine.levels[trace.engine.paths.index('/Alarms/LowTemperature')], 0)
+    # charging stops, the warning is cleared
+    self.assertEqual(trace.run(1, '/Alarms/LowChargeTemperature', current=-5.0, min_temp=2.0), [0])
+
+  def test_high_charge_temperature_only_while_charging(self):
+    # HighChargeTemperature 45 / 55 degrees, HighTemperature 50 / 60 degrees
+    trace = Trace()
+    self.assertEqual(trace.run(15, '/Alarms/HighChargeTemperature', current=-20.0, max_temp=47.0), [0] * 15)
+    self.assertEqual(trace.run(12, '/Alarms/HighChargeTemperature', current=20.0, max_temp=47.0), [0] * 10 + [1, 1])
+    self.assertEqual(trace.engine.levels[trace.engine.paths.index('/Alarms/HighTemperature')], 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# ServiceConfig: the shipped config.ini, the defaults without the optional sections and the
+# errors at start for unknown keys and values out of range.
+
+import os
+import sys
+import unittest
+import configparser
+
+TESTS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(TESTS, '..'))
+from bms_config import ServiceConfig
+
+SHIPPED = os.path.join(TESTS, '..', 'config.ini')
+OPTIONAL = ('POLL', 'HISTORY', 'RECORDER', 'COULOMB', 'ALARMS', 'PERF', 'DEADBAND')
+
+
+def readConfig():
+  config = configparser.ConfigParser()
+  config.read(SHIPPED)
+  return config
+
+
+class TestServiceConfig(unittest.TestCase):
+  def test_shipped_config(self):
+    features = ServiceConfig(readConfig())
+    self.assertEqual(features.poll.interval, 3.766)
+    self.assertFalse(features.history.enable)
+    self.assertEqual(features.recorder.file, 'recorder_{pack}.bin')
+    self.assertTrue(features.coulomb.enable)
+    self.assertEqual(features.alarms.budget, 0.002)
+    self.assertEqual(features.alarms.thresholds['LowCellVoltage'], (3.0, 2.8, 0.1, 5.0))
+    self.assertEqual(features.perf.metrics_port, 0)
+    # longest prefix first
+    self.assertEqual(features.deadbands[0], ('/system/mincellvoltage', 0.001))
+    self.assertIn(('/dc/0/current', 0.1), features.deadbands)
+    self.assertFalse(features.aggregate)
+    self.assertEqual(features.aggregate_device_instance, 39)
+
+  def test_defaults_without_the_optional_sections(self):
+    config = readConfig()
+    for section in OPTIONAL:
+      config.remove_section(section)
+    features = ServiceConfig(config)
+    self.assertEqual(features.poll.max_backoff, 120)
+    self.assertEqual(features.history.sample_interval, 10)
+    self.assertEqual(features.recorder.flush_interval, 300)
+    self.assertEqual(features.coulomb.max_gap, 30)
+    self.assertEqual(features.alarms.thresholds, {})
+    self.assertEqual(features.perf.interval, 10)
+    self.assertEqual(features.deadbands, [])
+
+  def assertFailsWith(self, section, key, value):
+    config = readConfig()
+    config[section][key] = value
+    self.assertRaises(ValueError, ServiceConfig, config)
+
+  def test_unknown_key(self):
+    self.assertFailsWith('POLL', 'MinIntervall', '1')
+    self.assertFailsWith('ALARMS', 'LowCellVoltag', '3.0, 2.8, 0.1, 5')
+    self.assertFailsWith('DEADBAND', 'Dc/0/Current', '0.1')
+
+  def test_invalid_value(self):
+    self.assertFailsWith('POLL', 'MinInterval', '0')
+    self.assertFailsWith('POLL', 'MaxInterval', '1')
+    self.assertFailsWith('HISTORY', 'SampleInterval', '-10')
+    self.assertFailsWith('RECORDER', 'Records', 'many')
+    self.assertFailsWith('COULOMB', 'Enable', 'maybe')
+    self.assertFailsWith('ALARMS', 'LowCellVoltage', '3.0, 2.8, 0.1')
+    self.assertFailsWith('ALARMS', 'BudgetMs', 'two')
+    self.assertFailsWith('PERF', 'MetricsPort', '70000')
+    self.assertFailsWith('DEADBAND', '/Dc/0/Current', '-0.1')
+    self.assertFailsWith('DEFAULT', 'Aggregate', 'sometimes')
+
+
+if __name__ == "__main__":
+  unittest.main()
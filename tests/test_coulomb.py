@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# The coulomb counter: trapezoidal integration, the split at a change of sign, gaps, the
+# fractional SoC and the state file.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from bms_coulomb import CoulombCounter, STATE
+
+
+class TestIntegration(unittest.TestCase):
+  def test_trapezoid(self):
+    counter = CoulombCounter(100, max_gap=3600)
+    # 10 A to 20 A over one hour at 50 V: 15 Ah, 750 Wh charged
+    counter.add(0.0, 50.0, 10.0, 50)
+    counter.add(3600.0, 50.0, 20.0, 50)
+    self.assertAlmostEqual(counter.charged_ah, 15.0)
+    self.assertAlmostEqual(counter.charged_wh, 750.0)
+    self.assertEqual(counter.discharged_ah, 0.0)
+
+  def test_split_at_change_of_sign(self):
+    counter = CoulombCounter(100, max_gap=3600)
+    # 30 A to -10 A over one hour crosses zero after 45 minutes
+    counter.add(0.0, 50.0, 30.0, 50)
+    counter.add(3600.0, 50.0, -10.0, 50)
+    self.assertAlmostEqual(counter.charged_ah, 30.0 * 0.75 / 2)
+    self.assertAlmostEqual(counter.discharged_ah, 10.0 * 0.25 / 2)
+    self.assertAlmostEqual(counter.charged_wh, 50.0 * 30.0 * 0.75 / 2)
+    self.assertAlmostEqual(counter.discharged_wh, 50.0 * 10.0 * 0.25 / 2)
+
+  def test_gap_is_not_counted(self):
+    counter = CoulombCounter(100, max_gap=30)
+    counter.add(0.0, 50.0, -36.0, 50)
+    counter.add(10.0, 50.0, -36.0, 50)
+    # failed fetches for 60 s
+    counter.add(70.0, 50.0, -36.0, 50)
+    counter.add(80.0, 50.0, -36.0, 50)
+    self.assertAlmostEqual(counter.discharged_ah, 36.0 * 20 / 3600)
+    self.assertEqual(counter.gaps, 1)
+
+  def test_repeat_holds_the_last_values(self):
+    counter = CoulombCounter(100)
+    counter.repeat(0.0, 50)
+    counter.add(0.0, 50.0, 18.0, 50)
+    counter.repeat(10.0, 50)
+    counter.repeat(20.0, 50)
+    self.assertAlmostEqual(counter.charged_ah, 18.0 * 20 / 3600)
+
+
+class TestSoc(unittest.TestCase):
+  def test_follows_the_counted_ah(self):
+    counter = CoulombCounter(100)
+    counter.add(0.0, 50.0, -20.0, 60)
+    self.assertEqual(counter.soc, 60.0)
+    # 20 A for 9 s is 0.05 Ah, 0.05 % of 100 Ah
+    for i in range(1, 11):
+      counter.add(i * 9.0, 50.0, -20.0, 60)
+    self.assertAlmostEqual(counter.soc, 59.5)
+
+  def test_stays_within_the_window_of_the_bms(self):
+    counter = CoulombCounter(10, soc_window=1.0)
+    counter.add(0.0, 50.0, 20.0, 60)
+    for i in range(1, 11):
+      counter.add(i * 20.0, 50.0, 20.0, 60)
+    self.assertEqual(counter.soc, 61.0)
+    # the BMS recalibrates
+    counter.add(220.0, 50.0, 0.0, 40)
+    self.assertEqual(counter.soc, 41.0)
+    counter.add(230.0, 50.0, 0.0, 100)
+    self.assertEqual(counter.soc, 99.0)
+
+
+class TestStateFile(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'coulomb_test.bin')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_restart_continues_from_the_last_save(self):
+    counter = CoulombCounter(100, self.filename, max_gap=3600, save_interval=300)
+    counter.add(0.0, 50.0, -10.0, 70)
+    counter.add(3600.0, 50.0, -10.0, 70)
+    self.assertFalse(counter.saveDue(3600.0))
+    self.assertTrue(counter.saveDue(3900.0))
+    counter.save(3900.0, 1.7e9)
+    self.assertEqual(os.path.getsize(self.filename), STATE.size)
+    self.assertFalse(os.path.exists(self.filename + '.tmp'))
+    restarted = CoulombCounter(100, self.filename)
+    self.assertEqual(restarted.discharged_ah, 10.0)
+    self.assertEqual(restarted.discharged_wh, 500.0)
+    # the saved SoC is used when the BMS agrees with it, otherwise the one of the BMS
+    restarted.add(0.0, 50.0, 0.0, 70)
+    self.assertEqual(restarted.soc, 69.0)
+    other = CoulombCounter(100, self.filename)
+    other.add(0.0, 50.0, 0.0, 80)
+    self.assertEqual(other.soc, 80.0)
+
+  def test_foreign_file_starts_from_zero(self):
+    with open(self.filename, 'wb') as f:
+      f.write(b'x' * STATE.size)
+    counter = CoulombCounter(100, self.filename)
+    self.assertEqual(counter.charged_ah, 0.0)
+    self.assertEqual(CoulombCounter(100, os.path.join(self.directory, 'missing.bin')).discharged_ah, 0.0)
+
+
+if __name__ == "__main__":
+  unittest.main()
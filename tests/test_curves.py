@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# The default current curves against the SoC steps of earlier versions, for several max currents.
+#
+#   python3 -m pytest tests   or   python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+import configparser
+
+TESTS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(TESTS, '..', 'bench'))
+sys.path.insert(1, os.path.join(TESTS, '..'))
+import bms_curves
+from compare_curves import compare
+
+MAX_CURRENTS = (10, 50, 100, 200, 350)
+
+
+class TestDefaultCurves(unittest.TestCase):
+  def assertMatchesSteps(self, charge_text, discharge_text):
+    for max_current in MAX_CURRENTS:
+      for soc, old_charge, charge, old_discharge, discharge in compare(charge_text, discharge_text, max_current, max_current):
+        if soc != int(soc):
+          # between whole SoC values the curves ramp instead of stepping
+          continue
+        self.assertAlmostEqual(charge, old_charge, places=6, msg="charge at SoC %g, %d A" % (soc, max_current))
+        self.assertAlmostEqual(discharge, old_discharge, places=6, msg="discharge at SoC %g, %d A" % (soc, max_current))
+
+  def test_builtin_defaults(self):
+    self.assertMatchesSteps(bms_curves.DEFAULT_CHARGE_CURRENT_SOC, bms_curves.DEFAULT_DISCHARGE_CURRENT_SOC)
+
+  def test_shipped_config(self):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(TESTS, '..', 'config.ini'))
+    battery = config['Battery']
+    self.assertMatchesSteps(battery['ChargeCurrentSoc'], battery['DischargeCurrentSoc'])
+
+  def test_near_empty_is_5A(self):
+    curve = bms_curves.compileCurve(bms_curves.DEFAULT_DISCHARGE_CURRENT_SOC, full=200)
+    self.assertAlmostEqual(200 * curve(10), 5)
+    self.assertAlmostEqual(200 * curve(0), 5)
+
+
+class TestParseCurve(unittest.TestCase):
+  def test_amps_are_factors_of_full(self):
+    self.assertEqual(bms_curves.parseCurve('0:1, 50:10A, 100:0.5', full=40), [(0.0, 1.0), (50.0, 0.25), (100.0, 0.5)])
+
+  def test_amps_need_full(self):
+    self.assertRaises(ValueError, bms_curves.parseCurve, '0:5A, 100:1')
+
+  def test_lookup_interpolates(self):
+    curve = bms_curves.compileCurve('0:0, 10:1, 20:1')
+    self.assertAlmostEqual(curve(5), 0.5)
+    self.assertEqual(curve(-5), 0.0)
+    self.assertEqual(curve(25), 1.0)
+
+
+if __name__ == "__main__":
+  unittest.main()
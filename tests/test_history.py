@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# CellHistory: the running statistics against a direct computation over the stored samples, also
+# while and after the sums are rebuilt, and the rebuild spread over several add() calls.
+
+import os
+import sys
+import math
+import random
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from bms_history import CellHistory, REBUILD_CHUNK
+
+CELLS = 4
+
+
+def direct(history):
+  # mean and deviation per cell and the imbalance slope from the stored samples
+  slots = range(history.count)
+  means = []
+  deviations = []
+  for i in range(CELLS):
+    values = [history.voltages[j * CELLS + i] for j in slots]
+    mean = sum(values) / len(values)
+    means.append(mean)
+    deviations.append(math.sqrt(sum((value - mean) ** 2 for value in values) / len(values)))
+  times = [history.times[j] for j in slots]
+  t_mean = sum(times) / len(times)
+  y = [history.imbalance[j] for j in slots]
+  y_mean = sum(y) / len(y)
+  slope = (sum((times[k] - t_mean) * (y[k] - y_mean) for k in range(len(times)))
+           / sum((t - t_mean) ** 2 for t in times) * 3600)
+  return means, deviations, slope
+
+
+class TestStatistics(unittest.TestCase):
+  def setUp(self):
+    random.seed(7)
+    # 1000 slots
+    self.history = CellHistory(CELLS, hours=10000 / 3600.0, sample_interval=10)
+    self.time = 0.0
+
+  def addSamples(self, count):
+    for k in range(count):
+      # the imbalance grows by 1 mV per hour
+      spread = 0.02 + self.time / 3600 * 0.001
+      cells = [3.3 + random.gauss(0, 0.002) for i in range(CELLS)]
+      cells[0] -= spread
+      self.assertTrue(self.history.add(self.time, cells, random.choice((-20.0, 0.0, 15.0)), 22.0))
+      self.time += 10.0
+
+  def checkStatistics(self):
+    history = self.history
+    means, deviations, slope = direct(history)
+    for i in range(CELLS):
+      self.assertAlmostEqual(history.mean(i), means[i], places=9)
+      self.assertAlmostEqual(history.stddev(i), deviations[i], places=6)
+    self.assertAlmostEqual(history.imbalanceSlope(), slope, places=6)
+
+  def test_before_the_first_wrap(self):
+    self.addSamples(500)
+    self.checkStatistics()
+
+  def test_during_and_after_rebuilds(self):
+    size = self.history.size
+    self.addSamples(size)
+    # the wrap starts the rebuild, one chunk per stored sample
+    self.assertEqual(self.history._rebuild_at, REBUILD_CHUNK)
+    chunks = (size + REBUILD_CHUNK - 1) // REBUILD_CHUNK
+    for k in range(chunks - 2):
+      self.addSamples(1)
+      self.assertIsNotNone(self.history._rebuild_at)
+      self.checkStatistics()
+    self.addSamples(1)
+    self.assertIsNone(self.history._rebuild_at)
+    self.checkStatistics()
+    self.addSamples(3 * size + 123)
+    self.checkStatistics()
+    self.assertAlmostEqual(self.history.imbalanceSlope(), 0.001, places=3)
+
+  def test_samples_within_the_interval_are_not_stored(self):
+    self.addSamples(1)
+    self.assertFalse(self.history.add(self.time - 5.0, [3.3] * CELLS, 0.0, 22.0))
+    self.assertEqual(self.history.count, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# JKBMSConnection and JKFrameDecoder against the JK BMS stand-in of bench/jk_simulator.py: frames in
+# pieces, with noise, with the echo of the request, with broken checksums and replayed from a
+# capture. jk_capture.hex holds two frames, one discharging at -3 degrees, one charging with
+# charging switched off in the BMS.
+
+import os
+import sys
+import logging
+import unittest
+from array import array
+
+TESTS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(TESTS, '..', 'bench'))
+import jk_simulator
+from bms_jk import JKBMSConnection, JKFrameDecoder, DATA_OFFSET
+
+CELLS = 16
+CAPTURE = os.path.join(TESTS, 'jk_capture.hex')
+
+
+def setUpModule():
+  logging.basicConfig(level=logging.CRITICAL + 1)
+
+
+class JKTestCase(unittest.TestCase):
+  mode = 'realistic'
+  capture = None
+
+  def setUp(self):
+    self.server = jk_simulator.start(mode=self.mode, cells=CELLS, capture=self.capture)
+    self.connection = JKBMSConnection('tcp://127.0.0.1:%d' % (self.server.server_address[1]), timeout=1)
+    self.decoder = JKFrameDecoder(CELLS)
+    self.sample = {}
+    self.cell_volt = array('d', [0.0]) * CELLS
+
+  def tearDown(self):
+    self.connection.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def read(self):
+    self.decoder.extract(self.connection.read(), self.sample, self.cell_volt)
+
+  def assertSent(self, document):
+    battery = document['Battery']
+    for k in range(CELLS):
+      self.assertAlmostEqual(self.cell_volt[k], document['Cell'][str(k)], places=3)
+    self.assertAlmostEqual(self.sample['Current'], battery['Charge_Current'], places=2)
+    self.assertEqual(self.sample['Current'] < 0, battery['Charge_Current'] < 0)
+    self.assertAlmostEqual(self.sample['Voltage'], battery['Battery_Voltage'], places=2)
+    self.assertEqual(self.sample['Soc'], battery['Percent_Remain'])
+    self.assertEqual(self.sample['ChargeCycles'], battery['Cycle_Count'])
+
+  def checkReads(self, count):
+    for i in range(count):
+      self.read()
+      self.assertSent(self.server.document)
+    self.assertEqual(self.connection.corrupted, 0)
+
+
+class TestPartial(JKTestCase):
+  mode = 'partial'
+
+  def test_frame_in_pieces(self):
+    self.checkReads(20)
+
+
+class TestEcho(JKTestCase):
+  mode = 'echo'
+
+  def test_echo_of_the_request_is_skipped(self):
+    self.checkReads(20)
+
+
+class TestNoisy(JKTestCase):
+  mode = 'noisy'
+
+  def test_noise_and_truncated_frame_are_skipped(self):
+    for i in range(20):
+      self.read()
+      self.assertSent(self.server.document)
+
+
+class TestCorrupted(JKTestCase):
+  mode = 'corrupted'
+
+  def test_broken_checksum_is_counted_and_skipped(self):
+    # every 4th answer of a connection is broken, the read fails and the next one reconnects
+    failed = 0
+    for i in range(12):
+      try:
+        self.read()
+      except (OSError, ValueError):
+        failed += 1
+        self.connection.close()
+        continue
+      self.assertSent(self.server.document)
+    self.assertEqual(failed, 3)
+    self.assertEqual(self.connection.corrupted, 3)
+
+
+class TestReplay(JKTestCase):
+  mode = 'replay'
+  capture = CAPTURE
+
+  def test_captured_frames(self):
+    # the stand-in answers with the captured frames round robin, starting with the second
+    self.read()
+    self.assertEqual(list(self.cell_volt), [round(3.320 + k * 0.001, 3) for k in range(CELLS)])
+    self.assertAlmostEqual(self.sample['Current'], 12.5)
+    self.assertAlmostEqual(self.sample['Voltage'], 53.12)
+    self.assertEqual(self.sample['Soc'], 58)
+    self.assertEqual(self.sample['Charge'], 'off')
+    self.assertEqual(self.sample['Discharge'], 'on')
+    self.read()
+    self.assertEqual(list(self.cell_volt), [round(3.301 + k * 0.001, 3) for k in range(CELLS)])
+    self.assertAlmostEqual(self.sample['Current'], -23.45)
+    self.assertAlmostEqual(self.sample['Power'], 52.9 * -23.45)
+    self.assertEqual(self.sample['Soc'], 57)
+    self.assertEqual(self.sample['Temperature1'], 21.0)
+    self.assertEqual(self.sample['Temperature2'], -3.0)
+    self.assertEqual(self.sample['Charge'], 'on')
+    self.assertEqual(self.connection.corrupted, 0)
+
+
+class TestDecoder(unittest.TestCase):
+  def test_missing_cell_is_an_error(self):
+    with open(CAPTURE) as f:
+      frame = bytes.fromhex(f.readline())
+    decoder = JKFrameDecoder(CELLS + 1)
+    with self.assertRaises(ValueError):
+      decoder.extract(memoryview(frame), {}, array('d', [0.0]) * (CELLS + 1))
+
+  def test_offset_encoding_of_older_firmware(self):
+    document = jk_simulator.simulator.BatteryModel(CELLS).step()
+    frame = bytearray(jk_simulator.encodeFrame(document, CELLS))
+    # current field 0x84 as older firmware sends it: 10000 + current in 10 mA, 8000 is -20 A
+    position = DATA_OFFSET + 2 + 3 * CELLS + 4 * 3
+    self.assertEqual(frame[position], 0x84)
+    frame[position + 1:position + 3] = (8000).to_bytes(2, 'big')
+    sample = {}
+    JKFrameDecoder(CELLS, 'Offset').extract(memoryview(frame), sample, array('d', [0.0]) * CELLS)
+    self.assertAlmostEqual(sample['Current'], -20.0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+# The fixed-size timing windows of bms_perf.
+
+import os
+import sys
+import unittest
+import threading
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from bms_perf import PerfWindow
+
+
+class TestPerfWindow(unittest.TestCase):
+  def test_wraps_around(self):
+    window = PerfWindow(4)
+    for value in range(1, 11):
+      window.add(float(value))
+    self.assertEqual(window.count, 4)
+    self.assertEqual(sorted(window.values), [7.0, 8.0, 9.0, 10.0])
+    self.assertEqual(window.summary(), (8.0, 9.0, 10.0))
+
+  def test_adds_from_several_threads(self):
+    # the latency of a source is added from the threads of a hedged fetch
+    window = PerfWindow(7)
+
+    def add():
+      for i in range(20000):
+        window.add(0.001)
+    threads = [threading.Thread(target=add) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertTrue(0 <= window.position < window.size)
+    self.assertEqual(window.count, window.size)
+    window.add(0.002)
+    self.assertEqual(window.summary()[2], 0.002)
+
+
+if __name__ == "__main__":
+  unittest.main()
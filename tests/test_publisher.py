@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# DbusPublisher: deadbands per path prefix, steps of exactly one deadband, one ItemsChanged per flush
+# and the counts of published and suppressed values.
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(TESTS, '..', 'bench'))
+import standins
+from bench_update import makeConfig
+
+module = standins.loadService(makeConfig(0, 'realistic', 2))
+
+DEADBANDS = [('/voltages', 0.001), ('/dc/0/voltage', 0.01), ('/dc/0/current', 0.1)]
+
+
+def createPublisher(values):
+  service = standins.VeDbusService('com.victronenergy.battery.test')
+  for path, value in values.items():
+    service.add_path(path, value)
+  return service, module.DbusPublisher(service, DEADBANDS)
+
+
+class TestDeadband(unittest.TestCase):
+  def checkSteps(self, path, start, step, digits, count):
+    service, publisher = createPublisher({path: round(start, digits)})
+    for i in range(1, count + 1):
+      value = round(start + i * step, digits)
+      publisher[path] = value
+      publisher.flush()
+      self.assertEqual(service[path], value)
+    self.assertEqual(publisher.published_count, count)
+    self.assertEqual(publisher.suppressed_count, 0)
+
+  def test_step_of_one_deadband_is_published(self):
+    self.checkSteps('/Dc/0/Current', 0.2, 0.1, 1, 2000)
+    self.checkSteps('/Dc/0/Current', -100.0, 0.1, 1, 2000)
+    self.checkSteps('/Voltages/Cell1', 2.8, 0.001, 3, 600)
+    self.checkSteps('/Dc/0/Voltage', 40.0, 0.01, 2, 2000)
+
+  def test_smaller_change_is_suppressed(self):
+    service, publisher = createPublisher({'/Dc/0/Current': 0.2})
+    publisher['/Dc/0/Current'] = 0.25
+    publisher.flush()
+    self.assertEqual(service['/Dc/0/Current'], 0.2)
+    self.assertEqual(publisher['/Dc/0/Current'], 0.25)
+    self.assertEqual(publisher.suppressed_count, 1)
+    # compared with the last published value, not the last value set
+    publisher['/Dc/0/Current'] = 0.3
+    publisher.flush()
+    self.assertEqual(service['/Dc/0/Current'], 0.3)
+    self.assertEqual(publisher.published_count, 1)
+
+  def test_path_without_deadband_publishes_every_change(self):
+    service, publisher = createPublisher({'/Soc': 50.0, '/Info/ChargeRequest': None})
+    publisher['/Soc'] = 50.01
+    publisher['/Info/ChargeRequest'] = 1
+    publisher.flush()
+    self.assertEqual(service['/Soc'], 50.01)
+    self.assertEqual(service['/Info/ChargeRequest'], 1)
+
+
+class TestFlush(unittest.TestCase):
+  def test_one_signal_per_flush(self):
+    service, publisher = createPublisher({'/Dc/0/Current': 0.0, '/Dc/0/Voltage': 52.0, '/Voltages/Cell1': 3.3})
+    publisher['/Dc/0/Current'] = 5.0
+    publisher['/Dc/0/Voltage'] = 52.5
+    publisher['/Voltages/Cell1'] = 3.31
+    self.assertEqual(service.writes, 0)
+    publisher.flush()
+    self.assertEqual(service.writes, 3)
+    self.assertEqual(service.signals, 1)
+    # nothing changed, nothing sent
+    publisher['/Dc/0/Current'] = 5.0
+    publisher.flush()
+    self.assertEqual(service.writes, 3)
+    self.assertEqual(service.signals, 1)
+
+  def test_change_undone_before_flush_is_not_sent(self):
+    service, publisher = createPublisher({'/Dc/0/Current': 0.0})
+    publisher['/Dc/0/Current'] = 5.0
+    publisher['/Dc/0/Current'] = 0.0
+    publisher.flush()
+    self.assertEqual(service.writes, 0)
+    self.assertEqual(publisher.published_count, 0)
+    self.assertEqual(publisher.suppressed_count, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# The recorder: records reach the file on close (the service closes it on SIGTERM), the ring
+# wraps, and --from/--to select by timestamp also when the clock was set during the recording.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+TESTS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(TESTS, '..', 'bench'))
+import standins
+from bench_update import makeConfig
+from bms_recorder import Recorder, RecorderReader
+
+CELLS = [3.3, 3.31, 3.32, 3.29]
+
+
+def addRecords(recorder, timestamps):
+  for timestamp in timestamps:
+    recorder.add(timestamp, 50, 13.2, -4.5, -59.4, 20.0, 21.0, 50, 50, 13.8, 1, 1, CELLS)
+
+
+class RecorderTestCase(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'recorder_test.bin')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def timestamps(self, start=None, end=None):
+    return [values[0] for values in RecorderReader(self.filename).records(start, end)]
+
+
+class TestRecorder(RecorderTestCase):
+  def test_close_writes_the_batch(self):
+    recorder = Recorder(self.filename, len(CELLS), capacity=100, flush_interval=300)
+    addRecords(recorder, [1.7e9 + k for k in range(10)])
+    self.assertEqual(self.timestamps(), [])
+    recorder.close()
+    self.assertEqual(self.timestamps(), [1.7e9 + k for k in range(10)])
+
+  def test_ring_keeps_the_newest_records(self):
+    recorder = Recorder(self.filename, len(CELLS), capacity=100, flush_interval=300, batch_records=16)
+    addRecords(recorder, [1.7e9 + k for k in range(250)])
+    recorder.close()
+    self.assertEqual(self.timestamps(), [1.7e9 + k for k in range(150, 250)])
+    self.assertEqual(self.timestamps(1.7e9 + 200, 1.7e9 + 210), [1.7e9 + k for k in range(200, 210)])
+
+  def test_range_after_the_clock_was_set(self):
+    # booted with a wrong clock a few years ahead, NTP sets it back after 30 records
+    boot = [1.8e9 + k for k in range(30)]
+    synced = [1.7e9 + k for k in range(70)]
+    recorder = Recorder(self.filename, len(CELLS), capacity=100, flush_interval=300)
+    addRecords(recorder, boot + synced)
+    recorder.close()
+    self.assertEqual(self.timestamps(1.7e9 + 10, 1.7e9 + 20), synced[10:20])
+    self.assertEqual(self.timestamps(1.8e9 + 5, 1.8e9 + 8), boot[5:8])
+    self.assertEqual(self.timestamps(1.7e9 + 60, 1.75e9), synced[60:])
+
+
+class TestServiceClose(RecorderTestCase):
+  def test_close_saves_recorder_and_counters(self):
+    config = makeConfig(0, 'realistic', len(CELLS))
+    config['RECORDER']['Enable'] = 'True'
+    config['RECORDER']['File'] = self.filename
+    config['COULOMB']['File'] = os.path.join(self.directory, 'coulomb_test.bin')
+    module = standins.loadService(config)
+    service = module.DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+    bms_data = {
+      'Battery': {'Percent_Remain': 50, 'Battery_Voltage': 13.22, 'Charge_Current': -4.5, 'Battery_Power': -59.5,
+                  'Battery_T1': 20.0, 'Battery_T2': 21.0, 'Cycle_Count': 3, 'Charge': 'on', 'Discharge': 'on'},
+      'Cell': dict((str(i), CELLS[i]) for i in range(len(CELLS))),
+    }
+    for k in range(5):
+      service._processJSONBMSData(bms_data)
+    self.assertEqual(self.timestamps(), [])
+    self.assertFalse(os.path.exists(config['COULOMB']['File']))
+    service.close()
+    self.assertEqual(len(self.timestamps()), 5)
+    self.assertTrue(os.path.exists(config['COULOMB']['File']))
+
+
+if __name__ == "__main__":
+  unittest.main()
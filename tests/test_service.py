@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+# The pack service against the local BMS simulator, with the Venus OS stand-ins of bench/standins.py.
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+TESTS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(TESTS, '..', 'bench'))
+import standins
+import simulator
+from bench_update import makeConfig
+
+
+def setUpModule():
+  global server
+  logging.basicConfig(level=logging.CRITICAL + 1)
+  server = simulator.start()
+
+
+def tearDownModule():
+  server.shutdown()
+  server.server_close()
+
+
+def url(mode, cells=8, delay=0.2):
+  return '127.0.0.1:%d/%s?cells=%d&delay=%g' % (server.server_port, mode, cells, delay)
+
+
+def createService(mode, cells=8, hosts=None, **defaults):
+  config = makeConfig(server.server_port, mode, cells)
+  config['COULOMB']['Enable'] = 'False'
+  if hosts:
+    config['ONPREMISE']['Host'] = ','.join(hosts)
+  for key, value in defaults.items():
+    config['DEFAULT'][key] = value
+  module = standins.loadService(config)
+  return module.DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+
+
+def expire(service):
+  # as if no valid data had arrived for StaleTimeout seconds
+  service._lastUpdate -= service.stale_timeout + 1
+  service._checkStale()
+
+
+class TestPaths(unittest.TestCase):
+  def test_management_paths_are_read_only(self):
+    service = createService('realistic')
+    writeable = service._dbusservice.writeable
+    management = [path for path in writeable if path.startswith('/Mgmt/')]
+    self.assertIn('/Mgmt/Perf/Fetch/P95', management)
+    self.assertIn('/Mgmt/Perf/DataAge', management)
+    self.assertEqual([path for path in management if writeable[path]], [])
+    self.assertTrue(writeable['/Info/MaxChargeCurrent'])
+
+
+class TestThreadFetch(unittest.TestCase):
+  def test_main_loop_stays_responsive_while_fetching(self):
+    # FetchMode = Thread against a BMS answering after 1 s, the test is the main loop
+    service = createService('slow', FetchMode='Thread')
+    service._sources[0].url = service._sources[0].url.replace('delay=0.2', 'delay=1')
+    dbusservice = service._dbusservice
+    start = time.perf_counter()
+    service._update()
+    self.assertLess(time.perf_counter() - start, 0.05)
+    # while the request is in flight: dbus reads, further polls and timers do not wait for it
+    slowest = 0.0
+    last = time.perf_counter()
+    while time.perf_counter() - start < 0.8:
+      self.assertEqual(dbusservice['/UpdateIndex'], 0)
+      dbusservice['/Soc']
+      service._update()
+      now = time.perf_counter()
+      slowest = max(slowest, now - last)
+      last = now
+      time.sleep(0.01)
+    self.assertLess(slowest, 0.05)
+    self.assertFalse(standins.GLib.iteration())
+    # the result comes back through idle_add and is processed in the main loop
+    self.assertTrue(standins.GLib.iteration(timeout=3))
+    self.assertEqual(dbusservice['/UpdateIndex'], 1)
+    self.assertEqual(dbusservice['/Connected'], 1)
+    self.assertEqual(dbusservice['/System/NrOfCellsPerBattery'], 8)
+    self.assertGreater(service._perf.windows['Fetch'].summary()[0], 0.9)
+
+
+class TestStale(unittest.TestCase):
+  def test_recovers_from_a_source_answering_304(self):
+    service = createService('static')
+    service._update()
+    service._update()
+    self.assertEqual(service._sources[0].etag, '"static-8"')
+    self.assertFalse(service._stale)
+    expire(service)
+    self.assertTrue(service._stale)
+    self.assertEqual(service._dbusservice['/Connected'], 0)
+    self.assertEqual(service._dbusservice['/Info/MaxChargeCurrent'], 0)
+    service._update()
+    self.assertFalse(service._stale)
+    self.assertEqual(service._dbusservice['/Connected'], 1)
+    self.assertGreater(service._dbusservice['/Info/MaxChargeCurrent'], 0)
+
+  def test_304_while_stale_is_not_fresh_data(self):
+    service = createService('static')
+    service._update()
+    expire(service)
+    last_update = service._lastUpdate
+    # a request which was sent with the old ETag before the pack went stale
+    service._sources[0].etag = '"static-8"'
+    service._processJSONBMSData(service._fetchSource(service._sources[0]))
+    self.assertTrue(service._stale)
+    self.assertEqual(service._lastUpdate, last_update)
+    self.assertIsNone(service._sources[0].etag)
+
+  def test_limits_ramp_up_after_stale(self):
+    # CurrentRampUp = 2 A/s, both limits are 50 A at the SoC of the simulator
+    service = createService('realistic')
+    dbusservice = service._dbusservice
+    service._update()
+    # the service starts stale, so the limits ramp up at start as well
+    self.assertLess(dbusservice['/Info/MaxChargeCurrent'], 0.1)
+    # as if it had been running for a while
+    service._charge_limiter.reset(50, time.monotonic())
+    service._discharge_limiter.reset(50, time.monotonic())
+    service._update()
+    self.assertEqual(dbusservice['/Info/MaxChargeCurrent'], 50)
+    expire(service)
+    self.assertEqual(dbusservice['/Info/MaxChargeCurrent'], 0)
+    service._update()
+    self.assertEqual(dbusservice['/Connected'], 1)
+    self.assertLess(dbusservice['/Info/MaxChargeCurrent'], 0.1)
+    self.assertLess(dbusservice['/Info/MaxDischargeCurrent'], 0.1)
+    time.sleep(0.5)
+    service._update()
+    self.assertGreater(dbusservice['/Info/MaxChargeCurrent'], 0.9)
+    self.assertLess(dbusservice['/Info/MaxChargeCurrent'], 1.5)
+    self.assertLess(dbusservice['/Info/MaxDischargeCurrent'], 1.5)
+
+
+class TestAggregate(unittest.TestCase):
+  def test_cell_ids_are_counted_from_1(self):
+    packs = [createService('realistic'), createService('realistic', cells=16)]
+    for pack in packs:
+      pack._update()
+    config = makeConfig(server.server_port, 'realistic', 8)
+    config['COULOMB']['Enable'] = 'False'
+    module = standins.loadService(config)
+    aggregate = module.DbusJSONBMSAggregateService(servicename='com.victronenergy.battery', deviceinstance=39, packs=packs)
+    aggregate._update()
+    dbusservice = aggregate._dbusservice
+    self.assertEqual(dbusservice['/System/NrOfModulesOnline'], 2)
+    # a pack publishes the index of the cell, the aggregate P<pack>C<cell>
+    ids = ['P%dC%d' % (k + 1, pack._dbusservice['/System/MinVoltageCellId'] + 1) for k, pack in enumerate(packs)]
+    self.assertIn(dbusservice['/System/MinVoltageCellId'], ids)
+    ids = ['P%dC%d' % (k + 1, pack._dbusservice['/System/MaxVoltageCellId'] + 1) for k, pack in enumerate(packs)]
+    self.assertIn(dbusservice['/System/MaxVoltageCellId'], ids)
+
+
+class TestNotModified(unittest.TestCase):
+  def test_control_goes_on_while_the_source_answers_304(self):
+    config = makeConfig(server.server_port, 'static', 8)
+    config['COULOMB']['Enable'] = 'False'
+    battery = config['Battery']
+    # the cells of the simulator are above MaxCellVoltage, after 1 s the charge voltage drops to float
+    battery['MaxCellVoltage'] = '3.0'
+    battery['FloatCellVoltage'] = '2.9'
+    battery['MaxVoltageTimeSec'] = '1'
+    battery['SOCLevelToResetVoltageLimit'] = '0'
+    service = standins.loadService(config).DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+    service._update()
+    self.assertIsNotNone(service.state.max_voltage_start_time)
+    self.assertAlmostEqual(service._dbusservice['/Info/MaxChargeVoltage'], 24.0)
+    for i in range(3):
+      time.sleep(0.5)
+      service._update()
+    self.assertEqual(service._sources[0].etag, '"static-8"')
+    self.assertEqual(service._dbusservice['/UpdateIndex'], 1)
+    self.assertIsNone(service.state.max_voltage_start_time)
+    self.assertFalse(service.state.allow_max_voltage)
+    self.assertAlmostEqual(service._dbusservice['/Info/MaxChargeVoltage'], 23.2)
+
+
+class TestHedge(unittest.TestCase):
+  def test_hanging_primary_gets_one_request(self):
+    service = createService('realistic', hosts=(url('slow', delay=2), url('realistic')))
+    primary = service._sources[0]
+    # as if the primary usually answered within 50 ms
+    for i in range(10):
+      primary.latency.add(0.05)
+    running = {}
+    most = {}
+    fetch = service._fetchSource
+
+    def countingFetch(source):
+      running[source.url] = running.get(source.url, 0) + 1
+      most[source.url] = max(most.get(source.url, 0), running[source.url])
+      try:
+        return fetch(source)
+      finally:
+        running[source.url] -= 1
+    service._fetchSource = countingFetch
+    # polls much faster than the primary answers, every one is served by the secondary in time
+    for i in range(8):
+      start = time.perf_counter()
+      bms_data = service._getJSONBMSData()
+      self.assertIsInstance(bms_data, dict)
+      self.assertLess(time.perf_counter() - start, 0.5)
+    self.assertEqual(most[primary.url], 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
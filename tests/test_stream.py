@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# AccessType Stream against the SSE and NDJSON streams of bench/simulator.py: partial frames are
+# merged into the document, and a new connection starts a new document.
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+TESTS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(TESTS, '..', 'bench'))
+import standins
+import simulator
+from bench_update import makeConfig
+
+
+def setUpModule():
+  global server
+  logging.basicConfig(level=logging.CRITICAL + 1)
+  server = simulator.start()
+
+
+def tearDownModule():
+  server.shutdown()
+  server.server_close()
+
+
+def createStreamService(protocol, query):
+  config = makeConfig(server.server_port, 'realistic', 8)
+  config['COULOMB']['Enable'] = 'False'
+  config['DEFAULT']['AccessType'] = 'Stream'
+  config['ONPREMISE']['StreamUrl'] = 'http://127.0.0.1:%d/%s?cells=8&%s' % (server.server_port, protocol.lower(), query)
+  config['ONPREMISE']['StreamProtocol'] = protocol
+  config['ONPREMISE']['StreamReconnectDelay'] = '0.1'
+  module = standins.loadService(config)
+  service = module.DbusJSONBMSService(servicename='com.victronenergy.battery', deviceinstance=40)
+  # (connection, frame) of every document published
+  service.published = []
+  process = service._processJSONBMSData
+
+  def recordingProcess(bms_data):
+    service.published.append((bms_data['Stream']['connection'], bms_data['Stream']['frame']))
+    current = bms_data['Battery']['Charge_Current']
+    result = process(bms_data)
+    service.published_current = current
+    return result
+  service._processJSONBMSData = recordingProcess
+  return service
+
+
+def runUntil(service, last, timeout=5):
+  # the test is the main loop: runs the idle callbacks until (connection, frame) last was published
+  deadline = time.monotonic() + timeout
+  while last not in service.published and time.monotonic() < deadline:
+    standins.GLib.iteration(timeout=0.2)
+
+
+def drain():
+  # what is still queued of a stream when a test is done
+  while standins.GLib.iteration(timeout=0.2):
+    pass
+
+
+class TestStream(unittest.TestCase):
+  def checkReconnect(self, protocol):
+    # every 3rd frame is a whole document, each connection closes after 5 frames
+    service = createStreamService(protocol, 'name=%s&frames=5&full=3&interval=0.02&connections=2' % (protocol))
+    runUntil(service, (2, 5))
+    drain()
+    # frames 1 and 2 of a connection only carry changes, on their own they are no document,
+    # neither before the first whole one nor merged into the document of the last connection
+    self.assertEqual(service.published, [(1, 3), (1, 4), (1, 5), (2, 3), (2, 4), (2, 5)])
+    # the changes of a partial frame are published
+    self.assertEqual(service._dbusservice['/Dc/0/Current'], round(service.published_current, 1))
+    self.assertEqual(service._dbusservice['/Connected'], 1)
+    self.assertEqual(service._dbusservice['/UpdateIndex'], 6)
+
+  def test_sse(self):
+    self.checkReconnect('SSE')
+
+  def test_ndjson(self):
+    self.checkReconnect('NDJSON')
+
+  def test_partial_frame_after_outage_does_not_revive_a_stale_pack(self):
+    service = createStreamService('SSE', 'name=stale&frames=4&full=3&interval=0.02&connections=2')
+    runUntil(service, (1, 4))
+    # no valid data for StaleTimeout, then the stream comes back with partial frames
+    service._lastUpdate -= service.stale_timeout + 1
+    service._checkStale()
+    self.assertEqual(service._dbusservice['/Connected'], 0)
+    deadline = time.monotonic() + 5
+    while (2, 3) not in service.published and time.monotonic() < deadline:
+      standins.GLib.iteration(timeout=0.2)
+      if (2, 3) not in service.published:
+        self.assertEqual(service._dbusservice['/Connected'], 0)
+    self.assertEqual(service._dbusservice['/Connected'], 1)
+    runUntil(service, (2, 4))
+    drain()
+
+
+class TestMerge(unittest.TestCase):
+  def test_partial_frame_replaces_only_its_values(self):
+    module = standins.loadService(makeConfig(0, 'realistic', 2))
+    document = {'Battery': {'Charge_Current': 1.0, 'Battery_Voltage': 53.2}, 'Cell': {'0': 3.3, '1': 3.31}}
+    module.mergeJSONBMSData(document, {'Battery': {'Charge_Current': -4.5}, 'Cell': {'1': 3.29}})
+    self.assertEqual(document, {'Battery': {'Charge_Current': -4.5, 'Battery_Voltage': 53.2}, 'Cell': {'0': 3.3, '1': 3.29}})
+
+
+if __name__ == "__main__":
+  unittest.main()